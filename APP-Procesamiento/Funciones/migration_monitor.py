@@ -0,0 +1,173 @@
+import json
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class MigrationMonitor:
+    """Progress, timing and throughput instrumentation of a migration. Every measurement is sent as an event to the
+    callbacks and appended as a JSON line to the log file, so the GUI and the batch jobs follow a migration without
+    parsing its console output. Events are dicts with the event name under 'event' and the seconds since the monitor
+    was created under 'time':
+      start: Title and parameters of the migration.
+      stage: Name and duration [s] of a finished stage (load, half-derivative, tables, summation or write).
+      progress: Work units done, total and their unit, seconds since the summation started, estimated seconds left and
+        migrated voxels per second.
+      summary: Duration of every stage [s], total time [s], voxels, voxels per second of the summation, workers and
+        their utilisation (fraction of the summation time the workers were busy, None if it is not measured).
+    """
+
+    def __init__(self, callbacks=None, log_file=None, verbose=True, print_interval=5.0):
+        """Creates the monitor of a migration
+        Args:
+          callbacks (list callable): Functions called with every event.
+          log_file (string): Path of the JSON lines file the events are appended to (no log if not given).
+          verbose (bool): Whether the progress and the summary are printed to the console.
+          print_interval (float): Minimum time between two progress lines printed to the console [s].
+        """
+        self.callbacks = list(callbacks) if callbacks is not None else []
+        self.log_file = log_file
+        self.verbose = verbose
+        self.print_interval = print_interval
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.voxels = 0
+        self.workers = None
+        self.busy_time = None
+        # Unit, total and done work units of the current summation and the time it started
+        self.unit = None
+        self.total = 0
+        self.done = 0
+        self.work_voxels = 0
+        self.work_start = self.start_time
+        self.last_print = None
+
+    def emit(self, event, **data):
+        """Sends an event to the callbacks and to the log file
+        Args:
+          event (string): Name of the event.
+          data: Values of the event.
+        """
+        record = {'event': event, 'time': time.perf_counter() - self.start_time}
+        record.update(data)
+        for callback in self.callbacks:
+            callback(record)
+        if self.log_file is not None:
+            # The file is opened for every event so the log of an interrupted migration is complete
+            with open(self.log_file, 'a') as log:
+                log.write(json.dumps(record, default=json_value) + '\n')
+
+    def start(self, title, **parameters):
+        """Reports the start of a migration
+        Args:
+          title (string): Title of the migration.
+          parameters: Parameters of the migration.
+        """
+        self.emit('start', title=title, parameters=parameters)
+
+    @contextmanager
+    def stage(self, name):
+        """Context measuring the duration of a stage of the migration. The durations of a stage entered several times
+        are added together.
+        Args:
+          name (string): Name of the stage.
+        """
+        tic = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - tic
+            self.add_stage_time(name, seconds)
+            self.emit('stage', name=name, seconds=seconds)
+
+    def add_stage_time(self, name, seconds):
+        """Adds time to a stage without reporting it (used for stages interleaved with others)
+        Args:
+          name (string): Name of the stage.
+          seconds (float): Time spent in the stage [s].
+        """
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_voxels(self, voxels):
+        """Counts the voxels of a summation without progress reports (FFT migrations)
+        Args:
+          voxels (int): Amount of migrated voxels.
+        """
+        self.voxels += voxels
+
+    def begin_work(self, total, unit, voxels, workers=None):
+        """Starts the progress count of a summation
+        Args:
+          total (int): Amount of work units of the summation.
+          unit (string): Name of the work units (B-Scans, tiles...).
+          voxels (int): Amount of voxels migrated by the summation.
+          workers (int): Amount of worker processes or threads of the summation.
+        """
+        self.unit = unit
+        self.total = total
+        self.done = 0
+        self.voxels += voxels
+        self.work_voxels = voxels
+        self.workers = workers
+        self.work_start = time.perf_counter()
+
+    def advance(self, count=1, busy=None):
+        """Reports finished work units of the summation
+        Args:
+          count (int): Amount of finished work units.
+          busy (float): Time the workers spent on the finished units [s] (used for the utilisation of the workers).
+        """
+        self.done += count
+        if busy is not None:
+            self.busy_time = (self.busy_time or 0.0) + busy
+        now = time.perf_counter()
+        elapsed = now - self.work_start
+        fraction = self.done / self.total if self.total > 0 else 1.0
+        eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+        voxels_per_second = self.work_voxels * fraction / elapsed if elapsed > 0 else None
+        self.emit('progress', unit=self.unit, done=self.done, total=self.total, elapsed=elapsed, eta=eta,
+                  voxels_per_second=voxels_per_second)
+        # The console only gets a line every print_interval seconds and the last one
+        if self.verbose and (self.last_print is None or now - self.last_print >= self.print_interval
+                             or self.done >= self.total):
+            self.last_print = now
+            rate = '' if voxels_per_second is None else f", {voxels_per_second:.3g} voxels/s"
+            print(f"Migrated {self.done} of {self.total} {self.unit} ({100 * fraction:.0f}%){rate}, "
+                  f"ETA {eta:.1f} s")
+
+    def finish(self):
+        """Reports the summary of the migration
+        Returns:
+          dict: Values of the summary event.
+        """
+        total = time.perf_counter() - self.start_time
+        summation = self.stages.get('summation')
+        utilisation = None
+        if self.busy_time is not None and self.workers and summation:
+            utilisation = min(1.0, self.busy_time / (self.workers * summation))
+        summary = {'stages': dict(self.stages), 'total': total, 'voxels': self.voxels,
+                   'voxels_per_second': self.voxels / summation if summation else None, 'workers': self.workers,
+                   'utilisation': utilisation}
+        self.emit('summary', **summary)
+        if self.verbose:
+            print('Migration time:', total)
+            for name, seconds in self.stages.items():
+                print(f"  {name}: {seconds:.3f} s")
+            if summary['voxels_per_second'] is not None:
+                print(f"  {summary['voxels_per_second']:.3g} voxels/s")
+            if utilisation is not None:
+                print(f"  {self.workers} workers, {100 * utilisation:.0f}% busy")
+        return summary
+
+
+def json_value(value):
+    """Converts the values of the events that are not JSON types (numpy scalars and arrays)
+    Args:
+      value: Value of an event.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
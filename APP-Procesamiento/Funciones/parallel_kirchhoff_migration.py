@@ -8,9 +8,12 @@ import numpy as np
 import multiprocessing as mp
 
 from numba import jit
+from scipy.integrate import trapezoid
 
 from numpy import ndarray
 
+from Funciones.migration_monitor import MigrationMonitor
+
 
 @jit(nopython=True)
 def transmission_angles_2d(er, h, xp, zp, xc):
@@ -31,7 +34,43 @@ def transmission_angles_2d(er, h, xp, zp, xc):
     return possible_theta_a[min_index], possible_theta_g[min_index]
 
 
-def kirchhoff_migration_2d(b_scan, h_ant, er, t0, tf, dt, x0, xf, qx, z0, zf):
+def transmission_angles_table_2d(er, h, offsets, z):
+    """Calculates incidence angles with Snell's law for every lateral offset and depth of a migration grid. Angles only
+    depend on the offset between antenna and point, so they are calculated once for all the B-Scans of a direction.
+    Args:
+      er (float): Ground apparent relative permittivity.
+      h (float): Height of the antennas from ground [m].
+      offsets (float array): Horizontal distances between the antenna locations and the points in ground subsurface.
+      z (float array): z-coordinates of the points in ground subsurface.
+    Returns:
+      theta_a_table (float array): Air transmission angles indexed by [offset, depth].
+      theta_g_table (float array): Ground transmission angles indexed by [offset, depth].
+    """
+    theta_a_table = np.zeros((len(offsets), len(z)))
+    theta_g_table = np.zeros((len(offsets), len(z)))
+    for m in range(0, len(offsets)):
+        for j in range(0, len(z)):
+            theta_a_table[m, j], theta_g_table[m, j] = transmission_angles_2d(er, h, offsets[m], z[j], 0)
+    return theta_a_table, theta_g_table
+
+
+def half_derivative_2d(scan, dt):
+    """Applies the half-derivative filter of the 2D migration. The term only depends on the time, so a whole C-Scan
+    (with the time over the last axis) is filtered at once for both migration directions.
+    Args:
+      scan (float array): Amplitudes of the B-Scan or C-Scan.
+      dt (float): Time step [s].
+    """
+    # Calculate frequency domain array
+    fs = 1 / dt
+    f = np.linspace(-fs / 2, fs / 2, np.shape(scan)[-1])
+    # Calculate half-derivative term and its multiplication with the scan
+    scan_f = np.fft.fftshift(np.fft.fft(scan, axis=0), axes=0)  # Scan in the frequency domain
+    half_der = np.sqrt(1j * 2 * np.pi * f.T)  # Half derivative term
+    return np.real(np.fft.ifft(np.fft.ifftshift(half_der * scan_f, axes=0), axis=0))  # Time domain expression
+
+
+def kirchhoff_migration_2d(b_scan, h_ant, er, t0, tf, dt, x0, xf, qx, z0, zf, filtered=False, angle_table=None):
     """Algorithm for Kirchhoff 2D migration
     Args:
       conn (Pipe): Connection pipe with the calling function.
@@ -46,6 +85,9 @@ def kirchhoff_migration_2d(b_scan, h_ant, er, t0, tf, dt, x0, xf, qx, z0, zf):
       qx (float): Amount of values over the horizontal axis.
       z0 (float): Initial z-axis value [m].
       zf (float): Final z-axis value [m].
+      filtered (bool): Whether the B-Scan was already filtered by half_derivative_2d.
+      angle_table (tuple): Precalculated angle tables from transmission_angles_table_2d. They are calculated for the
+        B-Scan grid if not given.
     """
     # Speed of light constant definition and calculation of propagation velocity in ground
     c0 = 3e8  # [m/s]
@@ -59,13 +101,12 @@ def kirchhoff_migration_2d(b_scan, h_ant, er, t0, tf, dt, x0, xf, qx, z0, zf):
         else:
             t = np.arange(t0, tf + dt, dt)
     z = np.arange(z0, zf, dt * vp)
-    # Calculate frequency domain array
-    fs = 1 / dt
-    f = np.linspace(-fs / 2, fs / 2, len(t))
     # Calculate half-derivative term and its multiplication with the B-Scan
-    b_scan_f = np.fft.fftshift(np.fft.fft(b_scan, axis=0), axes=0)  # B-Scan in the frequency domain
-    half_der = np.tile(np.sqrt(1j * 2 * np.pi * f.T), (qx, 1))  # Half derivative term
-    d_b_scan = np.real(np.fft.ifft(np.fft.ifftshift(half_der * b_scan_f, axes=0), axis=0))  # Time domain expression
+    d_b_scan = b_scan if filtered else half_derivative_2d(b_scan, dt)
+    # Transmission angles indexed by [offset, depth]
+    if angle_table is None:
+        angle_table = transmission_angles_table_2d(er, h_ant, x - x[0], z)
+    theta_a_table, theta_g_table = angle_table
     # Create empty array for angles and integration kernel
     theta_a_arr = np.zeros((len(x), 1))
     theta_g_arr = np.zeros((len(x), 1))
@@ -76,10 +117,9 @@ def kirchhoff_migration_2d(b_scan, h_ant, er, t0, tf, dt, x0, xf, qx, z0, zf):
         for j in range(0, len(z)):
             zp = z[j]
             for k in range(0, qx):
-                # Calls the transmission angle function to find both the ground and air transmission angles
-                theta_a, theta_g = transmission_angles_2d(er, h_ant, xp, zp, x[k])
-                theta_a_arr[k] = theta_a
-                theta_g_arr[k] = theta_g
+                # Reads both the ground and air transmission angles of the offset from the tables
+                theta_a_arr[k] = theta_a_table[abs(k - i), j]
+                theta_g_arr[k] = theta_g_table[abs(k - i), j]
                 # Calculate kernel values
             r = h_ant * (1 / np.cos(theta_a_arr)) + zp * (1 / np.cos(theta_g_arr)) + 1e-9
             t_e = 2 * (h_ant * (1 / np.cos(theta_a_arr)) / c0 + zp* (1 / np.cos(theta_g_arr)) / vp)
@@ -90,12 +130,13 @@ def kirchhoff_migration_2d(b_scan, h_ant, er, t0, tf, dt, x0, xf, qx, z0, zf):
             squeezed_scan = np.matrix.flatten(d_b_scan)
             kernel[:, i, j] = np.reshape(np.cos(theta_a_arr) / np.sqrt(r), (len(x),)) * squeezed_scan[linear_indexes]
     # Calculates the intrgral over the migration direction
-    migrated_image = np.abs(np.trapz(kernel, x, axis=0))
+    migrated_image = np.abs(trapezoid(kernel, x, axis=0))
     # Connects the pipe to the calculated migrated image
     return migrated_image
 
 
-def kirchhoff_migration_3d_parallel(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf):
+def kirchhoff_migration_3d_parallel(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                    monitor=None):
     """Algorithm for Kirchhoff 3D migration. Calls parallel 2D migrations.
     Args:
       c_scan_scalars (nested-list float): Amplitudes of the C-Scan (should be pre-processed first).
@@ -112,69 +153,53 @@ def kirchhoff_migration_3d_parallel(c_scan_scalars, h_ant, er, t0, tf, dt, x0, x
       qy (float): Amount of values over the y-axis.
       z0 (float): Initial z-axis value [m].
       zf (float): Final z-axis value [m].
+      monitor (MigrationMonitor): Receives the progress and timing of the migration (printed to the console if not
+        given).
     """
     # Speed of light constant definition and calculation of propagation velocity in ground
     c0 = 3e8  # [m/s]
     vp = c0 / np.sqrt(er)  # [m/s]
     # Creation of time and space arrays
+    x = np.linspace(x0, xf, qx)
+    y = np.linspace(y0, yf, qy)
     z = np.arange(z0, zf, dt * vp)
     # Creates empty array for the migrated images
     migrated_image_one = np.zeros([qx, qy, len(z)])
     migrated_image_two = np.zeros([qx, qy, len(z)])
-    # == Timer start ==
-    tic = time.perf_counter()
-    # =================
-    # Creates empty lists for the processes and the pipes to be appended to (first migration direction)
-    pool = mp.Pool(processes=os.cpu_count())
-    processes = []
-    pipe_parent = []
-    pipe_child = []
-    # Loops over all the positions of the x-axis
-    for i in range(0, qx):
-        # Creates the communication pipes
-        parent_conn, child_conn = mp.Pipe()
-        pipe_parent.append(parent_conn)
-        pipe_child.append(child_conn)
-        # Calls the migration function with the corresponding migration pipe and the corresponding plane of the C-Scan
-        result = pool.apply_async(kirchhoff_migration_2d,
-                       args=(c_scan_scalars[i, :, :], h_ant, er, t0, tf, dt, y0, yf, qy, z0, zf))
-        # Starts the process for migration
-        #p.start()
-        # Saves the process appending it to the processes list
-        processes.append(result)
-    for i in range(0, qx):
-        # Recovers the values in the communication pipes
-        migrated_image_one[i, :, :] = processes[i].get()
-        # Joins the processes to the main execution
-        #processes[i].join()
-    # Creates empty lists for the processes and the pipes to be appended to (second migration direction)
-    processes = []
-    pipe_parent = []
-    pipe_child = []
-    # Loops over all the positions of the y-axis
-    for j in range(0, qy):
-        # Creates the communication pipes
-        #parent_conn, child_conn = mp.Pipe()
-        #pipe_parent.append(parent_conn)
-        #pipe_child.append(child_conn)
-        # Calls the migration function with the corresponding migration pipe and the corresponding plane of the C-Scan
-        result = pool.apply_async(kirchhoff_migration_2d,
-                       args=(c_scan_scalars[:, j, :], h_ant, er, t0, tf, dt, x0, xf, qx, z0, zf))
-        # Starts the process for migration
-        # p.start()
-        # Joins the processes to the main execution
-        processes.append(result)
-    for j in range(0, qy):
-        # Recovers the values in the communication pipes
-        migrated_image_two[:, j, :] = processes[j].get()
-        # Joins the processes to the main execution
-        #processes[j].join()
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    # The C-Scan is filtered once for both migration directions
+    with monitor.stage('half-derivative'):
+        d_c_scan = half_derivative_2d(c_scan_scalars, dt)
+    # Angle tables of each direction are shared by all its B-Scans (planes of fixed x migrate along y and vice versa)
+    with monitor.stage('tables'):
+        y_angle_table = transmission_angles_table_2d(er, h_ant, y - y0, z)
+        x_angle_table = transmission_angles_table_2d(er, h_ant, x - x0, z)
+    processes = os.cpu_count()
+    with monitor.stage('summation'), mp.Pool(processes=processes) as pool:
+        # Every B-Scan of both directions is a work unit of the progress
+        monitor.begin_work(qx + qy, 'B-Scans', qx * qy * len(z), processes)
+        # Calls the migration function with the corresponding plane of the C-Scan over all the positions of the x-axis
+        # (first migration direction)
+        results = [pool.apply_async(kirchhoff_migration_2d,
+                                    args=(d_c_scan[i, :, :], h_ant, er, t0, tf, dt, y0, yf, qy, z0, zf, True,
+                                          y_angle_table)) for i in range(0, qx)]
+        for i in range(0, qx):
+            # Recovers the migrated planes
+            migrated_image_one[i, :, :] = results[i].get()
+            monitor.advance()
+        # Calls the migration function over all the positions of the y-axis (second migration direction)
+        results = [pool.apply_async(kirchhoff_migration_2d,
+                                    args=(d_c_scan[:, j, :], h_ant, er, t0, tf, dt, x0, xf, qx, z0, zf, True,
+                                          x_angle_table)) for j in range(0, qy)]
+        for j in range(0, qy):
+            migrated_image_two[:, j, :] = results[j].get()
+            monitor.advance()
     # Multiples the two migrated images to create the 3D migration
     migrated_image_full = np.multiply(migrated_image_one, migrated_image_two)
-    # == Timer stop ===
-    toc = time.perf_counter()
-    print('Migration time:', toc - tic)
-    # =================
+    if own_monitor:
+        monitor.finish()
     # Returns the migrated image and the length of the z-axis
     return migrated_image_full, len(z)
 
@@ -226,7 +251,7 @@ def store_migration_file(folder, title, migrated_image, h_ant, er, x0, xf, qx, y
     output_file.close()
 
 
-def execute_migration(c_scan_file, title, er, pol, z0, zf):
+def execute_migration(c_scan_file, title, er, pol, z0, zf, monitor=None):
     """Stored the result of the 3D migrated image
     Args:
       c_scan_file (string): File with the C-Scan to be migrated.
@@ -235,7 +260,16 @@ def execute_migration(c_scan_file, title, er, pol, z0, zf):
       er (float): Ground apparent relative permittivity.
       z0 (float): Initial z-axis value [m].
       zf (float): Final z-axis value [m].
+      monitor (MigrationMonitor): Receives the progress and timing of the migration (printed to the console if not
+        given).
     """
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    monitor.start(title, c_scan_file=c_scan_file, er=er, pol=pol, z0=z0, zf=zf)
+    # == Timer start ==
+    tic = time.perf_counter()
+    # =================
     # Reads the folder of the file, this folder will be used to store the migrated image
     folder = os.path.dirname(c_scan_file)
     # Merged file is opened into data_frame variable
@@ -299,11 +333,20 @@ def execute_migration(c_scan_file, title, er, pol, z0, zf):
             c_scan_scalars[count, :, :] = data_frame['A-Scan/Re{A-Scan y-pol}'][index_0:index_f][:]
     # Closes the .h5 file
     data_frame.close()
+    # == Timer stop ===
+    toc = time.perf_counter()
+    monitor.add_stage_time('load', toc - tic)
+    monitor.emit('stage', name='load', seconds=toc - tic)
+    # =================
     # Calls the migration function and stores the obtained migrated image
     print(f"Antenna height: {ha}")
-    mi, qz = kirchhoff_migration_3d_parallel(c_scan_scalars, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf)
+    mi, qz = kirchhoff_migration_3d_parallel(c_scan_scalars, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                             monitor)
     # Stores the obtained migrated image
-    store_migration_file(folder, title, mi, ha, er, x0, xf, qx, y0, yf, qy, z0, zf, qz)
+    with monitor.stage('write'):
+        store_migration_file(folder, title, mi, ha, er, x0, xf, qx, y0, yf, qy, z0, zf, qz)
+    if own_monitor:
+        monitor.finish()
 
 
 if __name__ == '__main__':
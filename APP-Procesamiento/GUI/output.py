@@ -13,11 +13,11 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QMessageBox
 
 
-from Funciones.ifft_multiple_files import create_ifft_file
+from Funciones.ifft_multiple_files import create_ifft_file, create_ifft_c_scan
 from Funciones.merge_ascans import store_c_scan_files
 from Funciones.c_scan_background_subtraction import remove_background_and_save
 from Funciones.c_scan_background_removal import remove_average_and_save
-from Funciones.parallel_kirchhoff_migration import execute_migration
+from Hilos.migracion_thread import MigrarCScan
 from Funciones.a_scan_plot import plot_a_scan_from_merged_file
 from Funciones.b_scan_plot import plot_b_scan_from_merged_file
 from Funciones.c_scan_plot import plot_c_scan_from_merged_file
@@ -882,8 +882,8 @@ class Ui_MainWindow(object):
                 # self.lineEdit_filePath.setText("")
                 # self.filePath = None
             else:
-                create_ifft_file(directory)
-                store_c_scan_files(directory + "Time", title=fileName)
+                # Las trazas en el tiempo se escriben directamente en el C-Scan, sin archivos .csv intermedios
+                create_ifft_c_scan(directory, title=fileName)
                 self.lanzarMensajeExito()
                 self.rawFilePath = directory + "Time/C_Scans/" + fileName + ".h5"
                 self.lineEdit_rawFilePath.setText(self.rawFilePath)
@@ -941,24 +941,50 @@ class Ui_MainWindow(object):
             pol = self.comboBox_polarizationAxis.currentText()
             z_ini = float(self.lineEdit_zini.text().replace(",", "."))
             z_end = float(self.lineEdit_zend.text().replace(",", "."))
-
-            title = 'migration_er' + str(er)
-            execute_migration(file, title, er, pol, z_ini, z_end)
-            self.lanzarMensajeExito()
         except ValueError:
             traceback.print_exc()
             self.lanzarMensajeError("Los valores suministrados para las constantes no son válidos.")
-        except Exception as ex:
-            self.lanzarMensajeError("Ha ocurrido un error procesando el archivo, por favor intente de nuevo.")
-            print(file)
-            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-            message = template.format(type(ex).__name__, ex.args)
-            print(message)
-            # self.disableProcessing
-            self.disableProcessing()
-            self.lineEdit_rawFilePath.setText("")
-            self.rawFilePath = None
+            return
+
+        title = 'migration_er' + str(er)
+        # La migración se ejecuta en un hilo aparte y la interfaz se bloquea hasta que termina. El avance de la
+        # migración llega con las señales del hilo y se muestra en la barra de estado
+        self.centralwidget.setEnabled(False)
+        self.hiloMigracion = MigrarCScan(file, title, er, pol, z_ini, z_end)
+        self.hiloMigracion.eventoSignal.connect(self.mostrarAvanceMigracion)
+        self.hiloMigracion.finalizadoSignal.connect(self.finalizarMigracion)
+        self.hiloMigracion.errorSignal.connect(self.errorMigracion)
+        self.hiloMigracion.start()
+
+    def finalizarMigracion(self, summary):
+        self.centralwidget.setEnabled(True)
+        self.statusbar.clearMessage()
+        self.lanzarMensajeExito(("Completado.", "Migración finalizada en {:.1f} s.".format(summary['total'])))
+
+    def errorMigracion(self, ex):
+        self.centralwidget.setEnabled(True)
+        self.statusbar.clearMessage()
+        if isinstance(ex, ValueError):
+            self.lanzarMensajeError("Los valores suministrados para las constantes no son válidos.")
+            return
+        self.lanzarMensajeError("Ha ocurrido un error procesando el archivo, por favor intente de nuevo.")
+        print(self.hiloMigracion.archivo)
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        message = template.format(type(ex).__name__, ex.args)
+        print(message)
+        self.disableProcessing()
+        self.lineEdit_rawFilePath.setText("")
+        self.rawFilePath = None
 
+    def mostrarAvanceMigracion(self, event):
+        if event['event'] == 'progress':
+            mensaje = "Migrando: {} de {} {} ({:.0f} %)".format(event['done'], event['total'], event['unit'],
+                                                             100 * event['done'] / event['total'])
+            if event['eta'] is not None:
+                mensaje += ", tiempo restante: {:.0f} s".format(event['eta'])
+            self.statusbar.showMessage(mensaje)
+        elif event['event'] == 'stage':
+            self.statusbar.showMessage("Etapa '{}' finalizada en {:.1f} s".format(event['name'], event['seconds']))
 
     def execAscanPlot(self, MainWindow):
         try:
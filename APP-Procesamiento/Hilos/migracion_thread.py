@@ -0,0 +1,45 @@
+import traceback
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from Funciones.parallel_kirchhoff_migration import execute_migration
+from Funciones.migration_monitor import MigrationMonitor
+
+
+class MigrarCScan(QThread):
+
+    # Señal con cada evento del monitor de la migración (avance, etapas y resumen)
+    eventoSignal = pyqtSignal(dict)
+
+    # Señal que indica que la migración ha terminado, con el resumen del monitor
+    finalizadoSignal = pyqtSignal(dict)
+
+    # Señal con la excepción que detuvo la migración
+    errorSignal = pyqtSignal(object)
+
+    def __init__(self, p_archivo, p_titulo, p_er, p_pol, p_z_ini, p_z_fin, p_parent=None):
+
+        # Se inicializa la superclase del hilo
+        super().__init__(parent=p_parent)
+
+        # Almacena el archivo del C-Scan y los parametros de la migración
+        self.archivo = p_archivo
+        self.titulo = p_titulo
+        self.er = p_er
+        self.pol = p_pol
+        self.z_ini = p_z_ini
+        self.z_fin = p_z_fin
+
+    def __del__(self):
+        self.wait()
+
+    def run(self):
+        try:
+            # Los eventos del monitor se envían al hilo de la interfaz con una señal, la interfaz no se modifica desde
+            # este hilo
+            monitor = MigrationMonitor(callbacks=[self.eventoSignal.emit])
+            execute_migration(self.archivo, self.titulo, self.er, self.pol, self.z_ini, self.z_fin, monitor)
+            self.finalizadoSignal.emit(monitor.finish())
+        except Exception as ex:
+            traceback.print_exc()
+            self.errorSignal.emit(ex)
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import numpy as np
+from scipy.integrate import trapezoid
+
+# The functions of the application are imported from its package folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Funciones import parallel_kirchhoff_migration as pkm  # noqa: E402
+
+
+def test_migration_2d_without_np_trapz(monkeypatch):
+    # np.trapz was removed in NumPy 2.0
+    monkeypatch.delattr(np, 'trapz', raising=False)
+    # The integrals are recorded to check them against the trapezoidal rule
+    integrals = []
+
+    def recorded_trapezoid(kernel, x, axis):
+        integrals.append((kernel, x))
+        return trapezoid(kernel, x, axis=axis)
+
+    monkeypatch.setattr(pkm, 'trapezoid', recorded_trapezoid)
+    qx, qt, dt = 6, 120, 1e-10
+    b_scan = np.random.default_rng(0).normal(size=(qx, qt))
+    migrated_image = pkm.kirchhoff_migration_2d(b_scan, 0.1, 4.0, 0, qt * dt, dt, 0, 0.2, qx, 0, 0.06)
+    kernel, x = integrals[0]
+    areas = np.diff(x)[:, np.newaxis, np.newaxis] * (kernel[1:] + kernel[:-1]) / 2
+    np.testing.assert_allclose(migrated_image, np.abs(np.sum(areas, axis=0)), rtol=1e-12)
@@ -7,6 +7,9 @@ from Funciones.gpr20_ifft import inverse_fast_fourier
 
 class Procesamiento:
 
+    # Ventana de tiempo (t0, tf, dt) [s] de la grafica de la traza A
+    VENTANA_TRAZA_A = (0, 20e-9, 20e-12)
+
     def __init__(self):
         pass
 
@@ -57,8 +60,11 @@ class Procesamiento:
         dt = 1 / Fs
         return np.arange(0, Nf * dt / 2, dt)
 
-    def calcular_traza_a(self, s_params, freq_list):
-        traza_a, tiempo, _, _ = inverse_fast_fourier(s_params, freq_list)
+    def calcular_traza_a(self, s_params, freq_list, ventana=None):
+        # El barrido del VNA es de un solo lado, así que la traza se calcula solo con la parte positiva del espectro
+        # (IFFT de salida real), sin construir la parte negativa. La traza es la misma del espectro espejado. Si se da
+        # una ventana de tiempo (t0, tf, dt), solo se calcula la traza en esa ventana con la transformada chirp-Z
+        traza_a, tiempo, _, _ = inverse_fast_fourier(s_params, freq_list, hermitian=True, time_window=ventana)
         return traza_a, tiempo
 
     def grafica_traza_a(self, traza_a):
@@ -1,15 +1,23 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy.signal import czt
 
-def inverse_fast_fourier(signal_freq, freq_dom):
+def inverse_fast_fourier(signal_freq, freq_dom, hermitian=False, time_window=None):
     """Calculates the inverse fast Fourier transform of the given signal.
     Args:
       signal_freq (float array): signal to which the IFFT is calculated from.
       freq_dom (float array): array of the frequencies corresponding to the frequency-domain signal.
+      hermitian (bool): whether a one-sided signal is transformed from its positive side only with a real-output IFFT
+        (see hermitian_inverse_fourier()) instead of mirroring it. The time-domain signal and the time array are the
+        same as the ones of the mirrored signal, but the negative side is not built. Not used for two-sided signals.
+      time_window (tuple float): initial time, final time and time step [s] of the time-domain signal. If given, the
+        signal is only calculated over np.arange(t0, tf, dt) with a chirp-Z transform instead of the IFFT (see
+        zoom_inverse_fourier()).
     Returns:
       signal_time (float array): time-domain signal obtained from the IFFT implementation.
-      time_dom (float array): array of time corresponding to the time-domain signal.
-      signal_freq (float array): frequency-domain signal with the processing done over it.
+      time_dom (float array): array of time corresponding to the time-domain signal (the time window if given).
+      signal_freq (float array): frequency-domain signal with the processing done over it (only the positive side in
+        the hermitian mode).
       freq_dom (float array): array of the frequencies corresponding to the frequency-domain signal with processing.
     """
 
@@ -40,8 +48,12 @@ def inverse_fast_fourier(signal_freq, freq_dom):
             index_st = np.where(freq_dom >= st_freq)[0][0]
             signal_freq = np.append(np.zeros(index_st - 1), signal_freq)
 
-    # IFFT is calculated:
-    if one_sided:
+    # IFFT is calculated (only if the whole time-domain signal is needed):
+    if one_sided and hermitian:
+        # The time-domain signal of the mirrored signal is calculated from the positive side only
+        if time_window is None:
+            signal_time = hermitian_inverse_fourier(signal_freq)
+    elif one_sided:
         # If the signal is one-sided the positive side of the signal (known) is mirrored into the negative frequencies
         # as the complex conjugate
         positive_side = signal_freq
@@ -53,27 +65,166 @@ def inverse_fast_fourier(signal_freq, freq_dom):
 
         # The frequency domain signal is organized with np.fftshift(), the IFFT is calculated with np.ifft() and then is
         # organized using np.ifftshift()
-        org_signal_freq = np.fft.fftshift(signal_freq)
-        signal_time = np.fft.ifft(org_signal_freq)
-        signal_time = np.fft.ifftshift(signal_time)
+        if time_window is None:
+            org_signal_freq = np.fft.fftshift(signal_freq)
+            signal_time = np.fft.ifft(org_signal_freq)
+            signal_time = np.fft.ifftshift(signal_time)
     else:
         # The frequency domain signal is organized with np.fftshift(), the IFFT is calculated with np.ifft() and then is
         # organized using np.ifftshift()
-        org_signal_freq = np.fft.fftshift(signal_freq)
-        signal_time = np.fft.ifft(org_signal_freq)
-        signal_time = np.fft.ifftshift(signal_time)
+        if time_window is None:
+            org_signal_freq = np.fft.fftshift(signal_freq)
+            signal_time = np.fft.ifft(org_signal_freq)
+            signal_time = np.fft.ifftshift(signal_time)
 
-    # Construction of the time domain array
-    nf = len(freq_dom)
+    # Construction of the time domain array (the frequency array of the hermitian mode is not mirrored)
+    nf = 2 * len(freq_dom) if one_sided and hermitian else len(freq_dom)
     fs = nf * df
     dt = 1 / fs
     time_dom = np.arange(- nf * dt / 2, (nf - 1) * dt / 2, dt)
 
+    # Only the time window is calculated with a chirp-Z transform
+    if time_window is not None:
+        signal_time, time_dom = zoom_inverse_fourier(signal_freq, df, nf, time_window, one_sided and hermitian)
+
     # # Amplitude correction of the time domain signal
     # signal_time = fs * signal_time
 
     return signal_time, time_dom, signal_freq, freq_dom
 
+def inverse_fast_fourier_batch(signals_freq, freq_dom, hermitian=False, time_window=None):
+    """Calculates the inverse fast Fourier transform of several signals sharing the same frequency array. The window,
+    zero-padding and axes are calculated once and all the signals are transformed by a single IFFT over the last axis,
+    giving the same traces as calling inverse_fast_fourier() for each signal.
+    Args:
+      signals_freq (complex array): signals to which the IFFT is calculated from, one per row (n_signals, n_freq).
+      freq_dom (float array): array of the frequencies corresponding to the frequency-domain signals.
+      hermitian (bool): whether one-sided signals are transformed from their positive side only (as in
+        inverse_fast_fourier()).
+      time_window (tuple float): initial time, final time and time step [s] of the time-domain signals, calculated with
+        a single chirp-Z transform over the last axis instead of the IFFT (as in inverse_fast_fourier()).
+    Returns:
+      signals_time (complex array): time-domain signals obtained from the IFFT implementation, one per row.
+      time_dom (float array): array of time corresponding to the time-domain signals (the time window if given).
+      signals_freq (complex array): frequency-domain signals with the processing done over them (only the positive
+        side in the hermitian mode).
+      freq_dom (float array): array of the frequencies corresponding to the frequency-domain signals with processing.
+    """
+
+    signals_freq = np.atleast_2d(signals_freq)
+
+    # Retrieve the frequency step from the frequency array
+    df = freq_dom[1] - freq_dom[0]
+
+    # Check whether the signals are one-sided or two-sided by checking the frequency domain vector first value
+    st_freq = freq_dom[0]
+    one_sided = st_freq >= 0
+
+    if one_sided:
+        # Same delay and hamming window as inverse_fast_fourier(), calculated once for all the signals
+        t_del = 5e-9
+        delay = np.exp(-1j * 2 * np.pi * freq_dom * t_del)
+        signals_freq = delay * signals_freq * np.hamming(len(freq_dom))
+
+        # Zero-padding from f = 0 to the starting frequency
+        if st_freq > 0:
+            freq_dom = np.arange(0, freq_dom[-1], df)
+            index_st = np.where(freq_dom >= st_freq)[0][0]
+            padding = np.zeros((signals_freq.shape[0], index_st - 1))
+            signals_freq = np.append(padding, signals_freq, axis=-1)
+
+    if one_sided and hermitian:
+        # A single real-output IFFT of the positive side over the last axis for all the signals
+        if time_window is None:
+            signals_time = hermitian_inverse_fourier(signals_freq)
+    else:
+        if one_sided:
+            # The positive side of the signals is mirrored into the negative frequencies as the complex conjugate
+            positive_side = signals_freq
+            negative_side = np.flip(np.conj(positive_side), -1)
+            signals_freq = np.append(negative_side, positive_side, axis=-1)
+            freq_dom = np.append(-np.flip(freq_dom, 0), freq_dom)
+
+        # A single IFFT over the last axis for all the signals, organized as in inverse_fast_fourier()
+        if time_window is None:
+            org_signals_freq = np.fft.fftshift(signals_freq, axes=-1)
+            signals_time = np.fft.ifft(org_signals_freq, axis=-1)
+            signals_time = np.fft.ifftshift(signals_time, axes=-1)
+
+    # Construction of the time domain array (the frequency array of the hermitian mode is not mirrored)
+    nf = 2 * len(freq_dom) if one_sided and hermitian else len(freq_dom)
+    fs = nf * df
+    dt = 1 / fs
+    time_dom = np.arange(- nf * dt / 2, (nf - 1) * dt / 2, dt)
+
+    if time_window is not None:
+        signals_time, time_dom = zoom_inverse_fourier(signals_freq, df, nf, time_window, one_sided and hermitian)
+
+    return signals_time, time_dom, signals_freq, freq_dom
+
+def hermitian_inverse_fourier(signals_freq):
+    """Calculates the time-domain signals of one-sided signals mirrored as in inverse_fast_fourier() from their positive
+    side only. The mirrored signals have the f = 0 sample twice, so their negative side is the complex conjugate of the
+    positive side shifted by one frequency step: they are Hermitian-symmetric around -df / 2 instead of f = 0. Their
+    time-domain signals are real signals with the frequencies shifted by df / 2 (a real-output IFFT, np.irfft) shifted
+    back by -df / 2 in frequency, which is a phase ramp in time.
+    Args:
+      signals_freq (complex array): positive side of the signals with the processing of inverse_fast_fourier() over the
+        last axis.
+    Returns:
+      signals_time (complex array): time-domain signals of the mirrored signals, organized using np.ifftshift().
+    """
+    nf = 2 * signals_freq.shape[-1]
+    # The positive side is placed at the odd samples of a spectrum with half the frequency step, that is, at the
+    # frequencies shifted by df / 2. The first nf samples of its real-output IFFT are the real signals over the time
+    # array of the mirrored signals
+    half_step_freq = np.zeros(signals_freq.shape[:-1] + (nf + 1,), dtype=complex)
+    half_step_freq[..., 1:nf:2] = signals_freq
+    signals_time = 2 * np.fft.irfft(half_step_freq, 2 * nf, axis=-1)[..., 0:nf]
+    signals_time = signals_time * np.exp(-1j * np.pi * np.arange(0, nf) / nf)
+    return np.fft.ifftshift(signals_time, axes=-1)
+
+def zoom_inverse_fourier(signals_freq, df, nf, time_window, hermitian=False):
+    """Calculates the time-domain signals of the IFFT only over a time window with a chirp-Z transform (zoom FFT). The
+    inverse Fourier sum of the IFFT is evaluated at the times of the window, so the samples match the IFFT at its own
+    times and the window can have a finer time step than the IFFT without zero-padding the whole spectrum. It costs
+    O((n_freq + n_times) log(n_freq + n_times)) per signal, so narrow windows are cheaper than the full IFFT.
+    Args:
+      signals_freq (complex array): frequency-domain signals with the processing of inverse_fast_fourier() over the
+        last axis (mirrored signals, or only the positive side in the hermitian mode).
+      df (float): frequency step [Hz].
+      nf (int): length of the IFFT replaced by the transform.
+      time_window (tuple float): initial time, final time and time step [s] of the time-domain signals.
+      hermitian (bool): whether the signals are only the positive side of the mirrored signals (see
+        hermitian_inverse_fourier()).
+    Returns:
+      signals_time (complex array): time-domain signals over the time window.
+      time_dom (float array): array of time corresponding to the time-domain signals.
+    """
+    t0, tf, dt = time_window
+    time_dom = np.arange(t0, tf, dt)
+    if len(time_dom) == 0:
+        raise Exception("The time window has no samples")
+
+    # The transform evaluates sum(x[n] * w ** (n * m) / a ** n) for m = 0, 1, 2..., so the frequency step of the signals
+    # is turned into the time step of the window and the initial phase into the initial time
+    w = np.exp(1j * 2 * np.pi * df * dt)
+    a = np.exp(-1j * 2 * np.pi * df * t0)
+
+    if hermitian:
+        # The mirrored signals are Hermitian-symmetric around -df / 2, so the sum is twice the real part of the sum of
+        # the positive side shifted by df / 2, shifted back by -df / 2 (see hermitian_inverse_fourier())
+        half_shift = np.exp(1j * np.pi * df * time_dom)
+        signals_time = czt(signals_freq, len(time_dom), w, a, axis=-1) * half_shift
+        signals_time = 2 / nf * np.real(signals_time) * np.conj(half_shift)
+    else:
+        # np.fft.fftshift() places the first sample of the signals at the frequency -(nf + 1) // 2 * df
+        k0 = -((nf + 1) // 2)
+        signals_time = czt(signals_freq, len(time_dom), w, a, axis=-1)
+        signals_time = signals_time * np.exp(1j * 2 * np.pi * k0 * df * time_dom) / nf
+
+    return signals_time, time_dom
+
 def cosine_with_shift(dom, a, xo):
     f = a * np.cos(2 * np.pi * xo * dom) * np.exp(- 2j * np.pi * xo * dom)
 
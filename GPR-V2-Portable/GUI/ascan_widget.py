@@ -5,6 +5,8 @@ from matplotlib.figure import Figure
 
 import numpy as np
 
+from Clases.procesamiento_class import Procesamiento
+
 class AScanWidget(QWidget):
 
     def __init__(self, p_parent=None):
@@ -16,9 +18,9 @@ class AScanWidget(QWidget):
         # Este es el lienzo sobre el cual se va a mostrar la figura
         self.canvas = FigureCanvas(self.figure)
 
-        # Almacena limites para el eje x de la grafica
-        self.low_limit = 0
-        self.high_limit = 20e-9
+        # Almacena limites para el eje x de la grafica (la ventana en la que se calcula la traza A)
+        self.low_limit = Procesamiento.VENTANA_TRAZA_A[0]
+        self.high_limit = Procesamiento.VENTANA_TRAZA_A[1]
 
         # Se inicializa una grafica desocupada para mantener la estetica
         ax = self.figure.add_subplot(111)
@@ -12,6 +12,7 @@ from GUI.bscan_widget import BScanWidget
 
 from Hilos.mover_posicionador_thread import MoverPosicionador
 
+import numpy as np
 import multiprocessing as mp
 from threading import Thread
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout
@@ -130,11 +131,8 @@ class MainWindow(QWidget):
         # Se fija la traza como el parámetro S21
         self.objeto_vna.set_trace(tnumber=1, sparameter="S21", format="SMITH")
 
-        # Se define el tamaño del vector para la traza A
-        if puntos % 2 == 0:
-        	len_traza_a = puntos / 2
-        else:
-        	len_traza_a = puntos // 2 + 1
+        # Se define el tamaño del vector para la traza A, que solo se calcula en la ventana de su grafica
+        len_traza_a = len(np.arange(*Procesamiento.VENTANA_TRAZA_A))
 
         # Se crean los arreglos compartidos en memoria para los procesos
         self.sh_traza_a = mp.Array('d', [0 for i in range(int(len_traza_a))])
@@ -262,16 +260,16 @@ class MainWindow(QWidget):
         # Se crea el vector de tiempo para la traza A
         # tiempo = procesamiento.tiempo(freq)
 
-        # Se crea la traza A con los parametros de dispersion
-        # traza_a, tiempo = procesamiento.calcular_traza_a(s_complex, freq)
+        # Se crea la traza A con los parametros de dispersion, solo en la ventana de tiempo de su grafica
+        traza_a, tiempo = procesamiento.calcular_traza_a(s_complex, freq, Procesamiento.VENTANA_TRAZA_A)
 
         # Se crea la traza A que será graficada
-        # traza_a_grafica = procesamiento.grafica_traza_a(traza_a)
+        traza_a_grafica = procesamiento.grafica_traza_a(traza_a)
 
         # Se actualizan las variables compartidas para la traza A
-        # for indx in range(len(traza_a)):
-        #     sh_traza_a[indx] = traza_a_grafica[indx]
-        #     sh_tiempo[indx] = tiempo[indx]
+        for indx in range(len(traza_a)):
+            sh_traza_a[indx] = traza_a_grafica[indx]
+            sh_tiempo[indx] = tiempo[indx]
 
         # Se actualizan las variables compartidas para la traza B
         # TODO: actualizar variables traza B
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import numpy as np
+
+# Las clases importan las funciones desde la carpeta de la aplicacion
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Clases.procesamiento_class as procesamiento_class  # noqa: E402
+from Clases.procesamiento_class import Procesamiento  # noqa: E402
+from Funciones.gpr20_ifft import inverse_fast_fourier  # noqa: E402
+
+
+def barrido_vna(f_min=1e9, f_max=6e9, n_puntos=201):
+    """Barrido de un solo lado de dos reflexiones con perdidas, como el S21 que entrega el VNA"""
+    freq = np.linspace(f_min, f_max, n_puntos)
+    s21 = 0.8 * np.exp(-2j * np.pi * freq * 2e-9) + 0.3 * np.exp(-2j * np.pi * freq * 4.5e-9) * (1 - freq / 12e9)
+    return s21, freq
+
+
+def test_calcular_traza_a_modo_hermitico(monkeypatch):
+    # Se registran los argumentos con los que se calcula la IFFT
+    llamadas = []
+
+    def ifft_registrada(*args, **kwargs):
+        llamadas.append(kwargs)
+        return inverse_fast_fourier(*args, **kwargs)
+
+    monkeypatch.setattr(procesamiento_class, 'inverse_fast_fourier', ifft_registrada)
+    s21, freq = barrido_vna()
+    procesamiento = Procesamiento()
+    traza_a, tiempo = procesamiento.calcular_traza_a(s21, freq)
+    assert llamadas[0]['hermitian']
+    # La traza es la del espectro espejado, asi que la grafica no cambia
+    traza_espejada, tiempo_espejado, _, _ = inverse_fast_fourier(s21, freq)
+    np.testing.assert_array_equal(tiempo, tiempo_espejado)
+    escala = np.max(np.abs(traza_espejada))
+    np.testing.assert_allclose(traza_a, traza_espejada, rtol=0, atol=1e-12 * escala)
+    np.testing.assert_allclose(procesamiento.grafica_traza_a(traza_a),
+                               np.sign(np.imag(traza_espejada)) * np.abs(traza_espejada), rtol=0, atol=1e-12 * escala)
+
+
+def test_calcular_traza_a_en_la_ventana():
+    s21, freq = barrido_vna()
+    procesamiento = Procesamiento()
+    traza_a, tiempo = procesamiento.calcular_traza_a(s21, freq)
+    # En una ventana sobre las muestras de la IFFT se obtienen las mismas muestras
+    inicio, fin = np.searchsorted(tiempo, 0), np.searchsorted(tiempo, 15e-9)
+    dt = tiempo[1] - tiempo[0]
+    ventana = (tiempo[inicio], tiempo[fin] - dt / 2, dt)
+    traza_ventana, tiempo_ventana = procesamiento.calcular_traza_a(s21, freq, ventana)
+    np.testing.assert_allclose(tiempo_ventana, tiempo[inicio:fin])
+    np.testing.assert_allclose(traza_ventana, traza_a[inicio:fin], rtol=0, atol=1e-10 * np.max(np.abs(traza_a)))
+    # La ventana de la grafica de la traza A tiene el tamaño de las variables compartidas de la interfaz
+    traza_grafica, tiempo_grafica = procesamiento.calcular_traza_a(s21, freq, Procesamiento.VENTANA_TRAZA_A)
+    assert len(traza_grafica) == len(tiempo_grafica) == len(np.arange(*Procesamiento.VENTANA_TRAZA_A))
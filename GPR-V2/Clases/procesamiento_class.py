@@ -57,10 +57,16 @@ class Procesamiento:
 
     def calcular_traza_a(self, s_params, len_t, len_zeros, Nf):
         zero_padded_pos_s_param = np.append(np.zeros(len_zeros), s_params)
-        zero_padded_neg_s_param = np.flip(np.conj(zero_padded_pos_s_param))[0:len(zero_padded_pos_s_param)-1]
-        full_s_param = np.append(zero_padded_neg_s_param, zero_padded_pos_s_param)
-        traza_a = np.fft.ifft(full_s_param) * (Nf / 2)
-        traza_a = traza_a[0:len_t]
+        # El espectro completo es hermítico (la parte negativa es el conjugado de la positiva), así que la traza se
+        # calcula con la IFFT de salida real de la parte positiva, sin construir la parte negativa
+        len_pos = len(zero_padded_pos_s_param)
+        n = 2 * len_pos - 1
+        traza_a = np.fft.irfft(zero_padded_pos_s_param, n)[0:len_t]
+        # La parte imaginaria de f = 0 no es hermítica y se suma aparte
+        traza_a = traza_a + 1j * np.imag(zero_padded_pos_s_param[0]) / n
+        # El espectro completo empieza en la parte negativa, lo que desplaza la traza len_pos - 1 muestras en
+        # frecuencia. Se aplica el mismo desplazamiento para obtener la misma traza
+        traza_a = traza_a * np.exp(2j * np.pi * (len_pos - 1) * np.arange(0, len(traza_a)) / n) * (Nf / 2)
         return traza_a
 
     def grafica_traza_a(self, traza_a):
@@ -1,71 +1,259 @@
 import os
 import sys
+import argparse
+import multiprocessing as mp
 import numpy as np
 import pandas as pd
+import h5py
 
 import gpr20_ifft
 
 import tkinter as tk
 from tkinter import filedialog
 
-def create_ifft_file(directory):
+# Amount of files read before their IFFTs are calculated together
+BATCH_SIZE = 256
+
+def read_file_name(file):
+    """Reads the position, orientation, frequency sweep and height of the antennas of a VNA A-Scan file from its name
+    Args:
+        file (string): Name of the A-Scan file
+    Returns:
+        tuple: x and y coordinates (mm), orientation, initial and final frequency (Hz), amount of frequencies and height
+        of the antennas (mm), with the coordinates, orientation and height as written in the name
+    """
+    x_index = file.find("_X")
+    y_index = file.find("_Y")
+    or_index = file.find("_Or")
+    fs_index = file.find("_Fs")
+    fe_index = file.find("_Fe")
+    qf_index = file.find("_Qf")
+    h_index = file.find("_H")
+    e_index = file.find(".csv")
+
+    x = file[x_index + 2:y_index]
+    y = file[y_index + 2:or_index]
+    orient = file[or_index + 3:fs_index]
+    fs = float(file[fs_index + 3:fe_index - 1]) * 10**6
+    fe = float(file[fe_index + 3:qf_index - 1]) * 10**6
+    qf = int(file[qf_index + 3:h_index])
+    h = file[h_index + 2:e_index]
+
+    return x, y, orient, fs, fe, qf, h
+
+def ifft_chunk(chunk):
+    """Reads a chunk of VNA A-Scan files sharing a frequency sweep and calculates their IFFTs at once. Used by the worker
+    processes of the converters, which send the time-domain signals back to the single process writing them
+    Args:
+        chunk (tuple): Folder/directory of the files, names of the files, frequency array and index of the first
+        time-domain sample kept (t >= 0)
+    Returns:
+        time_signals (complex array): Time-domain signals of the files from the first sample kept, one per row
+    """
+    directory, files, freq, index_start = chunk
+    signals = np.zeros((len(files), len(freq)), dtype=complex)
+    for i, file in enumerate(files):
+        df_freq = pd.read_csv(directory + file)
+        signals[i] = df_freq[df_freq.columns[0]].to_numpy() + 1j * df_freq[df_freq.columns[1]].to_numpy()
+
+    time_signals, _, _, _ = gpr20_ifft.inverse_fast_fourier_batch(signals, freq)
+
+    return time_signals[:, index_start:]
+
+def map_ifft_chunks(chunks, workers=None):
+    """Calculates the IFFTs of the chunks of files in worker processes, giving back the results in the order of the
+    chunks so a single process writes them in a deterministic order
+    Args:
+        chunks (list tuple): Chunks of files as given to ifft_chunk()
+        workers (int): Amount of worker processes (all the available CPUs if not given, no processes for a single one)
+    """
+    processes = workers or os.cpu_count()
+    if processes == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield ifft_chunk(chunk)
+        return
+    with mp.Pool(processes=min(processes, len(chunks))) as pool:
+        for time_signals in pool.imap(ifft_chunk, chunks):
+            yield time_signals
+
+def time_array(freq):
+    """Calculates the time array of the IFFT of the signals with the given frequency array and the index of its first
+    sample with t >= 0
+    Args:
+        freq (float array): Frequency array of the frequency-domain signals
+    """
+    _, time, _, _ = gpr20_ifft.inverse_fast_fourier_batch(np.zeros((1, len(freq))), freq)
+    return time, np.where(time >= 0)[0][0]
+
+def create_ifft_file(directory, batch_size=BATCH_SIZE, workers=None):
     files = os.listdir(directory)
     path = directory + 'Time/'
     if not os.path.isdir(path):
         os.mkdir(path)
 
+    # Files are grouped by their frequency sweep and each group is split in chunks of batch_size files, which are read
+    # and transformed together by a worker process
+    groups = {}
     for file in files:
-        df_freq = pd.read_csv(directory + file)
-        df_time = pd.DataFrame()
-        
-        x_index = file.find("_X")
-        y_index = file.find("_Y")
-        or_index = file.find("_Or")
-        fs_index = file.find("_Fs")
-        fe_index = file.find("_Fe")
-        qf_index = file.find("_Qf")
-        h_index = file.find("_H")
-        e_index = file.find(".csv")
-
-        x = file[x_index + 2:y_index]
-        y = file[y_index + 2:or_index]
-        orient = file[or_index + 3:fs_index]
-        fs = float(file[fs_index + 3:fe_index - 1]) * 10**6
-        fe = float(file[fe_index + 3:qf_index - 1]) * 10**6
-        qf = int(file[qf_index + 3:h_index])
-        h = file[h_index + 2:e_index]
-        
-        real_freq = df_freq[df_freq.columns[0]]
-        imag_freq = df_freq[df_freq.columns[1]]
-        
+        x, y, orient, fs, fe, qf, h = read_file_name(file)
+        groups.setdefault((fs, fe, qf), []).append((x, y, orient, h, file))
+
+    units = []
+    for (fs, fe, qf), traces in groups.items():
         freq = np.linspace(fs, fe, qf)
-        signal = real_freq.to_numpy() + 1j * imag_freq.to_numpy()
-        
-        time_signal, time, _, _ = gpr20_ifft.inverse_fast_fourier(signal, freq)
-        
-        index_start = np.where(time >= 0)[0][0]
-        
-        real_time_signal = np.real(time_signal[index_start:])
-        imag_time_signal = np.imag(time_signal[index_start:])
-        
-        new_file_name = path + 'TIME_X' + x + '_Y' + y + '_Or' + orient + '_Ts' + str(0) + 'u_Te' + str(round(time[-1] * 10**6, 4)) + 'u_Qt' + str(len(real_time_signal)) + '_H' + h + '.csv'
-        
-        df_time['A-Scan_real'] = real_time_signal
-        df_time['A-Scan_imag'] = imag_time_signal
-        
+        time, index_start = time_array(freq)
+        for batch_start in range(0, len(traces), batch_size):
+            batch = traces[batch_start:batch_start + batch_size]
+            units.append((batch, time, index_start, (directory, [trace[4] for trace in batch], freq, index_start)))
+
+    # The time-domain files are written by this process only, in the order of the chunks
+    time_signals_chunks = map_ifft_chunks([unit[3] for unit in units], workers)
+    for (batch, time, index_start, _), time_signals in zip(units, time_signals_chunks):
+        for (x, y, orient, h, _), time_signal in zip(batch, time_signals):
+            df_time = pd.DataFrame()
+
+            real_time_signal = np.real(time_signal)
+            imag_time_signal = np.imag(time_signal)
+
+            new_file_name = path + 'TIME_X' + x + '_Y' + y + '_Or' + orient + '_Ts' + str(0) + 'u_Te' + str(round(time[-1] * 10**6, 4)) + 'u_Qt' + str(len(real_time_signal)) + '_H' + h + '.csv'
+
+            df_time['A-Scan_real'] = real_time_signal
+            df_time['A-Scan_imag'] = imag_time_signal
+
+            df_time.to_csv(new_file_name, index=False)
+
+        # The time array is the same for all the files of the chunk, so it is written once
         df_dom = pd.DataFrame()
         df_dom['Time'] = time[index_start:]
-        
-        df_time.to_csv(new_file_name, index=False)
         df_dom.to_csv(path + 'time', index=False)
 
+def create_ifft_c_scan(directory, title="C_Scan_default_title", batch_size=BATCH_SIZE, workers=None):
+    """Creates the merged time-domain C-Scan of a folder of VNA A-Scan files in a single pass. The A-Scans are read in
+    batches, transformed by a single IFFT per batch and written straight into the preallocated data-sets of the .h5
+    file, without the time-domain .csv files. The file is the same as the one of create_ifft_file() followed by
+    merge_ascans.store_c_scan_files() over the 'Time' folder, and it is stored in the same place.
+    Args:
+        directory (string): Route for the folder/directory with the VNA A-Scan files (ending with '/')
+        title (string): Title of the output C-Scan file
+        batch_size (int): Amount of A-Scans read before their IFFTs are calculated together
+        workers (int): Amount of worker processes reading and transforming the A-Scans (all the available CPUs if not
+        given). The .h5 file is only written by the calling process
+    Returns:
+        output_file_name (string): Route of the output C-Scan file
+    """
+    files = [file for file in os.listdir(directory) if file.endswith(".csv")]
+    if not files:
+        raise Exception("Files in the selected folder/directory do not comply with the supported file extensions")
+
+    # A-Scans of each polarization are sorted over x and then over y, as the merged files store them
+    scans = {}
+    for file in files:
+        x, y, orient, fs, fe, qf, h = read_file_name(file)
+        if orient in ('X', 'Y'):
+            scans.setdefault(orient, []).append((float(x), float(y), float(h), (fs, fe, qf), file))
+    sweeps = set(scan[3] for orient_scans in scans.values() for scan in orient_scans)
+    if len(sweeps) > 1:
+        raise Exception("The A-Scan files do not share the same frequency sweep")
+    fs, fe, qf = sweeps.pop()
+    for orient_scans in scans.values():
+        orient_scans.sort(key=lambda scan: scan[:2])
+
+    # Time array of the A-Scans, as written in the title of the time-domain files
+    freq = np.linspace(fs, fe, qf)
+    time, index_start = time_array(freq)
+    qt = len(time) - index_start
+    t0 = 0.0
+    tf = round(time[-1] * 10**6, 4) * 10 ** -6
+
+    path = directory + 'Time/C_Scans/'
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    output_file_name = path + title + '.h5'
+    output_file = h5py.File(output_file_name, 'w')
+
+    # Attributes of the C-Scan file
+    output_file.attrs['Title'] = title
+    output_file.attrs['Total Amount of A-Scans'] = len(files)
+    output_file.attrs['Original extension of A-Scans'] = ".csv"
+
+    # Lattice of the survey points (in meters) from the first and last A-Scans and the steps between them
+    all_scans = sorted(scan for orient_scans in scans.values() for scan in orient_scans)
+    pos_grp = output_file.create_group('/Position')
+    pos_grp.attrs['x0'] = all_scans[0][0] / 1000
+    pos_grp.attrs['y0'] = all_scans[0][1] / 1000
+    pos_grp.attrs['xf'] = all_scans[-1][0] / 1000
+    pos_grp.attrs['yf'] = all_scans[-1][1] / 1000
+    x_values = np.unique([scan[0] for scan in all_scans]) / 1000
+    y_values = np.unique([scan[1] for scan in all_scans]) / 1000
+    if len(x_values) > 1:
+        pos_grp.attrs['dx'] = x_values[1] - x_values[0]
+    if len(y_values) > 1:
+        pos_grp.attrs['dy'] = y_values[1] - y_values[0]
+
+    dom_grp = output_file.create_group('/Time')
+    dom_grp.attrs['t0'] = t0
+    dom_grp.attrs['tf'] = tf
+    dom_grp.attrs['q'] = float(qt)
+    dom_grp.attrs['dt'] = (tf - t0) / (qt - 1)
+
+    asc_grp = output_file.create_group('/A-Scan')
+    datasets = {}
+    units = []
+    for orient, orient_scans in scans.items():
+        pol = orient.lower()
+        n = len(orient_scans)
+        pos_grp.create_dataset('h ' + pol + '-pol', (n, 1), dtype='f4',
+                               data=[[scan[2] / 1000] for scan in orient_scans], compression="gzip")
+        # Data-sets are preallocated and filled one batch at a time
+        chunks = (min(batch_size, n), qt)
+        re_dataset = asc_grp.create_dataset('Re{A-Scan ' + pol + '-pol}', (n, qt), dtype='f4', chunks=chunks,
+                                            compression="gzip")
+        im_dataset = asc_grp.create_dataset('Im{A-Scan ' + pol + '-pol}', (n, qt), dtype='f4', chunks=chunks,
+                                            compression="gzip")
+        datasets[orient] = (re_dataset, im_dataset)
+        for batch_start in range(0, n, batch_size):
+            batch = orient_scans[batch_start:batch_start + batch_size]
+            units.append((orient, batch_start, (directory, [scan[4] for scan in batch], freq, index_start)))
+
+    # Batches are read and transformed by the worker processes and written by this process only, in order
+    time_signals_chunks = map_ifft_chunks([unit[2] for unit in units], workers)
+    for (orient, batch_start, _), time_signals in zip(units, time_signals_chunks):
+        re_dataset, im_dataset = datasets[orient]
+        re_dataset[batch_start:batch_start + len(time_signals)] = np.real(time_signals)
+        im_dataset[batch_start:batch_start + len(time_signals)] = np.imag(time_signals)
+
+    output_file.close()
+
+    return output_file_name
+
 if __name__ == '__main__':
-    root = tk.Tk()
-    root.withdraw()
-    directory = filedialog.askdirectory(parent=root, initialdir=os.getcwd())
-    root.destroy()
-    directory += "/"
+    parser = argparse.ArgumentParser(description='IFFT of VNA A-Scan files')
+    parser.add_argument('directory', nargs='?', default=None, type=str,
+                        help="folder with the VNA A-Scan files (selected in a dialog if not given)")
+    parser.add_argument('--c-scan', default=None, type=str, metavar='TITLE',
+                        help="write the merged time-domain C-Scan with this title in a single pass, without the "
+                             "time-domain .csv files")
+    parser.add_argument('--batch-size', default=BATCH_SIZE, type=int, help="A-Scans transformed together")
+    parser.add_argument('--workers', default=None, type=int,
+                        help="worker processes reading and transforming the A-Scans (all the available CPUs if not "
+                             "given)")
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    directory = args.directory
+    if directory is None:
+        root = tk.Tk()
+        root.withdraw()
+        directory = filedialog.askdirectory(parent=root, initialdir=os.getcwd())
+        root.destroy()
+    directory = directory.rstrip("/") + "/"
 
-    create_ifft_file(directory)
+    if args.c_scan is not None:
+        print(create_ifft_c_scan(directory, args.c_scan, args.batch_size, args.workers))
+    else:
+        create_ifft_file(directory, args.batch_size, args.workers)
 
     sys.exit()
\ No newline at end of file
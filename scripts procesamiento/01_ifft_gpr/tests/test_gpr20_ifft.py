@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The IFFT scripts are imported as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpr20_ifft import inverse_fast_fourier, inverse_fast_fourier_batch  # noqa: E402
+
+
+def random_sweep(n_signals, f_min, seed=0):
+    """Random one-sided sweeps of 301 frequencies up to 6 GHz, like the ones of the VNA"""
+    rng = np.random.default_rng(seed)
+    freq = np.linspace(f_min, 6e9, 301)
+    return rng.normal(size=(n_signals, len(freq))) + 1j * rng.normal(size=(n_signals, len(freq))), freq
+
+
+@pytest.mark.parametrize('f_min', [0, 1e9])
+def test_hermitian_mode_matches_mirrored_signal(f_min):
+    signals, freq = random_sweep(3, f_min)
+    for signal in signals:
+        signal_time, time_dom, _, _ = inverse_fast_fourier(signal, freq)
+        hermitian_time, hermitian_dom, _, _ = inverse_fast_fourier(signal, freq, hermitian=True)
+        np.testing.assert_array_equal(hermitian_dom, time_dom)
+        np.testing.assert_allclose(hermitian_time, signal_time, rtol=0, atol=1e-12 * np.max(np.abs(signal_time)))
+    # The batch gives the same signals in both modes
+    signals_time, _, _, _ = inverse_fast_fourier_batch(signals, freq)
+    hermitian_time, _, _, _ = inverse_fast_fourier_batch(signals, freq, hermitian=True)
+    np.testing.assert_allclose(hermitian_time, signals_time, rtol=0, atol=1e-12 * np.max(np.abs(signals_time)))
+
+
+@pytest.mark.parametrize('hermitian', [False, True])
+def test_time_window_matches_ifft_samples(hermitian):
+    signals, freq = random_sweep(2, 1e9, seed=1)
+    signals_time, time_dom, _, _ = inverse_fast_fourier_batch(signals, freq, hermitian=hermitian)
+    # Window over samples of the IFFT
+    first, last = len(time_dom) // 2, len(time_dom) // 2 + 40
+    dt = time_dom[1] - time_dom[0]
+    window_time, window_dom, _, _ = inverse_fast_fourier_batch(signals, freq, hermitian=hermitian,
+                                                               time_window=(time_dom[first], time_dom[last] - dt / 2,
+                                                                            dt))
+    np.testing.assert_allclose(window_dom, time_dom[first:last])
+    np.testing.assert_allclose(window_time, signals_time[:, first:last], rtol=0,
+                               atol=1e-10 * np.max(np.abs(signals_time)))
@@ -0,0 +1,225 @@
+import numpy as np
+
+from numba import jit, prange, set_num_threads
+
+from migration_monitor import MigrationMonitor
+
+
+def air_phase_shift(spectrum, kx, ky, w, h_ant, t0):
+    """Extrapolates the C-Scan spectrum from the antennas down to the ground surface through the air layer. The
+    horizontal wavenumbers are conserved across the air-ground interface, so this accounts for the refraction of every
+    plane wave at the interface.
+    Args:
+      spectrum (complex array): Spectrum of the C-Scan indexed by [kx, ky, w].
+      kx (float array): Wavenumbers of the x-axis [rad/m].
+      ky (float array): Wavenumbers of the y-axis [rad/m].
+      w (float array): Angular frequencies of the time axis [rad/s].
+      h_ant (float): Height of the antennas from ground [m].
+      t0 (float): Initial time value [s].
+    """
+    # Speed of light constant definition, halved for the two-way travel times of the exploding reflector model
+    c0 = 3e8  # [m/s]
+    va = c0 / 2  # [m/s]
+    k2 = np.add.outer(kx ** 2, ky ** 2)[:, :, np.newaxis]
+    kz2 = (w / va) ** 2 - k2
+    # Shift of the time origin to the first sample and phase shift of the propagating waves. Evanescent waves in the air
+    # are beyond the critical angle of the ground and are removed
+    kz = np.sqrt(np.maximum(kz2, 0))
+    return np.where(kz2 > 0, spectrum * np.exp(-1j * w * t0 + 1j * kz * h_ant), 0)
+
+
+@jit(nopython=True, parallel=True)
+def stolt_mapping(spectrum, kx, ky, kz, v, dw):
+    """Maps the spectrum of the C-Scan at the ground surface from angular frequency to vertical wavenumber (Stolt
+    mapping), interpolating linearly between the frequency samples
+    Args:
+      spectrum (complex array): Spectrum of the C-Scan indexed by [kx, ky, w] for w = 0, dw, 2 * dw...
+      kx (float array): Wavenumbers of the x-axis [rad/m].
+      ky (float array): Wavenumbers of the y-axis [rad/m].
+      kz (float array): Vertical wavenumbers of the migrated image [rad/m].
+      v (float): Propagation velocity in the ground, halved for the two-way travel times [m/s].
+      dw (float): Angular frequency step [rad/s].
+    """
+    nkx, nky, nw = spectrum.shape
+    image_spectrum = np.zeros((nkx, nky, len(kz)), dtype=np.complex128)
+    for i in prange(0, nkx):
+        for j in range(0, nky):
+            k2 = kx[i] ** 2 + ky[j] ** 2
+            for m in range(0, len(kz)):
+                # Frequency of the plane wave with the given wavenumbers
+                w = v * np.sqrt(kz[m] ** 2 + k2)
+                position = w / dw
+                n = int(np.floor(position))
+                if kz[m] > 0 and n + 1 < nw:
+                    fraction = position - n
+                    value = (1 - fraction) * spectrum[i, j, n] + fraction * spectrum[i, j, n + 1]
+                    # Jacobian of the change of variables from frequency to vertical wavenumber
+                    image_spectrum[i, j, m] = value * v * kz[m] / w
+    return image_spectrum
+
+
+def stolt_migration_3d(c_scan, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, padding=2, workers=None,
+                       monitor=None):
+    """Algorithm for frequency-wavenumber (Stolt) 3D migration. The C-Scan is extrapolated through the air layer by
+    phase shift and migrated in the ground by Stolt mapping, so the whole C-Scan is migrated with FFTs.
+    Args:
+      c_scan (nested-list float): Amplitudes of the C-Scan (should be pre-processed first).
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      t0 (float): Initial time value [s].
+      tf (float): Final time value [s].
+      dt (float): Time step [s].
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      padding (int): Zero-padding factor of the x-, y- and time axis, used to avoid the wrap-around of the FFTs.
+      workers (int): Amount of threads used by the Stolt mapping (all the available threads if not given).
+      monitor (MigrationMonitor): Monitor of the timing of the migration (it is not reported if not given).
+    Returns:
+      migrated_image (float array): Migrated image amplitudes.
+      qz (int): Amount of values over the z-axis.
+    """
+    # Speed of light constant definition and calculation of propagation velocity in ground
+    c0 = 3e8  # [m/s]
+    vp = c0 / np.sqrt(er)  # [m/s]
+    # Creation of the z-axis (same as the Kirchhoff migration)
+    z = np.arange(z0, zf, dt * vp)
+    if monitor is None:
+        monitor = MigrationMonitor(verbose=False)
+    with monitor.stage('summation'):
+        # Padded sizes of the x-, y- and time axis
+        qt = np.shape(c_scan)[2]
+        nx, ny, nt = padding * qx, padding * qy, padding * qt
+        dx = (xf - x0) / (qx - 1) if qx > 1 else 1
+        dy = (yf - y0) / (qy - 1) if qy > 1 else 1
+        # Spectrum of the C-Scan (only positive frequencies as the C-Scan is real)
+        spectrum = np.fft.rfft(c_scan, n=nt, axis=2)
+        spectrum = np.fft.fft2(spectrum, s=(nx, ny), axes=(0, 1))
+        kx = 2 * np.pi * np.fft.fftfreq(nx, dx)
+        ky = 2 * np.pi * np.fft.fftfreq(ny, dy)
+        w = 2 * np.pi * np.fft.rfftfreq(nt, dt)
+        # Extrapolation through the air layer down to the ground surface
+        spectrum = air_phase_shift(spectrum, kx, ky, w, h_ant, t0)
+        # Stolt mapping in the ground. Depths are sampled as the times (z = vp * t / 2)
+        if workers is not None:
+            set_num_threads(workers)
+        dz = vp * dt / 2
+        kz = 2 * np.pi * np.fft.fftfreq(nt, dz)
+        image_spectrum = stolt_mapping(spectrum, kx, ky, kz, vp / 2, w[1])
+        del spectrum
+        # Back to the space domain. Only positive vertical wavenumbers are mapped, so the image is the envelope of the
+        # reflectivity
+        image = np.fft.ifftn(image_spectrum, axes=(0, 1, 2))[:qx, :qy, :]
+        del image_spectrum
+        image = np.abs(image)
+        # Linear interpolation of the image over the z-axis of the migrated image
+        position = z / dz
+        n = np.floor(position).astype(int)
+        fraction = position - n
+        valid = (n >= 0) & (n + 1 < nt)
+        n = np.clip(n, 0, nt - 2)
+        migrated_image = np.where(valid, (1 - fraction) * image[:, :, n] + fraction * image[:, :, n + 1], 0)
+    monitor.add_voxels(np.size(migrated_image))
+    return migrated_image, len(z)
+
+
+def layer_segments(boundaries, za, zb):
+    """Splits a depth interval into the lengths inside each layer of a layer stack
+    Args:
+      boundaries (float array): Depths of the boundaries between layers [m].
+      za (float): Initial depth of the interval [m].
+      zb (float): Final depth of the interval [m].
+    Returns:
+      list: Length of the interval inside each layer [m].
+    """
+    tops = np.concatenate(([0], boundaries))
+    bottoms = np.concatenate((boundaries, [np.inf]))
+    return [max(0.0, min(zb, bottom) - max(za, top)) for top, bottom in zip(tops, bottoms)]
+
+
+def phase_shift_migration_3d(c_scan, h_ant, permittivities, thicknesses, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                             padding=2, monitor=None):
+    """Algorithm for phase-shift (Gazdag) 3D migration over a layered ground. The C-Scan is extrapolated through the air
+    layer and then downward continued through the layers of the ground one depth at a time, all the frequencies at once.
+    Args:
+      c_scan (nested-list float): Amplitudes of the C-Scan (should be pre-processed first).
+      h_ant (float): Height of the antennas from ground [m].
+      permittivities (float array): Relative permittivity of each layer of the ground, from top to bottom (as given by
+        layer_parameter_estimation).
+      thicknesses (float array): Thickness of each layer of the ground [m]. The last layer extends below the stack, so
+        its thickness is not used.
+      t0 (float): Initial time value [s].
+      tf (float): Final time value [s].
+      dt (float): Time step [s].
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      padding (int): Zero-padding factor of the x-, y- and time axis, used to avoid the wrap-around of the FFTs.
+      monitor (MigrationMonitor): Monitor of the timing of the migration (it is not reported if not given).
+    Returns:
+      migrated_image (float array): Migrated image amplitudes.
+      qz (int): Amount of values over the z-axis.
+    """
+    # Speed of light constant definition and calculation of propagation velocity in each layer, halved for the two-way
+    # travel times of the exploding reflector model
+    c0 = 3e8  # [m/s]
+    v_layers = c0 / np.sqrt(np.asarray(permittivities, dtype=float)) / 2  # [m/s]
+    boundaries = np.cumsum(np.asarray(thicknesses, dtype=float)[:len(v_layers) - 1])
+    # Creation of the z-axis (same as the Kirchhoff migration with the permittivity of the first layer)
+    z = np.arange(z0, zf, dt * 2 * v_layers[0])
+    if monitor is None:
+        monitor = MigrationMonitor(verbose=False)
+    with monitor.stage('summation'):
+        # Padded sizes of the x-, y- and time axis
+        qt = np.shape(c_scan)[2]
+        nx, ny, nt = padding * qx, padding * qy, padding * qt
+        dx = (xf - x0) / (qx - 1) if qx > 1 else 1
+        dy = (yf - y0) / (qy - 1) if qy > 1 else 1
+        # Spectrum of the C-Scan (only positive frequencies as the C-Scan is real)
+        spectrum = np.fft.rfft(c_scan, n=nt, axis=2)
+        spectrum = np.fft.fft2(spectrum, s=(nx, ny), axes=(0, 1))
+        kx = 2 * np.pi * np.fft.fftfreq(nx, dx)
+        ky = 2 * np.pi * np.fft.fftfreq(ny, dy)
+        w = 2 * np.pi * np.fft.rfftfreq(nt, dt)
+        # Extrapolation through the air layer down to the ground surface
+        spectrum = air_phase_shift(spectrum, kx, ky, w, h_ant, t0)
+        # Vertical wavenumbers of every layer. Waves evanescent in a layer are removed when they reach it
+        k2 = np.add.outer(kx ** 2, ky ** 2)[:, :, np.newaxis]
+        kz_layers = []
+        for v in v_layers:
+            kz2 = (w / v) ** 2 - k2
+            kz_layers.append((np.sqrt(np.maximum(kz2, 0)), kz2 > 0))
+        # Phase shift of a depth step inside each layer, reused while the steps do not cross a boundary
+        dz = z[1] - z[0] if len(z) > 1 else 0
+        step_shifts = [np.where(propagating, np.exp(1j * kz * dz), 0) for kz, propagating in kz_layers]
+        migrated_image = np.zeros((qx, qy, len(z)))
+        z_current = 0.0
+        for k in range(0, len(z)):
+            # Downward continuation from the previous depth through the layers crossed by the step
+            segments = layer_segments(boundaries, z_current, z[k])
+            crossed = [l for l, length in enumerate(segments) if length > 0]
+            if len(crossed) == 1 and np.isclose(segments[crossed[0]], dz):
+                spectrum *= step_shifts[crossed[0]]
+            elif len(crossed) > 0:
+                phase = np.zeros(spectrum.shape)
+                propagating = np.ones(spectrum.shape, dtype=bool)
+                for l in crossed:
+                    phase += kz_layers[l][0] * segments[l]
+                    propagating &= kz_layers[l][1]
+                spectrum *= np.where(propagating, np.exp(1j * phase), 0)
+            z_current = z[k]
+            # Imaging condition (t = 0) as the sum over all the frequencies. Only positive frequencies are summed, so
+            # the image is the envelope of the reflectivity
+            migrated_image[:, :, k] = np.abs(np.fft.ifft2(np.sum(spectrum, axis=2))[:qx, :qy])
+    monitor.add_voxels(np.size(migrated_image))
+    return migrated_image, len(z)
@@ -5,10 +5,99 @@ import h5py
 import time
 import argparse
 import numpy as np
-import itertools
 import multiprocessing as mp
+from multiprocessing import shared_memory
 
-from numba import jit
+from numba import jit, prange, set_num_threads, get_num_threads
+from scipy import ndimage
+from scipy.integrate import trapezoid
+
+from fk_migration import stolt_migration_3d, phase_shift_migration_3d
+from migration_monitor import MigrationMonitor
+
+# Methods available to sample the traces at the travel time of the diffraction hyperbola
+SAMPLING_MODES = ('nearest', 'linear', 'sinc')
+# Amount of samples at each side of the travel time used by the windowed-sinc interpolation
+SINC_HALF_WIDTH = 4
+# Engines available to evaluate the sum over the antennas of the 2D migration
+ENGINES = ('direct', 'fft')
+# Default height step of the bins the antenna heights of the traces are grouped in [m]
+HEIGHT_STEP = 0.005
+# Amount of blocks the compiled migrations are split in to report their progress
+PROGRESS_STEPS = 20
+# Methods available to fuse the migrated images of both polarizations
+FUSION_METHODS = ('sum', 'product', 'max')
+# Largest amount of complex values of the kernel of a depth built at once by the frequency-domain back-projection
+KERNEL_BLOCK_SIZE = 2 ** 22
+# Amount of (x, y) columns of voxels migrated by each parallel work unit of the compiled 3D summation
+COLUMN_CHUNK_SIZE = 16
+# Start method of the worker processes. The compiled kernels start the threads of numba's threading layer, which are
+# not fork-safe (TBB), so workers forked after a compiled migration hang the interpreter. Workers are spawned instead
+POOL_CONTEXT = mp.get_context('spawn')
+# Default fraction of the largest energy of the coarse migration above which a region is refined by the
+# multiresolution migration
+ENERGY_THRESHOLD = 0.1
+
+
+@jit(nopython=True)
+def sample_trace(trace, position, sampling):
+    """Samples a trace at a fractional sample position
+    Args:
+      trace (float array): Amplitudes of the trace.
+      position (float): Fractional sample index of the travel time ((t_e - t0) / dt).
+      sampling (int): Index of the sampling method in SAMPLING_MODES.
+    """
+    last = len(trace) - 1
+    # Nearest sample (positions outside the trace are clipped to its first or last sample)
+    if sampling == 0:
+        index = min(max(int(np.floor(position + 0.5)), 0), last)
+        return trace[index]
+    # Linear interpolation between the two neighbouring samples
+    if sampling == 1:
+        if position <= 0:
+            return trace[0]
+        if position >= last:
+            return trace[last]
+        index = int(np.floor(position))
+        frac = position - index
+        return (1 - frac) * trace[index] + frac * trace[index + 1]
+    # Sinc interpolation with a Hann window over SINC_HALF_WIDTH samples at each side of the position
+    index = int(np.floor(position))
+    value = 0.0
+    for n in range(max(index - SINC_HALF_WIDTH + 1, 0), min(index + SINC_HALF_WIDTH, last) + 1):
+        u = position - n
+        value += trace[n] * np.sinc(u) * (0.5 + 0.5 * np.cos(np.pi * u / SINC_HALF_WIDTH))
+    return value
+
+
+@jit(nopython=True)
+def sample_traces(scan, positions, sampling):
+    """Samples several traces at fractional sample positions
+    Args:
+      scan (float array): Amplitudes of the traces with shape (traces, time).
+      positions (float array): Fractional sample indexes with shape (traces, samples per trace).
+      sampling (int): Index of the sampling method in SAMPLING_MODES.
+    """
+    samples = np.zeros(positions.shape)
+    for k in range(0, positions.shape[0]):
+        for n in range(0, positions.shape[1]):
+            samples[k, n] = sample_trace(scan[k], positions[k, n], sampling)
+    return samples
+
+
+@jit(nopython=True)
+def kahan_add(total, compensation, value):
+    """Adds a value to a sum with compensated (Kahan) summation, used to keep single precision sums accurate
+    Args:
+      total (float): Current value of the sum.
+      compensation (float): Rounding error of the sum not yet added to it.
+      value (float): Value to add.
+    Returns:
+      tuple: New value of the sum and its rounding error.
+    """
+    y = value - compensation
+    t = total + y
+    return t, (t - total) - y
 
 
 @jit(nopython=True)
@@ -21,177 +110,1771 @@ def transmission_angles_2d(er, h, xp, zp, xc):
       zp (float): z-coordinate of the point in ground subsurface.
       xc (float): horizontal-coordinate of the antenna location.
     """
-    # Creates arrays for all the possible transmission angles
-    possible_theta_g = np.linspace(0, np.pi / 2, 2 ** 8)
-    possible_theta_a = np.arcsin(np.minimum(np.sqrt(er) * np.sin(possible_theta_g), np.asarray([1])))
-    # Looks for the solution of the transmission angle equation
-    min_index = np.argmin(np.abs(np.abs(xc - xp) - zp * np.tan(possible_theta_g) - h * np.tan(possible_theta_a)))
-    # Returns the found transmission angles
-    return possible_theta_a[min_index], possible_theta_g[min_index]
+    # Creates arrays for all the possible transmission angles
+    possible_theta_g = np.linspace(0, np.pi / 2, 2 ** 8)
+    possible_theta_a = np.arcsin(np.minimum(np.sqrt(er) * np.sin(possible_theta_g), np.asarray([1])))
+    # Looks for the solution of the transmission angle equation
+    min_index = np.argmin(np.abs(np.abs(xc - xp) - zp * np.tan(possible_theta_g) - h * np.tan(possible_theta_a)))
+    # Returns the found transmission angles
+    return possible_theta_a[min_index], possible_theta_g[min_index]
+
+
+@jit(nopython=True)
+def transmission_angles_table_2d(er, h, offsets, z):
+    """Calculates incidence angles with Snell's law for every lateral offset and depth of a migration grid
+    Args:
+      er (float): Ground apparent relative permittivity.
+      h (float): Height of the antennas from ground [m].
+      offsets (float array): Horizontal distances between the antenna locations and the points in ground subsurface.
+      z (float array): z-coordinates of the points in ground subsurface.
+    Returns:
+      theta_a_table (float array): Air transmission angles indexed by [offset, depth].
+      theta_g_table (float array): Ground transmission angles indexed by [offset, depth].
+    """
+    # Creates arrays for all the possible transmission angles (only once for the whole table)
+    possible_theta_g = np.linspace(0, np.pi / 2, 2 ** 8)
+    possible_theta_a = np.arcsin(np.minimum(np.sqrt(er) * np.sin(possible_theta_g), np.asarray([1])))
+    tan_theta_g = np.tan(possible_theta_g)
+    tan_theta_a = np.tan(possible_theta_a)
+    # Creates empty tables for the angles
+    theta_a_table = np.zeros((len(offsets), len(z)))
+    theta_g_table = np.zeros((len(offsets), len(z)))
+    for m in range(0, len(offsets)):
+        for j in range(0, len(z)):
+            # Looks for the solution of the transmission angle equation
+            min_index = np.argmin(np.abs(offsets[m] - z[j] * tan_theta_g - h * tan_theta_a))
+            theta_a_table[m, j] = possible_theta_a[min_index]
+            theta_g_table[m, j] = possible_theta_g[min_index]
+    # Returns the found transmission angles
+    return theta_a_table, theta_g_table
+
+
+def build_angle_tables(er, h_ant, x0, xf, qx, y0, yf, qy, z):
+    """Builds the Snell's law angle tables for both migration directions of a C-Scan grid
+    Args:
+      er (float): Ground apparent relative permittivity.
+      h_ant (float): Height of the antennas from ground [m].
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z (float array): z-axis of the migrated image [m].
+    Returns:
+      x_angle_table (tuple): Angle tables for migrations along the x-axis.
+      y_angle_table (tuple): Angle tables for migrations along the y-axis.
+    """
+    # Lateral offsets available over each axis (the angles only depend on the distance to the antenna)
+    x_offsets = np.linspace(0, xf - x0, qx)
+    y_offsets = np.linspace(0, yf - y0, qy)
+    # When both axes share the same step the longest offsets array covers both migration directions
+    if qx >= qy:
+        longest_offsets, shortest_offsets = x_offsets, y_offsets
+    else:
+        longest_offsets, shortest_offsets = y_offsets, x_offsets
+    if np.allclose(longest_offsets[:len(shortest_offsets)], shortest_offsets):
+        angle_table = transmission_angles_table_2d(er, h_ant, longest_offsets, z)
+        return angle_table, angle_table
+    return transmission_angles_table_2d(er, h_ant, x_offsets, z), transmission_angles_table_2d(er, h_ant, y_offsets, z)
+
+
+@jit(nopython=True)
+def transmission_angles_3d(er, h, xp, yp, zp, xc, yc):
+    """Calculates incidence angles with Snell's law
+    Args:
+      er (float): Ground apparent relative permittivity.
+      h (float): Height of the antennas from ground [m].
+      xp (float): horizontal-coordinate of the point in ground subsurface.
+      zp (float): z-coordinate of the point in ground subsurface.
+      xc (float): horizontal-coordinate of the antenna location.
+    """
+    # Creates arrays for all the possible transmission angles
+    possible_theta_g = np.linspace(0, np.pi / 2, 2 ** 8)
+    possible_theta_a = np.arcsin(np.minimum(np.sqrt(er) * np.sin(possible_theta_g), np.asarray([1])))
+    # Looks for the solution of the transmission angle equation
+    min_index = np.argmin(np.abs(np.sqrt((xp-xc)**2 +(yp-yc)**2) - zp * np.tan(possible_theta_g) - h * np.tan(possible_theta_a)))
+    # Returns the found transmission angles
+    return possible_theta_a[min_index], possible_theta_g[min_index]
+
+
+@jit(nopython=True, parallel=True)
+def transmission_angles_table_3d(er, h, x_offsets, y_offsets, z):
+    """Calculates incidence angles with Snell's law for every lateral offset and depth of a 3D migration grid
+    Args:
+      er (float): Ground apparent relative permittivity.
+      h (float): Height of the antennas from ground [m].
+      x_offsets (float array): x-axis distances between the antenna locations and the points in ground subsurface.
+      y_offsets (float array): y-axis distances between the antenna locations and the points in ground subsurface.
+      z (float array): z-coordinates of the points in ground subsurface.
+    Returns:
+      theta_a_table (float array): Air transmission angles indexed by [x offset, y offset, depth].
+      theta_g_table (float array): Ground transmission angles indexed by [x offset, y offset, depth].
+    """
+    # Creates arrays for all the possible transmission angles (only once for the whole table)
+    possible_theta_g = np.linspace(0, np.pi / 2, 2 ** 8)
+    possible_theta_a = np.arcsin(np.minimum(np.sqrt(er) * np.sin(possible_theta_g), 1.0))
+    tan_theta_g = np.tan(possible_theta_g)
+    tan_theta_a = np.tan(possible_theta_a)
+    # Creates empty tables for the angles
+    theta_a_table = np.zeros((len(x_offsets), len(y_offsets), len(z)))
+    theta_g_table = np.zeros((len(x_offsets), len(y_offsets), len(z)))
+    for l in prange(0, len(x_offsets)):
+        for m in range(0, len(y_offsets)):
+            offset = np.sqrt(x_offsets[l] ** 2 + y_offsets[m] ** 2)
+            for k in range(0, len(z)):
+                # Looks for the solution of the transmission angle equation
+                min_index = np.argmin(np.abs(offset - z[k] * tan_theta_g - h * tan_theta_a))
+                theta_a_table[l, m, k] = possible_theta_a[min_index]
+                theta_g_table[l, m, k] = possible_theta_g[min_index]
+    # Returns the found transmission angles
+    return theta_a_table, theta_g_table
+
+
+def height_bins(h_ant, shape, heights=None, height_step=HEIGHT_STEP):
+    """Groups the antenna heights of the traces in bins of equal height. The tables of the migration are calculated for
+    every bin instead of for every trace, so migrating with the height of every trace costs about the same as with a
+    single height.
+    Args:
+      h_ant (float): Height of the antennas from ground used for all the traces if their heights are not given [m].
+      shape (tuple int): Amount of traces over each axis.
+      heights (float array): Height of the antennas from ground of every trace [m].
+      height_step (float): Height step between bins [m].
+    Returns:
+      bin_heights (float array): Height of every bin [m].
+      bins (int array): Bin of every trace.
+    """
+    if heights is None:
+        return np.asarray([h_ant], dtype=float), np.zeros(shape, dtype=np.int64)
+    heights = np.reshape(np.asarray(heights, dtype=float), shape)
+    # Only the bins with traces are kept
+    steps = np.round((heights - np.min(heights)) / height_step).astype(np.int64)
+    used_steps, bins = np.unique(steps, return_inverse=True)
+    return np.min(heights) + height_step * used_steps, np.reshape(bins, shape).astype(np.int64)
+
+
+def time_axis(t0, tf, dt, qt):
+    """Creates the time axis of the traces, matching the amount of samples of the traces
+    Args:
+      t0 (float): Initial time value [s].
+      tf (float): Final time value [s].
+      dt (float): Time step [s].
+      qt (int): Amount of values over the time axis.
+    """
+    t = np.arange(t0, tf, dt)
+    if len(t) != qt:
+        if len(t) > qt:
+            t = np.arange(t0, tf - dt, dt)
+        else:
+            t = np.arange(t0, tf + dt, dt)
+    return t
+
+
+def trapezoid_weights(x):
+    """Calculates the weights that turn a sum over the samples of x into a trapezoidal integral (as
+    scipy.integrate.trapezoid), used by the compiled kernels
+    Args:
+      x (float array): Sample points of the integration axis.
+    """
+    weights = np.zeros(len(x))
+    if len(x) > 1:
+        weights[:-1] += np.diff(x) / 2
+        weights[1:] += np.diff(x) / 2
+    return weights
+
+
+def aperture_mask(theta_a_table, distance_table, max_angle=None, max_distance=None):
+    """Selects the offsets and depths of the angle tables inside the migration aperture
+    Args:
+      theta_a_table (float array): Transmission angles in air indexed by offset and depth [rad].
+      distance_table (float array): Lateral distance between antenna and point of every offset [m], broadcastable to
+        the shape of theta_a_table.
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+    """
+    mask = np.ones(np.shape(theta_a_table), dtype=bool)
+    if max_angle is not None:
+        mask &= theta_a_table <= np.deg2rad(max_angle)
+    if max_distance is not None:
+        mask &= distance_table <= max_distance
+    return mask
+
+
+def half_derivative_term_2d(qt, dt):
+    """Calculates the half-derivative term of the filter of the 2D migration
+    Args:
+      qt (int): Amount of values over the time axis.
+      dt (float): Time step [s].
+    """
+    # Calculate frequency domain array
+    fs = 1 / dt
+    f = np.linspace(-fs / 2, fs / 2, qt)
+    return np.sqrt(1j * 2 * np.pi * f.T)  # Half derivative term
+
+
+def half_derivative_2d(scan, dt, half_der=None):
+    """Applies the half-derivative filter of the 2D migration. The filter does not depend on the permittivity nor on the
+    migration direction, so a whole C-Scan (with the time over the last axis) can be filtered at once.
+    Args:
+      scan (float array): Amplitudes of the B-Scan or C-Scan.
+      dt (float): Time step [s].
+      half_der (complex array): Precalculated half-derivative term from half_derivative_term_2d. It is calculated for
+        the time axis of the scan if not given.
+    """
+    if half_der is None:
+        half_der = half_derivative_term_2d(np.shape(scan)[-1], dt)
+    # Calculate the multiplication of the half-derivative term with the B-Scan (in the precision of the B-Scan)
+    scan_f = np.fft.fftshift(np.fft.fft(scan, axis=0), axes=0)  # B-Scan in the frequency domain
+    half_der = half_der.astype(scan_f.dtype, copy=False)
+    return np.real(np.fft.ifft(np.fft.ifftshift(half_der * scan_f, axes=0), axis=0))  # Time domain expression
+
+
+def half_derivative_3d(c_scan, dt):
+    """Applies the half-derivative filter of the full 3D migration. The filter does not depend on the permittivity.
+    Args:
+      c_scan (float array): Amplitudes of the C-Scan.
+      dt (float): Time step [s].
+    """
+    # Calculate frequency domain array
+    fs = 1 / dt
+    f = np.linspace(-fs / 2, fs / 2, np.shape(c_scan)[-1])
+    # Calculate half-derivative term and its multiplication with the C-Scan
+    c_scan_f = np.fft.fftshift(np.fft.fft2(c_scan, axes=[0, 1]), axes=[0, 1])  # C-Scan in the frequency domain
+    half_der = (1j * 2 * np.pi * f.T).astype(c_scan_f.dtype)  # Half derivative term (in the precision of the C-Scan)
+    d_c_scan = np.real(np.fft.ifft2(np.fft.ifftshift(half_der * c_scan_f, axes=0), axes=[0, 1]))  # Time domain expression
+    return np.ascontiguousarray(d_c_scan)
+
+
+@jit(nopython=True, parallel=True)
+def migrate_volume_3d(d_c_scan, weight_table, position_table, trace_bins, x_weights, y_weights, x_points, y_points,
+                      z_points, x_aperture, y_aperture, sampling, chunk_size):
+    """Compiled Kirchhoff 3D summation over a block of voxels of the migrated image
+    Args:
+      d_c_scan (float array): Filtered amplitudes of the C-Scan with shape (qx, qy, time).
+      weight_table (float array): Kernel weights indexed by [height bin, x offset, y offset, depth].
+      position_table (float array): Fractional sample index of the travel times indexed by [height bin, x offset,
+        y offset, depth].
+      trace_bins (int array): Height bin of every trace with shape (qx, qy).
+      x_weights (float array): Trapezoidal integration weights of the x-axis.
+      y_weights (float array): Trapezoidal integration weights of the y-axis.
+      x_points (int array): Indexes over the x-axis of the migrated voxels.
+      y_points (int array): Indexes over the y-axis of the migrated voxels.
+      z_points (int array): Indexes over the z-axis of the migrated voxels.
+      x_aperture (int): Largest x offset index with non-zero weights. Traces beyond it are not summed.
+      y_aperture (int): Largest y offset index with non-zero weights. Traces beyond it are not summed.
+      sampling (int): Index of the sampling method in SAMPLING_MODES.
+      chunk_size (int): Amount of (x, y) columns of voxels migrated by each parallel work unit.
+    """
+    qx, qy = d_c_scan.shape[0], d_c_scan.shape[1]
+    nx, ny, nz = len(x_points), len(y_points), len(z_points)
+    # The sums keep the precision of the C-Scan, with compensated summation in single precision
+    ftype = d_c_scan.dtype.type
+    compensated = d_c_scan.itemsize == 4
+    migrated_image = np.zeros((nx, ny, nz), dtype=d_c_scan.dtype)
+    # The columns of voxels are split into chunks which are distributed among the threads
+    n_columns = nx * ny
+    n_chunks = (n_columns + chunk_size - 1) // chunk_size
+    for chunk in prange(0, n_chunks):
+        # Integral over the x-axis for every antenna row of the y-axis and every depth of the column
+        x_integral = np.zeros((qy, nz), dtype=d_c_scan.dtype)
+        x_compensation = np.zeros((qy, nz), dtype=d_c_scan.dtype)
+        for column in range(chunk * chunk_size, min((chunk + 1) * chunk_size, n_columns)):
+            a = column // ny
+            b = column % ny
+            i = x_points[a]
+            j = y_points[b]
+            x_integral[:, :] = 0
+            x_compensation[:, :] = 0
+            # Only the traces inside the aperture of the column are summed
+            m_start, m_end = max(0, j - y_aperture), min(qy, j + y_aperture + 1)
+            for l in range(max(0, i - x_aperture), min(qx, i + x_aperture + 1)):
+                for m in range(m_start, m_end):
+                    trace = d_c_scan[l, m]
+                    weights = weight_table[trace_bins[l, m], abs(l - i), abs(m - j)]
+                    positions = position_table[trace_bins[l, m], abs(l - i), abs(m - j)]
+                    for c in range(0, nz):
+                        k = z_points[c]
+                        value = ftype(x_weights[l] * weights[k] * sample_trace(trace, positions[k], sampling))
+                        if compensated:
+                            x_integral[m, c], x_compensation[m, c] = kahan_add(x_integral[m, c],
+                                                                               x_compensation[m, c], value)
+                        else:
+                            x_integral[m, c] += value
+            # Integral over the y-axis of the absolute value of the x-axis integrals
+            for c in range(0, nz):
+                y_integral = ftype(0)
+                y_compensation = ftype(0)
+                for m in range(m_start, m_end):
+                    value = ftype(y_weights[m] * abs(x_integral[m, c]))
+                    if compensated:
+                        y_integral, y_compensation = kahan_add(y_integral, y_compensation, value)
+                    else:
+                        y_integral += value
+                migrated_image[a, b, c] = abs(y_integral)
+    return migrated_image
+
+
+def prepare_migration_3d(c_scan, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, filtered=False, max_angle=None,
+                         max_distance=None, heights=None, height_step=HEIGHT_STEP, monitor=None):
+    """Filters the C-Scan and calculates the tables used by migrate_volume_3d. They are shared by all the voxels of the
+    migrated image, so a migration split in blocks of voxels only calculates them once.
+    Args:
+      c_scan (nested-list float): Amplitudes of the C-Scan (should be pre-processed first).
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      t0 (float): Initial time value [s].
+      tf (float): Final time value [s].
+      dt (float): Time step [s].
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      filtered (bool): Whether the C-Scan was already filtered by half_derivative_3d.
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy) (h_ant for all
+        of them if not given).
+      height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+      monitor (MigrationMonitor): Monitor timing the filter and the tables (they are not reported if not given).
+    Returns:
+      tuple: Filtered C-Scan, weight table, position table, height bin of every trace, trapezoidal weights of the x-
+        and y-axis and largest x and y offset indexes inside the aperture.
+    """
+    # Speed of light constant definition and calculation of propagation velocity in ground
+    c0 = 3e8  # [m/s]
+    vp = c0 / np.sqrt(er)  # [m/s]
+    # Creation of time and space arrays
+    x = np.linspace(x0, xf, qx)
+    y = np.linspace(y0, yf, qy)
+    t = time_axis(t0, tf, dt, len(c_scan[0, 0]))
+    z = np.arange(z0, zf, dt * vp)
+    # Calculate half-derivative term and its multiplication with the C-Scan. Single precision C-Scans are migrated in
+    # single precision
+    if monitor is None:
+        monitor = MigrationMonitor(verbose=False)
+    dtype = np.result_type(np.asarray(c_scan).dtype, np.float32)
+    with monitor.stage('half-derivative'):
+        d_c_scan = np.ascontiguousarray(c_scan if filtered else half_derivative_3d(c_scan, dt), dtype=dtype)
+    # Transmission angles, kernel weights and travel times only depend on the x and y offsets between antenna and point,
+    # on the depth of the point and on the height of the antenna, so they are calculated once for every height bin
+    with monitor.stage('tables'):
+        bin_heights, trace_bins = height_bins(h_ant, (qx, qy), heights, height_step)
+        weight_table = np.zeros((len(bin_heights), qx, qy, len(z)), dtype=dtype)
+        position_table = np.zeros((len(bin_heights), qx, qy, len(z)), dtype=dtype)
+        x_aperture = y_aperture = 0
+        for n, h in enumerate(bin_heights):
+            theta_a_table, theta_g_table = transmission_angles_table_3d(er, h, x - x0, y - y0, z)
+            r_table = h * (1 / np.cos(theta_a_table)) + z * (1 / np.cos(theta_g_table))
+            t_e_table = 2 * (h * (1 / np.cos(theta_a_table)) / c0 + z * (1 / np.cos(theta_g_table)) / vp)
+            # Traces outside the aperture are left out of the summation
+            aperture = aperture_mask(theta_a_table, np.hypot.outer(x - x0, y - y0)[:, :, np.newaxis], max_angle,
+                                     max_distance)
+            weight_table[n] = np.where(aperture, np.cos(theta_a_table) / r_table, 0)
+            position_table[n] = (t_e_table - t[0]) / dt
+            x_aperture = max(x_aperture, np.max(np.nonzero(np.any(aperture, axis=(1, 2)))[0], initial=0))
+            y_aperture = max(y_aperture, np.max(np.nonzero(np.any(aperture, axis=(0, 2)))[0], initial=0))
+    return (d_c_scan, weight_table, position_table, trace_bins, trapezoid_weights(x).astype(dtype),
+            trapezoid_weights(y).astype(dtype), x_aperture, y_aperture)
+
+
+def kirchhoff_migration_3d(c_scan, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, sampling='nearest',
+                           workers=None, chunk_size=COLUMN_CHUNK_SIZE, filtered=False, max_angle=None,
+                           max_distance=None, heights=None, height_step=HEIGHT_STEP, monitor=None):
+    """Algorithm for full Kirchhoff 3D migration. Runs as a compiled multi-threaded kernel over the whole C-Scan, split
+    in slabs of planes of fixed x to report its progress.
+    Args:
+      c_scan (nested-list float): Amplitudes of the C-Scan (should be pre-processed first).
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      t0 (float): Initial time value [s].
+      tf (float): Final time value [s].
+      dt (float): Time step [s].
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of threads used by the compiled kernel (all the available threads if not given).
+      chunk_size (int): Amount of (x, y) columns of voxels migrated by each parallel work unit.
+      filtered (bool): Whether the C-Scan was already filtered by half_derivative_3d.
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy) (h_ant for all
+        of them if not given).
+      height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (they are not reported if not
+        given).
+    """
+    sampling_index = SAMPLING_MODES.index(sampling)
+    if monitor is None:
+        monitor = MigrationMonitor(verbose=False)
+    d_c_scan, weight_table, position_table, trace_bins, x_weights, y_weights, x_aperture, y_aperture = \
+        prepare_migration_3d(c_scan, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, filtered, max_angle,
+                             max_distance, heights, height_step, monitor)
+    # Sets the amount of threads of the compiled kernel
+    if workers is not None:
+        set_num_threads(workers)
+    # Calculates the migrated image over all the voxels, slab by slab
+    qz = weight_table.shape[3]
+    migrated_image = np.zeros((qx, qy, qz), dtype=d_c_scan.dtype)
+    slabs = np.array_split(np.arange(qx), min(qx, PROGRESS_STEPS))
+    with monitor.stage('summation'):
+        monitor.begin_work(len(slabs), 'x-slabs', qx * qy * qz, get_num_threads())
+        for slab in slabs:
+            migrated_image[slab[0]:slab[-1] + 1] = migrate_volume_3d(
+                d_c_scan, weight_table, position_table, trace_bins, x_weights, y_weights, slab, np.arange(qy),
+                np.arange(qz), x_aperture, y_aperture, sampling_index, chunk_size)
+            monitor.advance()
+    return migrated_image
+
+
+def line_migration_tables(h_ant, er, dt, x, z, t, angle_table=None, max_angle=None, max_distance=None):
+    """Calculates the tables of the 2D migration of the B-Scans over a horizontal axis. They only depend on the geometry,
+    so they are shared by all the B-Scans of a migration direction.
+    Args:
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      dt (float): Time step [s].
+      x (float array): Horizontal axis of the B-Scan [m].
+      z (float array): z-axis of the migrated image [m].
+      t (float array): Time axis of the traces [s].
+      angle_table (tuple): Precalculated angle tables from transmission_angles_table_2d. They are calculated for the
+        B-Scan grid if not given.
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+    Returns:
+      tuple: Weight table, position table, offset indexes between antennas and points and largest offset index summed
+        for a point.
+    """
+    # Speed of light constant definition and calculation of propagation velocity in ground
+    c0 = 3e8  # [m/s]
+    vp = c0 / np.sqrt(er)  # [m/s]
+    qx = len(x)
+    # Transmission angles only depend on the offset between antenna and point and on the depth of the point, so they
+    # are read from a table indexed by [offset, depth] instead of solving Snell's law for every antenna and point
+    if angle_table is None:
+        angle_table = transmission_angles_table_2d(er, h_ant, x - x[0], z)
+    theta_a_table = angle_table[0][:qx, :len(z)]
+    theta_g_table = angle_table[1][:qx, :len(z)]
+    # Calculates the path length and the travel time for every offset and depth
+    r_table = h_ant * (1 / np.cos(theta_a_table)) + z * (1 / np.cos(theta_g_table))
+    t_e_table = 2 * (h_ant * (1 / np.cos(theta_a_table)) / c0 + z * (1 / np.cos(theta_g_table)) / vp)
+    # Offset index between every antenna location (rows) and every point of the B-Scan (columns)
+    offset_indexes = np.abs(np.subtract.outer(np.arange(0, qx), np.arange(0, qx)))
+    # Kernel weights and fractional sample index of the travel times for every offset and depth
+    weight_table = np.cos(theta_a_table) / np.sqrt(vp * r_table)
+    position_table = (t_e_table - t[0]) / dt
+    # Traces outside the aperture are left out of the summation. Each point is only integrated over the antennas up to
+    # one offset beyond the aperture (where the kernel is zero), so the trapezoidal integral is the same as over the
+    # whole B-Scan
+    aperture = aperture_mask(theta_a_table, (x - x[0])[:, np.newaxis], max_angle, max_distance)
+    weight_table = np.where(aperture, weight_table, 0)
+    max_offset = np.max(np.nonzero(np.any(aperture, axis=1))[0], initial=0) + 1
+    return weight_table, position_table, offset_indexes, max_offset
+
+
+def migrate_b_scan(d_b_scan, x, weight_table, position_table, offset_indexes, max_offset, trace_bins, sampling_index,
+                   points=None, depths=None):
+    """Migrates a filtered B-Scan with the tables from line_migration_tables of every height bin
+    Args:
+      d_b_scan (float array): Amplitudes of the B-Scan filtered by half_derivative_2d.
+      x (float array): Horizontal axis of the B-Scan [m].
+      weight_table (float array): Kernel weights indexed by [height bin, offset, depth].
+      position_table (float array): Fractional sample index of the travel times indexed by [height bin, offset, depth].
+      offset_indexes (int array): Offset index between every antenna location and every point.
+      max_offset (int): Largest offset index summed for a point.
+      trace_bins (int array): Height bin of every trace of the B-Scan.
+      sampling_index (int): Index of the method used to sample the traces in SAMPLING_MODES.
+      points (slice): Points over the horizontal axis of the migrated image to calculate (all of them if not given).
+      depths (slice): Points over the z-axis of the migrated image to calculate (all of them if not given).
+    """
+    qx = len(x)
+    # Only the requested block of the migrated image is calculated
+    point_indexes = np.arange(0, qx)[points if points is not None else slice(None)]
+    if depths is not None:
+        weight_table = weight_table[:, :, depths]
+        position_table = position_table[:, :, depths]
+    migrated_image = np.zeros((len(point_indexes), weight_table.shape[2]))
+    for n, i in enumerate(point_indexes):
+        start, end = max(0, i - max_offset), min(qx, i + max_offset + 1)
+        # Trace out the hyperbolas of all the depths of the current point sampling the traces at the travel times. Each
+        # trace uses the tables of its height bin
+        table_indexes = (trace_bins[start:end], offset_indexes[start:end, i])
+        samples = sample_traces(d_b_scan[start:end], position_table[table_indexes], sampling_index)
+        kernel = weight_table[table_indexes] * samples
+        # Calculates the intrgral over the migration direction
+        migrated_image[n, :] = np.abs(trapezoid(kernel, x[start:end], axis=0))
+    return migrated_image
+
+
+@jit(nopython=True, parallel=True)
+def migrate_b_scans(d_b_scans, x, weight_table, position_table, trace_bins, max_offset, point_indexes, depth_indexes,
+                    sampling):
+    """Compiled 2D summation over a stack of filtered B-Scans sharing the tables from line_migration_tables
+    Args:
+      d_b_scans (float array): Amplitudes of the B-Scans filtered by half_derivative_2d with shape (lines, qx, time).
+      x (float array): Horizontal axis of the B-Scans [m].
+      weight_table (float array): Kernel weights indexed by [height bin, offset, depth].
+      position_table (float array): Fractional sample index of the travel times indexed by [height bin, offset, depth].
+      trace_bins (int array): Height bin of every trace of the B-Scans with shape (lines, qx).
+      max_offset (int): Largest offset index summed for a point.
+      point_indexes (int array): Indexes over the horizontal axis of the migrated points.
+      depth_indexes (int array): Indexes over the z-axis of the migrated points.
+      sampling (int): Index of the sampling method in SAMPLING_MODES.
+    """
+    n_lines, qx = d_b_scans.shape[0], d_b_scans.shape[1]
+    n_points, n_depths = len(point_indexes), len(depth_indexes)
+    # The sums keep the precision of the B-Scans, with compensated summation in single precision
+    ftype = d_b_scans.dtype.type
+    compensated = d_b_scans.itemsize == 4
+    migrated_images = np.zeros((n_lines, n_points, n_depths), dtype=d_b_scans.dtype)
+    # Every point of every line is an independent work unit
+    for unit in prange(0, n_lines * n_points):
+        line = unit // n_points
+        n = unit % n_points
+        i = point_indexes[n]
+        start, end = max(0, i - max_offset), min(qx, i + max_offset + 1)
+        for c in range(0, n_depths):
+            k = depth_indexes[c]
+            # Trapezoidal integral over the migration direction of the kernel along the hyperbola of the point
+            integral = ftype(0)
+            compensation = ftype(0)
+            previous = ftype(0)
+            for l in range(start, end):
+                b = trace_bins[line, l]
+                weight = weight_table[b, abs(l - i), k]
+                value = ftype(0)
+                if weight != 0:
+                    value = ftype(weight * sample_trace(d_b_scans[line, l], position_table[b, abs(l - i), k], sampling))
+                if l > start:
+                    area = ftype((x[l] - x[l - 1]) * (previous + value) / 2)
+                    if compensated:
+                        integral, compensation = kahan_add(integral, compensation, area)
+                    else:
+                        integral += area
+                previous = value
+            migrated_images[line, n, c] = abs(integral)
+    return migrated_images
+
+
+def migrate_b_scans_fft(d_b_scans, x, weight_table, position_table, trace_bins, dt, depth_indexes, max_frequency=None):
+    """FFT-convolution 2D summation over a stack of filtered B-Scans sharing the tables from line_migration_tables.
+    The traces are sampled at the travel times by Fourier interpolation, so for a depth the sum over the antennas is a
+    convolution along the horizontal axis (for every frequency) which is calculated with FFTs. The kernel of a depth is
+    shared by all the lines.
+    The cost per depth is O(nf * qx * log(qx)) for the kernel and O(lines * qx * nf) for the products, against
+    O(lines * qx * aperture) of migrate_b_scans, with nf the amount of frequencies. It is only cheaper for long lines
+    with wide apertures, mostly when the frequencies are limited to the band of the antennas with max_frequency.
+    Traces at different heights use different kernels, so the convolutions are calculated for every height bin and
+    their cost grows with the amount of bins.
+    Args:
+      d_b_scans (float array): Amplitudes of the B-Scans filtered by half_derivative_2d with shape (lines, qx, time).
+      x (float array): Horizontal axis of the B-Scans [m].
+      weight_table (float array): Kernel weights indexed by [height bin, offset, depth].
+      position_table (float array): Fractional sample index of the travel times indexed by [height bin, offset, depth].
+      trace_bins (int array): Height bin of every trace of the B-Scans with shape (lines, qx).
+      dt (float): Time step [s].
+      depth_indexes (int array): Indexes over the z-axis of the migrated points.
+      max_frequency (float): Highest frequency of the traces used by the interpolation [Hz] (all of them if not given).
+    """
+    n_lines, qx, qt = np.shape(d_b_scans)
+    # The time axis is padded so travel times beyond the traces do not wrap around, and the horizontal axis so the
+    # circular convolution is the same as the linear one
+    nt = 2 * qt
+    n = 2 * qx
+    # Spectrum of the traces weighted by the trapezoidal weights of the horizontal axis, in the precision of the B-Scans
+    weights = trapezoid_weights(x).astype(d_b_scans.dtype)
+    spectrum = np.fft.rfft(d_b_scans * weights[:, np.newaxis], n=nt, axis=2)
+    frequencies = np.arange(0, spectrum.shape[2])
+    # Weights of the positive frequencies in the real inverse transform
+    scale = np.full(len(frequencies), 2.0)
+    scale[0] = 1
+    scale[-1] = 1
+    if max_frequency is not None:
+        band = np.fft.rfftfreq(nt, dt) <= max_frequency
+        spectrum, frequencies, scale = spectrum[:, :, band], frequencies[band], scale[band]
+    spectrum = spectrum * (scale / nt).astype(d_b_scans.dtype)
+    # Offset of every sample of the circular convolution (the kernel is symmetric over the offset)
+    offsets = np.abs(np.fft.fftfreq(n, 1 / n)).astype(int)
+    valid = offsets < qx
+    n_bins = weight_table.shape[0]
+    migrated_images = np.zeros((n_lines, qx, len(depth_indexes)), dtype=d_b_scans.dtype)
+    for b in range(0, n_bins):
+        # Only the traces of the height bin are convolved with its kernels
+        bin_spectrum = spectrum if n_bins == 1 else np.where((trace_bins == b)[:, :, np.newaxis], spectrum, 0)
+        bin_spectrum = np.fft.fft(bin_spectrum, n=n, axis=1)
+        for c, k in enumerate(depth_indexes):
+            # Kernel weight times the phase of the travel time of every offset and frequency
+            kernel = np.zeros((n, len(frequencies)), dtype=bin_spectrum.dtype)
+            kernel[valid] = weight_table[b, offsets[valid], k][:, np.newaxis] * np.exp(
+                1j * 2 * np.pi * np.outer(position_table[b, offsets[valid], k], frequencies) / nt)
+            kernel = np.fft.fft(kernel, axis=0)
+            # Convolution along the horizontal axis summed over all the frequencies
+            convolution = np.fft.ifft(np.einsum('nf,lnf->ln', kernel, bin_spectrum), axis=1)
+            migrated_images[:, :, c] += np.real(convolution[:, :qx])
+    return np.abs(migrated_images)
+
+
+def kirchhoff_migration_2d(b_scan, h_ant, er, t0, tf, dt, x0, xf, qx, z0, zf, angle_table=None, sampling='nearest',
+                           filtered=False, max_angle=None, max_distance=None, points=None, depths=None):
+    """Algorithm for Kirchhoff 2D migration
+    Args:
+      conn (Pipe): Connection pipe with the calling function.
+      b_scan (nested-list float): Amplitudes of the B-Scan (should be pre-processed first).
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      t0 (float): Initial time value [s].
+      tf (float): Final time value [s].
+      dt (float): Time step [s].
+      x0 (float): Initial horizontal axis value [m].
+      xf (float): Final horizontal axis value [m].
+      qx (float): Amount of values over the horizontal axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      angle_table (tuple): Precalculated angle tables from transmission_angles_table_2d. They are calculated for the
+        B-Scan grid if not given.
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      filtered (bool): Whether the B-Scan was already filtered by half_derivative_2d.
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      points (slice): Points over the horizontal axis of the migrated image to calculate (all of them if not given).
+      depths (slice): Points over the z-axis of the migrated image to calculate (all of them if not given).
+    """
+    # Speed of light constant definition and calculation of propagation velocity in ground
+    c0 = 3e8  # [m/s]
+    vp = c0 / np.sqrt(er)  # [m/s]
+    # Creation of time and space arrays
+    x = np.linspace(x0, xf, qx)
+    t = time_axis(t0, tf, dt, len(b_scan[0]))
+    z = np.arange(z0, zf, dt * vp)
+    # Calculate half-derivative term and its multiplication with the B-Scan
+    d_b_scan = b_scan if filtered else half_derivative_2d(b_scan, dt)
+    weight_table, position_table, offset_indexes, max_offset = line_migration_tables(h_ant, er, dt, x, z, t,
+                                                                                     angle_table, max_angle,
+                                                                                     max_distance)
+    # All the traces are in the single height bin of the tables
+    trace_bins = np.zeros(qx, dtype=np.int64)
+    # Connects the pipe to the calculated migrated image
+    return migrate_b_scan(d_b_scan, x, weight_table[np.newaxis], position_table[np.newaxis], offset_indexes,
+                          max_offset, trace_bins, SAMPLING_MODES.index(sampling), points, depths)
+
+
+class MigrationPlan:
+    """Geometry-dependent precomputation of the two-pass Kirchhoff migration of a C-Scan grid. Axes, half-derivative
+    term and the tables of both migration directions are calculated once and reused by every B-Scan and block migrated
+    with the plan, and by later migrations of surveys with the same geometry.
+    """
+
+    def __init__(self, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, qt, z0, zf, max_angle=None, max_distance=None,
+                 heights=None, height_step=HEIGHT_STEP, dtype=np.float64):
+        """Builds the plan for a C-Scan grid
+        Args:
+          h_ant (float): Height of the antennas from ground [m].
+          er (float): Ground apparent relative permittivity.
+          t0 (float): Initial time value [s].
+          tf (float): Final time value [s].
+          dt (float): Time step [s].
+          x0 (float): Initial x-axis value [m].
+          xf (float): Final x-axis value [m].
+          qx (float): Amount of values over the x-axis.
+          y0 (float): Initial y-axis value [m].
+          yf (float): Final y-axis value [m].
+          qy (float): Amount of values over the y-axis.
+          qt (int): Amount of values over the time axis.
+          z0 (float): Initial z-axis value [m].
+          zf (float): Final z-axis value [m].
+          max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+            given).
+          max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+          heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy) (h_ant for
+            all of them if not given).
+          height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+          dtype (type): Precision of the filtered B-Scans, the tables and the migrated images (np.float64 or
+            np.float32).
+        """
+        self.geometry = (h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, qt, z0, zf, max_angle, max_distance)
+        self.heights = None if heights is None else np.array(heights, dtype=float)
+        self.height_step = height_step
+        self.dt = dt
+        self.dtype = dtype
+        # Speed of light constant definition and calculation of propagation velocity in ground
+        c0 = 3e8  # [m/s]
+        vp = c0 / np.sqrt(er)  # [m/s]
+        # Creation of time and space arrays
+        self.x = np.linspace(x0, xf, qx)
+        self.y = np.linspace(y0, yf, qy)
+        self.t = time_axis(t0, tf, dt, qt)
+        self.z = np.arange(z0, zf, dt * vp)
+        self.half_der = half_derivative_term_2d(qt, dt)
+        # Traces are grouped by height, the height bins of a B-Scan of each direction are a row of its array
+        bin_heights, trace_bins = height_bins(h_ant, (qx, qy), heights, height_step)
+        self.bins = {'x': trace_bins, 'y': np.ascontiguousarray(trace_bins.T)}
+        # Tables of each direction (planes of fixed x migrate along y and vice versa) for every height bin
+        self.axes = {'x': self.y, 'y': self.x}
+        bin_tables = {'x': [], 'y': []}
+        for h in bin_heights:
+            x_angle_table, y_angle_table = build_angle_tables(er, h, x0, xf, qx, y0, yf, qy, self.z)
+            for axis, axis_values, angle_table in (('x', self.y, y_angle_table), ('y', self.x, x_angle_table)):
+                bin_tables[axis].append(line_migration_tables(h, er, dt, axis_values, self.z, self.t, angle_table,
+                                                              max_angle, max_distance))
+        self.tables = {}
+        for axis, tables in bin_tables.items():
+            weight_table = np.stack([table[0] for table in tables]).astype(dtype)
+            position_table = np.stack([table[1] for table in tables]).astype(dtype)
+            self.tables[axis] = (weight_table, position_table, tables[0][2], max(table[3] for table in tables))
+
+    def matches(self, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, qt, z0, zf, max_angle=None, max_distance=None,
+                heights=None, height_step=HEIGHT_STEP):
+        """Checks whether the plan was built for the given geometry (same arguments as the constructor)"""
+        if self.geometry != (h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, qt, z0, zf, max_angle, max_distance):
+            return False
+        if heights is None or self.heights is None:
+            return heights is None and self.heights is None
+        return height_step == self.height_step and np.array_equal(np.asarray(heights, dtype=float), self.heights)
+
+    def filter(self, scan):
+        """Applies the half-derivative filter of the 2D migration to a B-Scan or a whole C-Scan
+        Args:
+          scan (float array): Amplitudes of the B-Scan or C-Scan.
+        """
+        return half_derivative_2d(np.asarray(scan, dtype=self.dtype), self.dt, self.half_der)
+
+    def migrate_line(self, axis, b_scan, sampling='nearest', filtered=False, points=None, depths=None, line=None):
+        """Migrates a B-Scan of the C-Scan
+        Args:
+          axis (string): Direction of the B-Scan ('x' for the planes of fixed x, 'y' for the planes of fixed y).
+          b_scan (float array): Amplitudes of the B-Scan.
+          sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+          filtered (bool): Whether the B-Scan was already filtered by the plan.
+          points (slice): Points over the horizontal axis of the migrated image to calculate (all of them if not given).
+          depths (slice): Points over the z-axis of the migrated image to calculate (all of them if not given).
+          line (int): Index of the plane of the B-Scan over the axis, used to read the heights of its traces. It is only
+            needed if the traces of the plan are at different heights.
+        """
+        d_b_scan = b_scan if filtered else self.filter(b_scan)
+        trace_bins = self.line_bins(axis, line)
+        return migrate_b_scan(d_b_scan, self.axes[axis], *self.tables[axis], trace_bins, SAMPLING_MODES.index(sampling),
+                              points, depths)
+
+    def migrate_lines(self, axis, b_scans, sampling='nearest', filtered=False, points=None, depths=None,
+                      engine='direct', max_frequency=None, lines=None):
+        """Migrates a stack of B-Scans of the C-Scan at once
+        Args:
+          axis (string): Direction of the B-Scans ('x' for the planes of fixed x, 'y' for the planes of fixed y).
+          b_scans (float array): Amplitudes of the B-Scans with shape (lines, traces, time).
+          sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+          filtered (bool): Whether the B-Scans were already filtered by the plan.
+          points (slice): Points over the horizontal axis of the migrated images to calculate (all of them if not
+            given).
+          depths (slice): Points over the z-axis of the migrated images to calculate (all of them if not given).
+          engine (string): Engine of the sum over the antennas (one of ENGINES). The fft engine samples the traces by
+            Fourier interpolation instead of the sampling method.
+          max_frequency (float): Highest frequency of the traces used by the fft engine [Hz] (all of them if not given).
+          lines (int array): Index of the plane of every B-Scan over the axis, used to read the heights of their traces
+            (all the planes of the axis in order if not given).
+        """
+        d_b_scans = np.ascontiguousarray(b_scans if filtered else self.filter(b_scans), dtype=self.dtype)
+        axis_values = self.axes[axis]
+        weight_table, position_table, _, max_offset = self.tables[axis]
+        trace_bins = self.bins[axis][np.arange(0, len(d_b_scans)) if lines is None else lines]
+        point_indexes = np.arange(0, len(axis_values))[points if points is not None else slice(None)]
+        depth_indexes = np.arange(0, len(self.z))[depths if depths is not None else slice(None)]
+        if engine == 'fft':
+            return migrate_b_scans_fft(d_b_scans, axis_values, weight_table, position_table, trace_bins, self.dt,
+                                       depth_indexes, max_frequency)[:, point_indexes, :]
+        return migrate_b_scans(d_b_scans, axis_values, weight_table, position_table, trace_bins, max_offset,
+                               point_indexes, depth_indexes, SAMPLING_MODES.index(sampling))
+
+    def line_bins(self, axis, line=None):
+        """Returns the height bins of the traces of a B-Scan of the C-Scan
+        Args:
+          axis (string): Direction of the B-Scan ('x' for the planes of fixed x, 'y' for the planes of fixed y).
+          line (int): Index of the plane of the B-Scan over the axis (only needed if the traces of the plan are at
+            different heights).
+        """
+        if line is None:
+            if self.tables[axis][0].shape[0] > 1:
+                raise Exception("The index of the B-Scan is needed to migrate traces at different heights")
+            return np.zeros(len(self.axes[axis]), dtype=np.int64)
+        return self.bins[axis][line]
+
+
+def migration_plan(plan, c_scan, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, max_angle=None,
+                   max_distance=None, heights=None, height_step=HEIGHT_STEP):
+    """Returns the migration plan of a C-Scan, building it if not given
+    Args:
+      plan (MigrationPlan): Plan to reuse, checked against the geometry of the C-Scan.
+      c_scan (float array): Amplitudes of the C-Scan. The plan is built in its precision. The rest of the arguments are
+        the same as MigrationPlan.
+    """
+    geometry = (h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, np.shape(c_scan)[2], z0, zf, max_angle, max_distance,
+                heights, height_step)
+    if plan is None:
+        # Single precision C-Scans are migrated in single precision
+        return MigrationPlan(*geometry, dtype=np.result_type(np.asarray(c_scan).dtype, np.float32))
+    if not plan.matches(*geometry):
+        raise Exception("The migration plan was built for a different geometry")
+    return plan
+
+
+@jit(nopython=True, parallel=True)
+def add_cross_line(cross_sums, d_line, index, x, weight_table, position_table, line_bins, max_offset, sampling):
+    """Adds the contribution of a new line of a survey to the signed cross-line sums of the points whose aperture
+    includes it. Every sum of migrate_b_scans is a trapezoidal integral, that is, a weighted sum of the kernels of the
+    lines it spans, so a new line only adds its own term to the points it reaches
+    Args:
+      cross_sums (float array): Signed cross-line sums updated in place, indexed by [point, line trace, depth].
+      d_line (float array): Amplitudes of the new line filtered by half_derivative_2d with shape (traces, time).
+      index (int): Index of the new line over the cross-line axis.
+      x (float array): Cross-line axis [m].
+      weight_table (float array): Kernel weights indexed by [height bin, offset, depth].
+      position_table (float array): Fractional sample index of the travel times indexed by [height bin, offset, depth].
+      line_bins (int array): Height bin of every trace of the new line.
+      max_offset (int): Largest offset index summed for a point.
+      sampling (int): Index of the sampling method in SAMPLING_MODES.
+    """
+    n_points, n_traces, qz = cross_sums.shape
+    start, end = max(0, index - max_offset), min(n_points, index + max_offset + 1)
+    for t in prange(0, n_traces):
+        b = line_bins[t]
+        for i in range(start, end):
+            # Trapezoid weight of the line in the integral of the point, which spans the lines within its own offsets
+            lo, hi = max(0, i - max_offset), min(n_points, i + max_offset + 1)
+            line_weight = 0.0
+            if index > lo:
+                line_weight += (x[index] - x[index - 1]) / 2
+            if index < hi - 1:
+                line_weight += (x[index + 1] - x[index]) / 2
+            offset = abs(index - i)
+            for k in range(0, qz):
+                weight = weight_table[b, offset, k]
+                if weight != 0:
+                    cross_sums[i, t, k] += line_weight * weight * sample_trace(d_line[t], position_table[b, offset, k],
+                                                                               sampling)
+
+
+class IncrementalMigration:
+    """Two-pass Kirchhoff migration of a C-Scan that is updated every time a scan line of the survey is completed, so a
+    migrated preview is available while the survey is still running. The along-line migration of a new line is
+    calculated once, and only the term of the new line is added to the cross-line sums of the points within its
+    aperture, so every line costs the same whatever the lines received before. When all the lines have been added the
+    migrated image is the one of kirchhoff_migration_3d_batched (up to the rounding of the order of the sums).
+    """
+
+    def __init__(self, plan, sampling='nearest', line_axis='x', monitor=None):
+        """Starts the migration of a survey with empty lines
+        Args:
+          plan (MigrationPlan): Migration plan of the geometry of the survey.
+          sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+          line_axis (string): Axis the lines of the survey are fixed on ('x' for lines along y at a fixed x, 'y' for
+            lines along x at a fixed y).
+          monitor (MigrationMonitor): Monitor the added lines are reported to (no report if not given).
+        """
+        if line_axis not in ('x', 'y'):
+            raise Exception("The axis of the lines must be 'x' or 'y'")
+        self.plan = plan
+        self.sampling = sampling
+        self.line_axis = line_axis
+        self.cross_axis = 'y' if line_axis == 'x' else 'x'
+        self.monitor = monitor
+        # Migrated images are stored line by line, indexed by [line, trace, depth]
+        n_lines, n_traces = len(plan.axes[self.cross_axis]), len(plan.axes[line_axis])
+        qz = len(plan.z)
+        self.along_image = np.zeros((n_lines, n_traces, qz), dtype=plan.dtype)
+        self.cross_image = np.zeros((n_lines, n_traces, qz), dtype=plan.dtype)
+        # Signed cross-line sums, kept in double precision so the rounding of the lines added one by one does not grow
+        # with the survey
+        self.cross_sums = np.zeros((n_lines, n_traces, qz))
+        self.received = np.zeros(n_lines, dtype=bool)
+        # A new line changes the cross-line migration of the points up to the largest offset summed for a point
+        self.max_offset = plan.tables[self.cross_axis][3]
+        if monitor is not None:
+            monitor.begin_work(n_lines, 'lines', n_lines * n_traces * qz)
+
+    def add_line(self, index, b_scan, filtered=False):
+        """Adds a completed line of the survey and updates the migrated image
+        Args:
+          index (int): Index of the line over its fixed axis.
+          b_scan (float array): Amplitudes of the traces of the line in the time domain with shape (traces, time).
+          filtered (bool): Whether the line was already filtered by the plan.
+        Returns:
+          slice: Lines of the migrated image that changed.
+        """
+        tic = time.perf_counter()
+        if self.received[index]:
+            raise Exception("The line {} was already added to the migration".format(index))
+        d_line = np.ascontiguousarray(b_scan if filtered else self.plan.filter(b_scan), dtype=self.plan.dtype)
+        self.received[index] = True
+        # Along-line migration of the new line only
+        self.along_image[index] = self.plan.migrate_lines(self.line_axis, d_line[np.newaxis], self.sampling,
+                                                          filtered=True, lines=[index])[0]
+        # Term of the new line in the cross-line sums of the points whose aperture includes it
+        weight_table, position_table, _, _ = self.plan.tables[self.cross_axis]
+        add_cross_line(self.cross_sums, d_line, index, self.plan.axes[self.cross_axis], weight_table, position_table,
+                       np.ascontiguousarray(self.plan.bins[self.cross_axis][:, index]), self.max_offset,
+                       SAMPLING_MODES.index(self.sampling))
+        changed = slice(max(0, index - self.max_offset), min(len(self.received), index + self.max_offset + 1))
+        self.cross_image[changed] = np.abs(self.cross_sums[changed])
+        if self.monitor is not None:
+            self.monitor.add_stage_time('summation', time.perf_counter() - tic)
+            self.monitor.advance()
+        return changed
+
+    def complete(self):
+        """Checks whether all the lines of the survey have been added"""
+        return bool(np.all(self.received))
+
+    def image(self):
+        """Returns the migrated image of the lines added so far indexed by [x, y, z] (zero over the missing lines)"""
+        migrated_image = np.multiply(self.along_image, self.cross_image)
+        return migrated_image if self.line_axis == 'x' else np.swapaxes(migrated_image, 0, 1)
+
+    def store(self, folder, title):
+        """Stores the migrated image of the lines added so far as a migrated image file
+        Args:
+          folder (string): Folder/directory where to store the migrated image.
+          title (string): Title for the migrated image file.
+        """
+        h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, qt, z0, zf, max_angle, max_distance = self.plan.geometry
+        store_migration_file(folder, title, self.image(), h_ant, er, x0, xf, qx, y0, yf, qy, z0, zf, len(self.plan.z),
+                             max_angle, max_distance, self.plan.heights, self.plan.height_step)
+
+
+def create_shared_array(shape, dtype=np.float64):
+    """Creates a float array stored in a shared memory block that can be attached by the worker processes
+    Args:
+      shape (tuple int): Shape of the array.
+      dtype (type): Type of the values of the array.
+    Returns:
+      shm (SharedMemory): Shared memory block of the array (must be closed and unlinked by the caller).
+      array (float array): Array stored in the shared memory block, initialized with zeros.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    array[:] = 0
+    return shm, array
+
+
+# Shared memory blocks and migration parameters attached by each worker process of kirchhoff_migration_3d_parallel
+_worker_state = {}
+
+
+def init_shared_migration_worker(shared_arrays, plan, sampling, filtered):
+    """Initializer of the worker processes. Attaches the shared C-Scan and migrated images.
+    Args:
+      shared_arrays (dict): Name of the shared memory block, shape and type of every shared array by key.
+      plan (MigrationPlan): Migration plan of the C-Scan.
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      filtered (bool): Whether the shared C-Scan was already filtered by the plan.
+    """
+    for key, (name, shape, dtype) in shared_arrays.items():
+        shm = shared_memory.SharedMemory(name=name)
+        # The block is kept referenced in the state so it is not released while the worker is alive
+        _worker_state[key] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    _worker_state['plan'] = plan
+    _worker_state['line_options'] = {'sampling': sampling, 'filtered': filtered}
+
+
+def migrate_shared_line(axis, index):
+    """Migrates a B-Scan of the shared C-Scan and writes the result straight into the shared migrated image
+    Args:
+      axis (string): Direction of the B-Scan ('x' for the planes of fixed x, 'y' for the planes of fixed y).
+      index (int): Index of the plane over the axis.
+    Returns:
+      busy (float): Time spent by the worker on the B-Scan [s].
+    """
+    tic = time.perf_counter()
+    c_scan = _worker_state['c_scan'][1]
+    plan = _worker_state['plan']
+    if axis == 'x':
+        _worker_state['image_one'][1][index, :, :] = plan.migrate_line('x', c_scan[index, :, :], line=index,
+                                                                       **_worker_state['line_options'])
+    else:
+        _worker_state['image_two'][1][:, index, :] = plan.migrate_line('y', c_scan[:, index, :], line=index,
+                                                                       **_worker_state['line_options'])
+    return time.perf_counter() - tic
+
+
+def migrate_shared_tile(tile):
+    """Migrates a block of voxels of the two-pass migration from the B-Scans of the shared C-Scan that cross it
+    Args:
+      tile (tuple): Index of the block in the grid of blocks and slices over the x-, y- and z-axis of the block (as
+        given by migration_tiles).
+    Returns:
+      tile_index (tuple int): Index of the block in the grid of blocks.
+      tile (float array): Migrated image over the block.
+      busy (float): Time spent by the worker on the block [s].
+    """
+    tic = time.perf_counter()
+    tile_index, x_slice, y_slice, z_slice = tile
+    c_scan = _worker_state['c_scan'][1]
+    plan = _worker_state['plan']
+    tile_shape = (x_slice.stop - x_slice.start, y_slice.stop - y_slice.start, z_slice.stop - z_slice.start)
+    tile_one = np.zeros(tile_shape, dtype=plan.dtype)
+    tile_two = np.zeros(tile_shape, dtype=plan.dtype)
+    # Planes of fixed x migrate along y only over the points of the block and vice versa
+    for a, i in enumerate(range(x_slice.start, x_slice.stop)):
+        tile_one[a, :, :] = plan.migrate_line('x', c_scan[i, :, :], **_worker_state['line_options'], points=y_slice,
+                                              depths=z_slice, line=i)
+    for b, j in enumerate(range(y_slice.start, y_slice.stop)):
+        tile_two[:, b, :] = plan.migrate_line('y', c_scan[:, j, :], **_worker_state['line_options'], points=x_slice,
+                                              depths=z_slice, line=j)
+    return tile_index, np.multiply(tile_one, tile_two), time.perf_counter() - tic
+
+
+def kirchhoff_migration_3d_parallel(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                    sampling='nearest', workers=None, filtered=False, max_angle=None,
+                                    max_distance=None, plan=None, heights=None, height_step=HEIGHT_STEP, monitor=None):
+    """Algorithm for Kirchhoff 3D migration. Calls parallel 2D migrations.
+    Args:
+      c_scan_scalars (nested-list float): Amplitudes of the C-Scan (should be pre-processed first).
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      t0 (float): Initial time value [s].
+      tf (float): Final time value [s].
+      dt (float): Time step [s].
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of worker processes (all the available CPUs if not given).
+      filtered (bool): Whether the C-Scan was already filtered by half_derivative_2d.
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      plan (MigrationPlan): Migration plan of a previous migration with the same geometry (it is built if not given).
+      heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy) (h_ant for all
+        of them if not given).
+      height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
+    """
+    # Speed of light constant definition and calculation of propagation velocity in ground
+    c0 = 3e8  # [m/s]
+    vp = c0 / np.sqrt(er)  # [m/s]
+    # Creation of time and space arrays
+    z = np.arange(z0, zf, dt * vp)
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    # Axes, filter and tables are built once for the whole C-Scan and shared by every B-Scan of both migration
+    # directions
+    with monitor.stage('tables'):
+        plan = migration_plan(plan, c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, max_angle,
+                              max_distance, heights, height_step)
+    # The C-Scan and the migrated images of both directions are placed in shared memory. Workers read the B-Scans from
+    # it and write the migrated planes straight into it, so no volume data is sent through the pool
+    shared_blocks = []
+    c_scan_shared = migrated_image_one = migrated_image_two = None
+    try:
+        shm, c_scan_shared = create_shared_array(np.shape(c_scan_scalars), plan.dtype)
+        shared_blocks.append(shm)
+        # The C-Scan is filtered once as a whole instead of B-Scan by B-Scan
+        with monitor.stage('half-derivative'):
+            c_scan_shared[:] = c_scan_scalars if filtered else plan.filter(c_scan_scalars)
+        shm, migrated_image_one = create_shared_array((qx, qy, len(z)), plan.dtype)
+        shared_blocks.append(shm)
+        shm, migrated_image_two = create_shared_array((qx, qy, len(z)), plan.dtype)
+        shared_blocks.append(shm)
+        shared_arrays = {'c_scan': (shared_blocks[0].name, c_scan_shared.shape, plan.dtype),
+                         'image_one': (shared_blocks[1].name, migrated_image_one.shape, plan.dtype),
+                         'image_two': (shared_blocks[2].name, migrated_image_two.shape, plan.dtype)}
+        processes = workers or os.cpu_count()
+        with monitor.stage('summation'), POOL_CONTEXT.Pool(processes=processes,
+                                                           initializer=init_shared_migration_worker,
+                                                           initargs=(shared_arrays, plan, sampling, True)) as pool:
+            monitor.begin_work(qx + qy, 'B-Scans', qx * qy * len(z), processes)
+            # Migrations over both directions are queued at once as they write into different images
+            results = [pool.apply_async(migrate_shared_line, args=('x', i)) for i in range(0, qx)]
+            results += [pool.apply_async(migrate_shared_line, args=('y', j)) for j in range(0, qy)]
+            for result in results:
+                monitor.advance(busy=result.get())
+        # Multiples the two migrated images to create the 3D migration
+        migrated_image_full = np.multiply(migrated_image_one, migrated_image_two)
+    finally:
+        # Releases the shared memory blocks
+        del c_scan_shared, migrated_image_one, migrated_image_two
+        for shm in shared_blocks:
+            shm.close()
+            shm.unlink()
+    if own_monitor:
+        monitor.finish()
+    # Returns the migrated image and the length of the z-axis
+    return migrated_image_full, len(z)
+
+def kirchhoff_migration_3d_batched(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                   sampling='nearest', workers=None, filtered=False, max_angle=None, max_distance=None,
+                                   plan=None, engine='direct', max_frequency=None, heights=None,
+                                   height_step=HEIGHT_STEP, monitor=None):
+    """Algorithm for Kirchhoff 3D migration as two-pass 2D migrations. The B-Scans of each direction are migrated by a
+    compiled multi-threaded kernel in a few batches, used to report the progress.
+    Args:
+      c_scan_scalars (nested-list float): Amplitudes of the C-Scan (should be pre-processed first).
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      t0 (float): Initial time value [s].
+      tf (float): Final time value [s].
+      dt (float): Time step [s].
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of threads used by the compiled kernel (all the available threads if not given).
+      filtered (bool): Whether the C-Scan was already filtered by half_derivative_2d.
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      plan (MigrationPlan): Migration plan of a previous migration with the same geometry (it is built if not given).
+      engine (string): Engine of the sum over the antennas (one of ENGINES).
+      max_frequency (float): Highest frequency of the traces used by the fft engine [Hz] (all of them if not given).
+      heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy) (h_ant for all
+        of them if not given).
+      height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
+    """
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    with monitor.stage('tables'):
+        plan = migration_plan(plan, c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, max_angle,
+                              max_distance, heights, height_step)
+    # The C-Scan is filtered once for both directions
+    with monitor.stage('half-derivative'):
+        d_c_scan = np.asarray(c_scan_scalars, dtype=plan.dtype) if filtered else plan.filter(c_scan_scalars)
+    # Sets the amount of threads of the compiled kernel
+    if workers is not None:
+        set_num_threads(workers)
+    # Planes of fixed x migrate along y and planes of fixed y (the C-Scan with the x- and y-axis swapped) along x. The
+    # fft engine migrates all the B-Scans of a direction at once as its kernels are shared by all of them
+    scans = {'x': d_c_scan, 'y': np.swapaxes(d_c_scan, 0, 1)}
+    batches = {axis: [np.arange(0, len(scan))] if engine == 'fft' else
+               np.array_split(np.arange(0, len(scan)), min(len(scan), PROGRESS_STEPS)) for axis, scan in scans.items()}
+    migrated_images = {}
+    with monitor.stage('summation'):
+        monitor.begin_work(len(batches['x']) + len(batches['y']), 'batches of B-Scans', qx * qy * len(plan.z),
+                           get_num_threads())
+        for axis, scan in scans.items():
+            images = []
+            for batch in batches[axis]:
+                images.append(plan.migrate_lines(axis, scan[batch[0]:batch[-1] + 1], sampling, filtered=True,
+                                                 engine=engine, max_frequency=max_frequency, lines=batch))
+                monitor.advance()
+            migrated_images[axis] = np.concatenate(images)
+    # Multiples the two migrated images to create the 3D migration
+    migrated_image_full = np.multiply(migrated_images['x'], np.swapaxes(migrated_images['y'], 0, 1))
+    if own_monitor:
+        monitor.finish()
+    # Returns the migrated image and the length of the z-axis
+    return migrated_image_full, len(plan.z)
+
+
+def kirchhoff_migration_3d_new_parallel(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                        sampling='nearest', workers=None, filtered=False, max_angle=None,
+                                        max_distance=None, heights=None, height_step=HEIGHT_STEP, monitor=None):
+    """Algorithm for full Kirchhoff 3D migration (--mode 3d). Migrates the whole C-Scan with the compiled kernel of
+    kirchhoff_migration_3d and returns it as the two-pass migrations do.
+    Args:
+      c_scan_scalars (nested-list float): Amplitudes of the C-Scan (should be pre-processed first).
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      t0 (float): Initial time value [s].
+      tf (float): Final time value [s].
+      dt (float): Time step [s].
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of threads used by the compiled kernel (all the available threads if not given).
+      filtered (bool): Whether the C-Scan was already filtered by half_derivative_3d.
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy) (h_ant for all
+        of them if not given).
+      height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
+    Returns:
+      migrated_image (float array): Migrated image amplitudes with shape (qx, qy, qz).
+      qz (int): Amount of values over the z-axis (z = np.arange(z0, zf, dt * vp)).
+    """
+    c0 = 3e8  # [m/s]
+    vp = c0 / np.sqrt(er)  # [m/s]
+    # Creation of time and space arrays
+    z = np.arange(z0, zf, dt * vp)
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    migrated_image_full = kirchhoff_migration_3d(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                                 sampling, workers, filtered=filtered, max_angle=max_angle,
+                                                 max_distance=max_distance, heights=heights, height_step=height_step,
+                                                 monitor=monitor)
+    if own_monitor:
+        monitor.finish()
+    # Returns the migrated image and the length of the z-axis
+    return migrated_image_full, len(z)
+
+def kirchhoff_migration_polarizations(c_scans, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, mode='2d',
+                                      sampling='nearest', workers=None, max_angle=None, max_distance=None,
+                                      engine='direct', max_frequency=None, heights=None, height_step=HEIGHT_STEP,
+                                      monitor=None):
+    """Migrates several C-Scans of the same grid (the polarizations of a survey) in a single pass. The tables are
+    calculated once for all of them, and the 2d mode migrates the B-Scans of all the C-Scans in the same compiled calls
+    (the fft engine also shares its kernels between them).
+    Args:
+      c_scans (list float array): Amplitudes of the C-Scans (should be pre-processed first).
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      t0 (float): Initial time value [s].
+      tf (float): Final time value [s].
+      dt (float): Time step [s].
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      mode (string): Migration mode ('2d' for two-pass 2D migrations or '3d' for full 3D migration).
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of threads used by the compiled kernels (all the available threads if not given).
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      engine (string): Engine of the sum over the antennas of the 2d mode (one of ENGINES).
+      max_frequency (float): Highest frequency of the traces used by the fft engine [Hz] (all of them if not given).
+      heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy) (h_ant for all
+        of them if not given).
+      height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
+    Returns:
+      migrated_images (list float array): Migrated image of every C-Scan.
+      qz (int): Amount of values over the z-axis.
+    """
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    # Sets the amount of threads of the compiled kernels
+    if workers is not None:
+        set_num_threads(workers)
+    if mode == "3d":
+        # The first C-Scan is filtered with the tables, the rest of them are filtered in the same precision
+        d_c_scan, weight_table, position_table, trace_bins, x_weights, y_weights, x_aperture, y_aperture = \
+            prepare_migration_3d(c_scans[0], h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                 max_angle=max_angle, max_distance=max_distance, heights=heights,
+                                 height_step=height_step, monitor=monitor)
+        with monitor.stage('half-derivative'):
+            d_c_scans = [d_c_scan] + [np.ascontiguousarray(half_derivative_3d(c_scan, dt), dtype=d_c_scan.dtype)
+                                      for c_scan in c_scans[1:]]
+        qz = weight_table.shape[3]
+        migrated_images = [np.zeros((qx, qy, qz), dtype=d_c_scan.dtype) for _ in c_scans]
+        slabs = np.array_split(np.arange(qx), min(qx, PROGRESS_STEPS))
+        with monitor.stage('summation'):
+            monitor.begin_work(len(slabs), 'x-slabs', len(c_scans) * qx * qy * qz, get_num_threads())
+            for slab in slabs:
+                for d_c_scan, migrated_image in zip(d_c_scans, migrated_images):
+                    migrated_image[slab[0]:slab[-1] + 1] = migrate_volume_3d(
+                        d_c_scan, weight_table, position_table, trace_bins, x_weights, y_weights, slab, np.arange(qy),
+                        np.arange(qz), x_aperture, y_aperture, SAMPLING_MODES.index(sampling), COLUMN_CHUNK_SIZE)
+                monitor.advance()
+    else:
+        with monitor.stage('tables'):
+            plan = migration_plan(None, c_scans[0], h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, max_angle,
+                                  max_distance, heights, height_step)
+        with monitor.stage('half-derivative'):
+            d_c_scans = [plan.filter(c_scan) for c_scan in c_scans]
+        qz = len(plan.z)
+        # Planes of fixed x migrate along y and planes of fixed y along x. Every batch holds the same planes of all the
+        # C-Scans, one C-Scan after the other
+        scans = {'x': d_c_scans, 'y': [np.swapaxes(d_c_scan, 0, 1) for d_c_scan in d_c_scans]}
+        batches = {axis: [np.arange(0, len(scan[0]))] if engine == 'fft' else
+                   np.array_split(np.arange(0, len(scan[0])), min(len(scan[0]), PROGRESS_STEPS))
+                   for axis, scan in scans.items()}
+        migrated_images = {}
+        with monitor.stage('summation'):
+            monitor.begin_work(len(batches['x']) + len(batches['y']), 'batches of B-Scans',
+                               len(c_scans) * qx * qy * qz, get_num_threads())
+            for axis, axis_scans in scans.items():
+                images = []
+                for batch in batches[axis]:
+                    b_scans = np.concatenate([scan[batch[0]:batch[-1] + 1] for scan in axis_scans])
+                    images.append(np.split(plan.migrate_lines(axis, b_scans, sampling, filtered=True, engine=engine,
+                                                              max_frequency=max_frequency,
+                                                              lines=np.tile(batch, len(c_scans))), len(c_scans)))
+                    monitor.advance()
+                migrated_images[axis] = [np.concatenate([image[n] for image in images]) for n in range(len(c_scans))]
+        # Multiples the two migrated images of every C-Scan to create its 3D migration
+        migrated_images = [np.multiply(image_x, np.swapaxes(image_y, 0, 1))
+                           for image_x, image_y in zip(migrated_images['x'], migrated_images['y'])]
+    if own_monitor:
+        monitor.finish()
+    return migrated_images, qz
+
+
+def fuse_polarizations(migrated_images, fusion):
+    """Fuses the migrated images of the polarizations of a survey into a single image
+    Args:
+      migrated_images (list float array): Migrated image of every polarization.
+      fusion (string): Fusion method (one of FUSION_METHODS): 'sum' of the amplitudes, 'product' of the amplitudes
+        (keeps the reflectors seen by every polarization) or 'max' of the amplitudes.
+    """
+    if fusion == 'sum':
+        return np.sum(migrated_images, axis=0)
+    if fusion == 'product':
+        return np.prod(migrated_images, axis=0)
+    if fusion == 'max':
+        return np.max(migrated_images, axis=0)
+    raise Exception(f"Unknown fusion method: {fusion}")
+
+
+def frequency_time_step(f, df):
+    """Calculates the time step of the traces obtained from a one-sided spectrum by gpr20_ifft.inverse_fast_fourier
+    (zero-padded from f = 0 and mirrored into the negative frequencies)
+    Args:
+      f (float array): Frequencies of the spectrum [Hz].
+      df (float): Frequency step [Hz].
+    """
+    return 1 / (2 * len(np.arange(0, f[-1], df)) * df)
+
+
+def frequency_back_projection_lines(spectra, x, f, h_ant, er, z, max_angle=None, max_distance=None, monitor=None):
+    """Two-pass back-projection of a stack of B-Scans straight from the spectra of their traces. For a depth, the sum
+    over the antennas and the frequencies of every point is the product of a kernel matrix (points by antennas and
+    frequencies) with the spectra of the B-Scans, so all the B-Scans sharing the geometry are migrated by one complex
+    matrix product per depth.
+    Args:
+      spectra (complex array): Spectra of the traces of the B-Scans, already windowed and filtered, with shape
+        (lines, traces, frequencies).
+      x (float array): Horizontal axis of the B-Scans [m].
+      f (float array): Frequencies of the spectra [Hz].
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      z (float array): z-axis of the migrated image [m].
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      monitor (MigrationMonitor): Monitor the migrated depths are reported to (no report if not given).
+    Returns:
+      migrated_images (float array): Migrated images of the B-Scans with shape (lines, points, depths).
+    """
+    n_lines, qx, nf = spectra.shape
+    # Travel times (the position table in seconds from t = 0) and kernel weights of every offset and depth, shared
+    # with the time-domain migration
+    weight_table, travel_times, offset_indexes, _ = line_migration_tables(h_ant, er, 1.0, x, z, np.zeros(1),
+                                                                          max_angle=max_angle,
+                                                                          max_distance=max_distance)
+    # Trapezoidal integral over the antennas, as the time-domain migration
+    weights = trapezoid_weights(x)
+    migrated_images = np.zeros((n_lines, qx, len(z)), dtype=spectra.real.dtype)
+    # The spectra of all the B-Scans are the columns of the right-hand matrix, frequencies are split in blocks so the
+    # kernel of a depth fits in memory
+    block = max(1, KERNEL_BLOCK_SIZE // (qx * qx))
+    columns = np.ascontiguousarray(np.moveaxis(spectra, 0, -1))
+    for k in range(0, len(z)):
+        integral = np.zeros((qx, n_lines), dtype=spectra.dtype)
+        for start in range(0, nf, block):
+            f_block = f[start:start + block]
+            # Kernel of the depth indexed by [point, antenna, frequency]: phase of the travel time and kernel weight
+            phases = np.exp(2j * np.pi * np.multiply.outer(travel_times[:, k], f_block)).astype(spectra.dtype)
+            kernel = (weight_table[:, k, np.newaxis] * phases)[offset_indexes] * weights[np.newaxis, :, np.newaxis]
+            integral += kernel.reshape(qx, -1) @ columns[:, start:start + block, :].reshape(-1, n_lines)
+        # The traces are the real part of the inverse transform
+        migrated_images[:, :, k] = np.abs(np.real(integral)).T
+        if monitor is not None:
+            monitor.advance()
+    return migrated_images
+
+
+def kirchhoff_migration_frequency(spectra, f, df, h_ant, er, x0, xf, qx, y0, yf, qy, z0, zf, max_angle=None,
+                                  max_distance=None, monitor=None):
+    """Algorithm for Kirchhoff 3D migration as two-pass 2D back-projections in the frequency domain. The C-Scan of S21
+    spectra of a merged frequency-domain file is migrated without calculating its time-domain traces: the Hamming
+    window of gpr20_ifft and the half-derivative filter are applied to the spectra and the travel times become phase
+    tables.
+    Args:
+      spectra (complex array): S21 spectra of the traces indexed by [x, y, frequency].
+      f (float array): Frequencies of the spectra [Hz].
+      df (float): Frequency step [Hz].
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
+    Returns:
+      migrated_image (float array): Migrated image amplitudes.
+      qz (int): Amount of values over the z-axis.
+    """
+    # Speed of light constant definition and calculation of propagation velocity in ground
+    c0 = 3e8  # [m/s]
+    vp = c0 / np.sqrt(er)  # [m/s]
+    # The z-axis is the one of the time-domain migration of the traces given by gpr20_ifft
+    z = np.arange(z0, zf, frequency_time_step(f, df) * vp)
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    # Hamming window of gpr20_ifft, half-derivative filter and amplitude of the inverse transform of the one-sided
+    # spectra (twice the real part over the length of the two-sided spectra)
+    with monitor.stage('half-derivative'):
+        spectra = np.asarray(spectra)
+        scale = 1 / len(np.arange(0, f[-1], df))
+        spectra = spectra * (scale * np.hamming(len(f)) * np.sqrt(1j * 2 * np.pi * f)).astype(spectra.dtype)
+    # Planes of fixed x migrate along y and planes of fixed y along x
+    with monitor.stage('summation'):
+        monitor.begin_work(2 * len(z), 'depths', qx * qy * len(z))
+        image_one = frequency_back_projection_lines(spectra, np.linspace(y0, yf, qy), f, h_ant, er, z, max_angle,
+                                                    max_distance, monitor)
+        image_two = frequency_back_projection_lines(np.swapaxes(spectra, 0, 1), np.linspace(x0, xf, qx), f, h_ant, er,
+                                                    z, max_angle, max_distance, monitor)
+    # Multiples the two migrated images to create the 3D migration
+    migrated_image = np.multiply(image_one, np.swapaxes(image_two, 0, 1))
+    if own_monitor:
+        monitor.finish()
+    return migrated_image, len(z)
+
+
+def write_migration_attributes(output_file, title, h_ant, er, x0, xf, qx, y0, yf, qy, z0, zf, qz, max_angle=None,
+                               max_distance=None, heights=None, height_step=None):
+    """Writes the attributes and the '/Position' group of a migrated image file
+    Args:
+      output_file (h5py.File): Migrated image file opened for writing.
+      title (string): Title for the migrated image file
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      qz (float): Amount of values over the z-axis.
+      max_angle (float): Maximum transmission angle in air of the migration aperture [deg] (no limit if not given).
+      max_distance (float): Maximum lateral distance of the migration aperture [m] (no limit if not given).
+      heights (float array): Height of the antennas from ground of every trace used by the migration [m] with shape
+        (qx, qy) (h_ant for all of them if not given).
+      height_step (float): Height step between the bins the heights of the traces were grouped in [m].
+    """
+    # Creates and populates attributes of the Micreated Image file
+    output_file.attrs['Title'] = title  # Title of the output file
+    output_file.attrs['Relative permittivity'] = er  # Relative permittivity used for migration
+    # Aperture used for migration (90 degrees and infinite distance for the full aperture)
+    output_file.attrs['Aperture angle'] = 90.0 if max_angle is None else max_angle
+    output_file.attrs['Aperture distance'] = np.inf if max_distance is None else max_distance
+    # Creates a group in the .h5 file to store the position of the measurement
+    pos_grp = output_file.create_group('/Position')
+    # Coordinates are stored in meters at the output file under the '/Position' group
+    pos_grp.attrs['x0'] = x0
+    pos_grp.attrs['y0'] = y0
+    pos_grp.attrs['z0'] = z0
+    pos_grp.attrs['xf'] = xf
+    pos_grp.attrs['yf'] = yf
+    pos_grp.attrs['zf'] = zf
+    pos_grp.attrs['qx'] = qx
+    pos_grp.attrs['qy'] = qy
+    pos_grp.attrs['qz'] = qz
+    # Height of the antena values are stored in data-set under '/Position' group
+    pos_grp.attrs['h_ant_mig'] = h_ant
+    if heights is not None:
+        pos_grp.create_dataset('h', (qx, qy), dtype='f4', data=heights, compression="gzip")
+        pos_grp.attrs['h_ant_step'] = height_step
+
+
+def store_migration_file(folder, title, migrated_image, h_ant, er, x0, xf, qx, y0, yf, qy, z0, zf, qz, max_angle=None,
+                         max_distance=None, heights=None, height_step=None):
+    """Stored the result of the 3D migrated image
+    Args:
+      folder (string): Folder/directory where to store the migrated image
+      title (string): Title for the migrated image file
+      migrated image (nested-list float): Migrated image amplitudes.
+      h_ant (float): Height of the antennas from ground [m].
+      er (float): Ground apparent relative permittivity.
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      qz (float): Amount of values over the z-axis.
+      max_angle (float): Maximum transmission angle in air of the migration aperture [deg] (no limit if not given).
+      max_distance (float): Maximum lateral distance of the migration aperture [m] (no limit if not given).
+      heights (float array): Height of the antennas from ground of every trace used by the migration [m] with shape
+        (qx, qy) (h_ant for all of them if not given).
+      height_step (float): Height step between the bins the heights of the traces were grouped in [m].
+    """
+    # Formats the output file name and creates the file
+    output_file_name = folder + '/' + title + '.h5'
+    output_file = h5py.File(output_file_name, 'w')
+    write_migration_attributes(output_file, title, h_ant, er, x0, xf, qx, y0, yf, qy, z0, zf, qz, max_angle,
+                               max_distance, heights, height_step)
+    # A group to store the migrated image '/MigratedImage'
+    mig_grp = output_file.create_group('/MigratedImage')
+    # Migrated image values are stored in data-set under the '/MigratedImage' group
+    mig_grp.create_dataset('Image', (qx, qy, qz), dtype='f4', data=migrated_image, compression="gzip")
+    # Output file is closed with all the information written in it
+    output_file.close()
 
-@jit(nopython=True)
-def transmission_angles_3d(er, h, xp, yp, zp, xc, yc):
-    """Calculates incidence angles with Snell's law
+
+def migration_tiles(qx, qy, qz, tile_size):
+    """Splits the voxels of the migrated image into blocks
     Args:
-      er (float): Ground apparent relative permittivity.
-      h (float): Height of the antennas from ground [m].
-      xp (float): horizontal-coordinate of the point in ground subsurface.
-      zp (float): z-coordinate of the point in ground subsurface.
-      xc (float): horizontal-coordinate of the antenna location.
+      qx (int): Amount of values over the x-axis.
+      qy (int): Amount of values over the y-axis.
+      qz (int): Amount of values over the z-axis.
+      tile_size (tuple int): Maximum amount of voxels of a block over the x-, y- and z-axis.
+    Returns:
+      list: Index of the block in the grid of blocks and slices over the x-, y- and z-axis of every block.
     """
-    # Creates arrays for all the possible transmission angles
-    possible_theta_g = np.linspace(0, np.pi / 2, 2 ** 8)
-    possible_theta_a = np.arcsin(np.minimum(np.sqrt(er) * np.sin(possible_theta_g), np.asarray([1])))
-    # Looks for the solution of the transmission angle equation
-    min_index = np.argmin(np.abs(np.sqrt((xp-xc)**2 +(yp-yc)**2) - zp * np.tan(possible_theta_g) - h * np.tan(possible_theta_a)))
-    # Returns the found transmission angles
-    return possible_theta_a[min_index], possible_theta_g[min_index]
+    tiles = []
+    for n, i in enumerate(range(0, qx, tile_size[0])):
+        for m, j in enumerate(range(0, qy, tile_size[1])):
+            for p, k in enumerate(range(0, qz, tile_size[2])):
+                tiles.append(((n, m, p), slice(i, min(i + tile_size[0], qx)), slice(j, min(j + tile_size[1], qy)),
+                              slice(k, min(k + tile_size[2], qz))))
+    return tiles
 
 
-def kirchhoff_migration_3d(c_scan, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf):
-    """Algorithm for Kirchhoff 2D migration
+def open_tiled_migration_file(output_file_name, title, h_ant, er, x0, xf, qx, y0, yf, qy, z0, zf, qz, tile_size, mode,
+                              sampling, max_angle=None, max_distance=None, heights=None, height_step=None):
+    """Opens the migrated image file of a tiled migration. An existing file of an interrupted migration with the same
+    parameters is reopened to resume it, otherwise the file is created with an empty chunked image.
     Args:
-      conn (Pipe): Connection pipe with the calling function.
-      b_scan (nested-list float): Amplitudes of the B-Scan (should be pre-processed first).
+      output_file_name (string): Path of the migrated image file.
+      title (string): Title for the migrated image file
       h_ant (float): Height of the antennas from ground [m].
       er (float): Ground apparent relative permittivity.
-      t0 (float): Initial time value [s].
-      tf (float): Final time value [s].
-      dt (float): Time step [s].
-      x0 (float): Initial horizontal axis value [m].
-      xf (float): Final horizontal axis value [m].
-      qx (float): Amount of values over the horizontal axis.
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
       z0 (float): Initial z-axis value [m].
       zf (float): Final z-axis value [m].
+      qz (float): Amount of values over the z-axis.
+      tile_size (tuple int): Maximum amount of voxels of a block over the x-, y- and z-axis.
+      mode (string): Migration mode ('2d' or '3d').
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      max_angle (float): Maximum transmission angle in air of the migration aperture [deg] (no limit if not given).
+      max_distance (float): Maximum lateral distance of the migration aperture [m] (no limit if not given).
+      heights (float array): Height of the antennas from ground of every trace used by the migration [m] with shape
+        (qx, qy) (h_ant for all of them if not given).
+      height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+    Returns:
+      output_file (h5py.File): Migrated image file opened for writing.
     """
-    # Speed of light constant definition and calculation of propagation velocity in ground
-    c0 = 3e8  # [m/s]
-    vp = c0 / np.sqrt(er)  # [m/s]
-    # Creation of time and space arrays
-    x = np.linspace(x0, xf, qx)
-    y = np.linspace(y0, yf, qy)
-    t = np.arange(t0, tf, dt)
-    if len(t) != len(c_scan[0, 0]):
-        if len(t) > len(c_scan[0, 0]):
-            t = np.arange(t0, tf - dt, dt)
-        else:
-            t = np.arange(t0, tf + dt, dt)
-    z = np.arange(z0, zf, dt * vp)
-    # Calculate frequency domain array
-    fs = 1 / dt
-    f = np.linspace(-fs / 2, fs / 2, len(t))
-    # Calculate half-derivative term and its multiplication with the B-Scan
-    c_scan_f = np.fft.fftshift(np.fft.fft2(c_scan, axes=[0, 1]), axes=[0, 1])  # B-Scan in the frequency domain
-    half_der = np.tile(1j * 2 * np.pi * f.T, (qx, qy, 1))  # Half derivative term
-    d_c_scan = np.real(np.fft.ifft2(np.fft.ifftshift(half_der * c_scan_f, axes=0), axes=[0, 1]))  # Time domain expression
-    # Create empty array for angles and integration kernel
-
-    # Create empty matrix for the integral kernel
-    #kernel = np.zeros((qx, qy, qx, qy, len(z)))
-    migrated_image = np.zeros((qx, qy, len(z)))
-    processes = [[[0 for k in range(0, len(z))] for j in range(0, qy)] for i in range(0, qx)]
-    pool = mp.Pool(processes=os.cpu_count()-1)
-    for (i, j, k) in itertools.product(range(0, qx), range(0, qy), range(0, len(z))):
-        xp, yp, zp = x[i], y[j], z[k]
-        #print(f"Migrating point ({i}, {j}, {k})")
-        processes[i][j][k] = pool.apply_async(migrate_point_3d, args=(c0, d_c_scan, er, h_ant, qx, qy, t, vp, x, xp, y, yp, zp))
-        #migrated_image[i, j, k] = migrate_point_3d(c0, d_c_scan, er, h_ant, qx, qy, t, vp, x, xp, y, yp, zp)
-
-    for (i, j, k) in itertools.product(range(0, qx), range(0, qy), range(0, len(z))):
-        migrated_image[i, j, k] = processes[i][j][k].get()
-        print(f"Finished migrating point ({i}, {j}, {k})")
-
-    return migrated_image
+    grid = tuple(-(-q // size) for q, size in zip((qx, qy, qz), tile_size))
+    if os.path.isfile(output_file_name):
+        output_file = h5py.File(output_file_name, 'a')
+        # The file is only resumed if it was created by a tiled migration with the same parameters
+        try:
+            pos_attrs = output_file['Position'].attrs
+            mig_attrs = output_file['MigratedImage'].attrs
+            resume = ('Completed tiles' in output_file['MigratedImage']
+                      and np.allclose([output_file.attrs['Relative permittivity'], pos_attrs['h_ant_mig'],
+                                       pos_attrs['x0'], pos_attrs['xf'], pos_attrs['y0'], pos_attrs['yf'],
+                                       pos_attrs['z0'], pos_attrs['zf']], [er, h_ant, x0, xf, y0, yf, z0, zf])
+                      and tuple(output_file['MigratedImage/Image'].shape) == (qx, qy, qz)
+                      and tuple(mig_attrs['Tile size']) == tuple(tile_size)
+                      and mig_attrs['Mode'] == mode and mig_attrs['Sampling'] == sampling
+                      and output_file.attrs['Aperture angle'] == (90.0 if max_angle is None else max_angle)
+                      and output_file.attrs['Aperture distance'] == (np.inf if max_distance is None else max_distance)
+                      and ('h' in output_file['Position']) == (heights is not None)
+                      and (heights is None or (pos_attrs['h_ant_step'] == height_step
+                                               and np.allclose(output_file['Position/h'][()], heights))))
+        except KeyError:
+            resume = False
+        if resume:
+            completed = int(np.sum(output_file['MigratedImage/Completed tiles'][()]))
+            print(f"Resuming migration with {completed} of {int(np.prod(grid))} tiles completed")
+            return output_file
+        output_file.close()
+        print(f"Migration file {output_file_name} does not match the migration parameters, starting over")
+    output_file = h5py.File(output_file_name, 'w')
+    write_migration_attributes(output_file, title, h_ant, er, x0, xf, qx, y0, yf, qy, z0, zf, qz, max_angle,
+                               max_distance, heights, height_step)
+    # A group to store the migrated image '/MigratedImage'
+    mig_grp = output_file.create_group('/MigratedImage')
+    mig_grp.attrs['Tile size'] = tile_size
+    mig_grp.attrs['Mode'] = mode
+    mig_grp.attrs['Sampling'] = sampling
+    # Migrated image is written block by block into a dataset chunked as the blocks
+    chunks = tuple(min(size, q) for q, size in zip((qx, qy, qz), tile_size))
+    mig_grp.create_dataset('Image', (qx, qy, qz), dtype='f4', chunks=chunks, compression="gzip")
+    # Blocks already written, used to resume an interrupted migration
+    mig_grp.create_dataset('Completed tiles', grid, dtype=bool)
+    output_file.flush()
+    return output_file
 
 
-def migrate_point_3d(c0, d_c_scan, er, h_ant, qx, qy, t, vp, x, xp, y, yp, zp):
-
-    theta_a_arr = np.zeros((len(x), len(y)))
-    theta_g_arr = np.zeros((len(x), len(y)))
-    for (l, m) in itertools.product(range(0, qx), range(0, qy)):
-        xa, ya = x[l], y[m]
-        theta_a, theta_g = transmission_angles_3d(er, h_ant, xp, yp, zp, xa, ya)
-        theta_a_arr[l, m] = theta_a
-        theta_g_arr[l, m] = theta_g
-    r = h_ant * (1 / np.cos(theta_a_arr)) + zp * (1 / np.cos(theta_g_arr))
-    t_e = 2 * (h_ant * (1 / np.cos(theta_a_arr)) / c0 + zp * (1 / np.cos(theta_g_arr)) / vp)
-    time_diff = np.tile(t, (qx, qy, 1)) - np.repeat(t_e[:, :, np.newaxis], len(t), axis=2)
-    coincidence_indexes = np.argmin(np.abs(time_diff), axis=2)
-    linear_indexes = np.ravel_multi_index([np.arange(0, len(x), 1), np.arange(0, len(y), 1), coincidence_indexes],
-                                          d_c_scan.shape)
-    squeezed_scan = np.matrix.flatten(d_c_scan)
-    kernel = np.reshape(np.cos(theta_a_arr) / r, (len(x), len(y))) * squeezed_scan[linear_indexes]
-    migrated_point = np.abs(np.trapz(kernel, x, axis=0))
-    migrated_point = np.abs(np.trapz(migrated_point, y, axis=0))
-    return migrated_point
-
-
-def kirchhoff_migration_2d(b_scan, h_ant, er, t0, tf, dt, x0, xf, qx, z0, zf):
-    """Algorithm for Kirchhoff 2D migration
+def kirchhoff_migration_tiled(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, output_file_name,
+                              title, tile_size, mode='2d', sampling='nearest', workers=None, filtered=False,
+                              max_angle=None, max_distance=None, plan=None, heights=None, height_step=HEIGHT_STEP,
+                              monitor=None):
+    """Algorithm for Kirchhoff 3D migration over blocks of voxels. Every block is written into the migrated image file
+    as soon as it is migrated, so the migrated image is never held in memory and an interrupted migration is resumed
+    from the blocks already written.
     Args:
-      conn (Pipe): Connection pipe with the calling function.
-      b_scan (nested-list float): Amplitudes of the B-Scan (should be pre-processed first).
+      c_scan_scalars (nested-list float): Amplitudes of the C-Scan (should be pre-processed first).
       h_ant (float): Height of the antennas from ground [m].
       er (float): Ground apparent relative permittivity.
       t0 (float): Initial time value [s].
       tf (float): Final time value [s].
       dt (float): Time step [s].
-      x0 (float): Initial horizontal axis value [m].
-      xf (float): Final horizontal axis value [m].
-      qx (float): Amount of values over the horizontal axis.
+      x0 (float): Initial x-axis value [m].
+      xf (float): Final x-axis value [m].
+      qx (float): Amount of values over the x-axis.
+      y0 (float): Initial y-axis value [m].
+      yf (float): Final y-axis value [m].
+      qy (float): Amount of values over the y-axis.
       z0 (float): Initial z-axis value [m].
       zf (float): Final z-axis value [m].
+      output_file_name (string): Path of the migrated image file.
+      title (string): Title for the migrated image file.
+      tile_size (tuple int): Maximum amount of voxels of a block over the x-, y- and z-axis.
+      mode (string): Migration mode ('2d' for two-pass 2D migrations or '3d' for full 3D migration).
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of worker processes (2d mode) or threads (3d mode) (all the available CPUs if not given).
+      filtered (bool): Whether the C-Scan was already filtered by half_derivative_2d (2d mode) or half_derivative_3d
+        (3d mode).
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      plan (MigrationPlan): Migration plan of a previous migration with the same geometry, only used by the 2d mode (it
+        is built if not given).
+      heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy) (h_ant for all
+        of them if not given).
+      height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
     """
     # Speed of light constant definition and calculation of propagation velocity in ground
     c0 = 3e8  # [m/s]
     vp = c0 / np.sqrt(er)  # [m/s]
     # Creation of time and space arrays
-    x = np.linspace(x0, xf, qx)
-    t = np.arange(t0, tf, dt)
-    if len(t) != len(b_scan[0]):
-        if len(t) > len(b_scan[0]):
-            t = np.arange(t0, tf - dt, dt)
-        else:
-            t = np.arange(t0, tf + dt, dt)
     z = np.arange(z0, zf, dt * vp)
-    # Calculate frequency domain array
-    fs = 1 / dt
-    f = np.linspace(-fs / 2, fs / 2, len(t))
-    # Calculate half-derivative term and its multiplication with the B-Scan
-    b_scan_f = np.fft.fftshift(np.fft.fft(b_scan, axis=0), axes=0)  # B-Scan in the frequency domain
-    half_der = np.tile(np.sqrt(1j * 2 * np.pi * f.T), (qx, 1))  # Half derivative term
-    d_b_scan = np.real(np.fft.ifft(np.fft.ifftshift(half_der * b_scan_f, axes=0), axis=0))  # Time domain expression
-    # Create empty array for angles and integration kernel
-    theta_a_arr = np.zeros((len(x), 1))
-    theta_g_arr = np.zeros((len(x), 1))
-    # Create empty matrix for the integral kernel
-    kernel = np.zeros((qx, qx, len(z)))
-    for i in range(0, qx):
-        xp = x[i]
-        for j in range(0, len(z)):
-            zp = z[j]
-            for k in range(0, qx):
-                # Calls the transmission angle function to find both the ground and air transmission angles
-                theta_a, theta_g = transmission_angles_2d(er, h_ant, xp, zp, x[k])
-                theta_a_arr[k] = theta_a
-                theta_g_arr[k] = theta_g
-                # Calculate kernel values
-            r = h_ant * (1 / np.cos(theta_a_arr)) + zp * (1 / np.cos(theta_g_arr))
-            t_e = 2 * (h_ant * (1 / np.cos(theta_a_arr)) / c0 + zp * (1 / np.cos(theta_g_arr)) / vp)
-            # Trace out hyperbola
-            time_diff = np.tile(t, (qx, 1)) - np.tile(t_e, (1, len(t)))
-            coincidence_indexes = np.argmin(np.abs(time_diff), axis=1)
-            linear_indexes = np.ravel_multi_index([np.arange(0, len(x), 1), coincidence_indexes], d_b_scan.shape)
-            squeezed_scan = np.matrix.flatten(d_b_scan)
-            kernel[:, i, j] = np.reshape(np.cos(theta_a_arr) / np.sqrt(vp*r), (len(x),)) * squeezed_scan[linear_indexes]
-    # Calculates the intrgral over the migration direction
-    migrated_image = np.abs(np.trapz(kernel, x, axis=0))
-    # Connects the pipe to the calculated migrated image
-    return migrated_image
+    qz = len(z)
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    output_file = open_tiled_migration_file(output_file_name, title, h_ant, er, x0, xf, qx, y0, yf, qy, z0, zf, qz,
+                                            tile_size, mode, sampling, max_angle, max_distance, heights,
+                                            height_step)
+    try:
+        image = output_file['MigratedImage/Image']
+        completed = output_file['MigratedImage/Completed tiles']
+        done = completed[()]
+        tiles = [tile for tile in migration_tiles(qx, qy, qz, tile_size) if not done[tile[0]]]
+        # Voxels of the blocks left to migrate
+        voxels = sum((x.stop - x.start) * (y.stop - y.start) * (z.stop - z.start) for _, x, y, z in tiles)
 
+        def write_tile(tile_index, x_slice, y_slice, z_slice, tile):
+            # The block is flushed to disk together with its completion mark. Blocks are written while others are
+            # migrated, so the time of the writes is also part of the summation
+            tic = time.perf_counter()
+            image[x_slice, y_slice, z_slice] = tile
+            completed[tile_index] = True
+            output_file.flush()
+            monitor.add_stage_time('write', time.perf_counter() - tic)
 
-def kirchhoff_migration_3d_parallel(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf):
-    """Algorithm for Kirchhoff 3D migration. Calls parallel 2D migrations.
+        if mode == "2d":
+            # Axes, filter and tables are built once for the whole C-Scan and shared by every block
+            with monitor.stage('tables'):
+                plan = migration_plan(plan, c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                      max_angle, max_distance, heights, height_step)
+            slices = {tile[0]: tile[1:] for tile in tiles}
+            shm, c_scan_shared = create_shared_array(np.shape(c_scan_scalars), plan.dtype)
+            try:
+                with monitor.stage('half-derivative'):
+                    c_scan_shared[:] = c_scan_scalars if filtered else plan.filter(c_scan_scalars)
+                shared_arrays = {'c_scan': (shm.name, c_scan_shared.shape, plan.dtype)}
+                processes = workers or os.cpu_count()
+                worker_args = (shared_arrays, plan, sampling, True)
+                with monitor.stage('summation'), POOL_CONTEXT.Pool(processes=processes,
+                                                                   initializer=init_shared_migration_worker,
+                                                                   initargs=worker_args) as pool:
+                    monitor.begin_work(len(tiles), 'tiles', voxels, processes)
+                    # Blocks are written by this process in the order they are finished by the workers
+                    for tile_index, tile, busy in pool.imap_unordered(migrate_shared_tile, tiles):
+                        write_tile(tile_index, *slices[tile_index], tile)
+                        monitor.advance(busy=busy)
+            finally:
+                del c_scan_shared
+                shm.close()
+                shm.unlink()
+        else:
+            # Filtered C-Scan and tables are calculated once and shared by every block
+            sampling_index = SAMPLING_MODES.index(sampling)
+            d_c_scan, weight_table, position_table, trace_bins, x_weights, y_weights, x_aperture, y_aperture = \
+                prepare_migration_3d(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, filtered,
+                                     max_angle, max_distance, heights, height_step, monitor)
+            if workers is not None:
+                set_num_threads(workers)
+            with monitor.stage('summation'):
+                monitor.begin_work(len(tiles), 'tiles', voxels, get_num_threads())
+                for tile_index, x_slice, y_slice, z_slice in tiles:
+                    tile = migrate_volume_3d(d_c_scan, weight_table, position_table, trace_bins, x_weights, y_weights,
+                                             np.arange(x_slice.start, x_slice.stop),
+                                             np.arange(y_slice.start, y_slice.stop),
+                                             np.arange(z_slice.start, z_slice.stop), x_aperture, y_aperture,
+                                             sampling_index, COLUMN_CHUNK_SIZE)
+                    write_tile(tile_index, x_slice, y_slice, z_slice, tile)
+                    monitor.advance()
+    finally:
+        output_file.close()
+    if own_monitor:
+        monitor.finish()
+    return qz
+
+
+def kirchhoff_migration_roi(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, box, mode='2d',
+                            sampling='nearest', workers=None, filtered=False, max_angle=None, max_distance=None,
+                            heights=None, height_step=HEIGHT_STEP, monitor=None):
+    """Algorithm for Kirchhoff 3D migration of a region of interest. Only the voxels inside the region are migrated, but
+    they are migrated from the whole C-Scan (or from the traces inside the aperture if it is limited).
     Args:
       c_scan_scalars (nested-list float): Amplitudes of the C-Scan (should be pre-processed first).
       h_ant (float): Height of the antennas from ground [m].
@@ -205,86 +1888,103 @@ def kirchhoff_migration_3d_parallel(c_scan_scalars, h_ant, er, t0, tf, dt, x0, x
       y0 (float): Initial y-axis value [m].
       yf (float): Final y-axis value [m].
       qy (float): Amount of values over the y-axis.
-      z0 (float): Initial z-axis value [m].
-      zf (float): Final z-axis value [m].
+      box (tuple float): Limits of the region of interest over the x-, y- and z-axis (x0, xf, y0, yf, z0, zf) [m].
+      mode (string): Migration mode ('2d' for two-pass 2D migrations or '3d' for full 3D migration).
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of worker processes (2d mode) or threads (3d mode) (all the available CPUs if not given).
+      filtered (bool): Whether the C-Scan was already filtered by half_derivative_3d (only used by the 3d mode).
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy) (h_ant for all
+        of them if not given).
+      height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
+    Returns:
+      migrated_image (float array): Migrated image amplitudes over the region of interest.
+      axes (tuple float array): x-, y- and z-axis of the migrated image.
     """
     # Speed of light constant definition and calculation of propagation velocity in ground
     c0 = 3e8  # [m/s]
     vp = c0 / np.sqrt(er)  # [m/s]
-    # Creation of time and space arrays
-    z = np.arange(z0, zf, dt * vp)
-    # Creates empty array for the migrated images
-    migrated_image_one = np.zeros([qx, qy, len(z)])
-    migrated_image_two = np.zeros([qx, qy, len(z)])
-    # == Timer start ==
-    tic = time.perf_counter()
-    #migrated_image_full = kirchhoff_migration_3d(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf)
-    # =================
-    # Creates empty lists for the processes and the pipes to be appended to (first migration direction)
-    pool = mp.Pool(processes=os.cpu_count())
-    processes = []
-    # Loops over all the positions of the x-axis
-    for i in range(0, qx):
-        print(f"Migrating over x-axis {i} of {qx-1}")
-        # Calls the migration function with the corresponding migration pipe and the corresponding plane of the C-Scan
-        result = pool.apply_async(kirchhoff_migration_2d,
-                       args=(c_scan_scalars[i, :, :], h_ant, er, t0, tf, dt, y0, yf, qy, z0, zf))
-    #     # Saves the process appending it to the processes list
-        processes.append(result)
-    for i in range(0, qx):
-        # Recovers the values in the communication pipes
-        migrated_image_one[i, :, :] = processes[i].get()
-        print(f"Finished migration over x-axis {i} of {qx-1}")
-    #     # Joins the processes to the main execution
-    #     #processes[i].join()
-    # # Creates empty lists for the processes and the pipes to be appended to (second migration direction)
-    processes = []
-    # # Loops over all the positions of the y-axis
-    for j in range(0, qy):
-        print(f"Migrating over y-axis {j} of {qy-1}")
-        # Creates the communication pipes
-        # Calls the migration function with the corresponding migration pipe and the corresponding plane of the C-Scan
-        result = pool.apply_async(kirchhoff_migration_2d,
-                       args=(c_scan_scalars[:, j, :], h_ant, er, t0, tf, dt, x0, xf, qx, z0, zf))
-    #     # Starts the process for migration
-    #     # p.start()
-        # Joins the processes to the main execution
-        processes.append(result)
-    for j in range(0, qy):
-        # Recovers the values in the communication pipes
-        migrated_image_two[:, j, :] = processes[j].get()
-        print(f"Finished migration over y-axis {j} of {qy-1}")
-    #     # Joins the processes to the main execution
-    # # Multiples the two migrated images to create the 3D migration
-    migrated_image_full = np.multiply(migrated_image_one, migrated_image_two)
-    # == Timer stop ===
-    toc = time.perf_counter()
-    print('Migration time:', toc - tic)
-    # =================
-    # Returns the migrated image and the length of the z-axis
-    return migrated_image_full, len(z)
+    # Creation of the space arrays. The region keeps the points of the C-Scan grid inside it and its own z-axis
+    x = np.linspace(x0, xf, qx)
+    y = np.linspace(y0, yf, qy)
+    tolerance = 1e-9  # [m]
+    x_indexes = np.nonzero((x >= box[0] - tolerance) & (x <= box[1] + tolerance))[0]
+    y_indexes = np.nonzero((y >= box[2] - tolerance) & (y <= box[3] + tolerance))[0]
+    z = np.arange(box[4], box[5], dt * vp)
+    if len(x_indexes) == 0 or len(y_indexes) == 0 or len(z) == 0:
+        raise Exception(f"The region of interest {tuple(box)} does not contain any point of the C-Scan grid")
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    voxels = len(x_indexes) * len(y_indexes) * len(z)
+    if mode == "2d":
+        # The plan is built once for the region and shared by every B-Scan crossing it
+        with monitor.stage('tables'):
+            plan = migration_plan(None, c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, box[4], box[5],
+                                  max_angle, max_distance, heights, height_step)
+        # The region is split in slabs of planes of fixed x which are migrated in parallel
+        processes = workers or os.cpu_count()
+        slabs = np.array_split(x_indexes, min(len(x_indexes), 4 * processes))
+        y_slice = slice(y_indexes[0], y_indexes[-1] + 1)
+        tiles = [(n, slice(slab[0], slab[-1] + 1), y_slice, slice(0, len(z))) for n, slab in enumerate(slabs)]
+        migrated_image = np.zeros((len(x_indexes), len(y_indexes), len(z)), dtype=plan.dtype)
+        shm, c_scan_shared = create_shared_array(np.shape(c_scan_scalars), plan.dtype)
+        try:
+            c_scan_shared[:] = c_scan_scalars
+            shared_arrays = {'c_scan': (shm.name, c_scan_shared.shape, plan.dtype)}
+            # Only the B-Scans crossing the region are filtered, by the workers
+            with monitor.stage('summation'), POOL_CONTEXT.Pool(processes=processes,
+                                                               initializer=init_shared_migration_worker,
+                                                               initargs=(shared_arrays, plan, sampling, False)) as pool:
+                monitor.begin_work(len(tiles), 'x-slabs', voxels, processes)
+                for n, tile, busy in pool.imap_unordered(migrate_shared_tile, tiles):
+                    start = tiles[n][1].start - x_indexes[0]
+                    migrated_image[start:start + tile.shape[0], :, :] = tile
+                    monitor.advance(busy=busy)
+        finally:
+            del c_scan_shared
+            shm.close()
+            shm.unlink()
+    else:
+        sampling_index = SAMPLING_MODES.index(sampling)
+        d_c_scan, weight_table, position_table, trace_bins, x_weights, y_weights, x_aperture, y_aperture = \
+            prepare_migration_3d(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, box[4], box[5],
+                                 filtered, max_angle, max_distance, heights, height_step, monitor)
+        if workers is not None:
+            set_num_threads(workers)
+        # The region is migrated slab by slab of planes of fixed x to report the progress
+        migrated_image = np.zeros((len(x_indexes), len(y_indexes), len(z)), dtype=d_c_scan.dtype)
+        slabs = np.array_split(np.arange(0, len(x_indexes)), min(len(x_indexes), PROGRESS_STEPS))
+        with monitor.stage('summation'):
+            monitor.begin_work(len(slabs), 'x-slabs', voxels, get_num_threads())
+            for slab in slabs:
+                migrated_image[slab[0]:slab[-1] + 1] = migrate_volume_3d(
+                    d_c_scan, weight_table, position_table, trace_bins, x_weights, y_weights, x_indexes[slab],
+                    y_indexes, np.arange(len(z)), x_aperture, y_aperture, sampling_index, COLUMN_CHUNK_SIZE)
+                monitor.advance()
+    if own_monitor:
+        monitor.finish()
+    return migrated_image, (x[x_indexes], y[y_indexes], z)
 
-def kirchhoff_migration_3d_new_parallel(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf):
-    c0 = 3e8  # [m/s]
-    vp = c0 / np.sqrt(er)  # [m/s]
-    # Creation of time and space arrays
-    z = np.arange(z0, zf, dt * vp)
-    tic = time.perf_counter()
-    migrated_image_full = kirchhoff_migration_3d(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf)
-    toc = time.perf_counter()
-    print('Migration time:', toc - tic)
-    # =================
-    # Returns the migrated image and the length of the z-axis
-    return migrated_image_full, len(z)
 
-def store_migration_file(folder, title, migrated_image, h_ant, er, x0, xf, qx, y0, yf, qy, z0, zf, qz):
-    """Stored the result of the 3D migrated image
+def kirchhoff_migration_multiresolution(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                        mode='2d', factor=4, threshold=ENERGY_THRESHOLD, sampling='nearest',
+                                        workers=None, max_angle=None, max_distance=None, heights=None,
+                                        height_step=HEIGHT_STEP, monitor=None):
+    """Algorithm for coarse-to-fine Kirchhoff 3D migration. A C-Scan decimated over the x- and y-axis is migrated first,
+    and only the regions where its migrated image has high energy are migrated again at full resolution. The rest of
+    the migrated image is the coarse migrated image repeated over the full grid.
     Args:
-      folder (string): Folder/directory where to store the migrated image
-      title (string): Title for the migrated image file
-      migrated image (nested-list float): Migrated image amplitudes.
+      c_scan_scalars (nested-list float): Amplitudes of the C-Scan (should be pre-processed first).
       h_ant (float): Height of the antennas from ground [m].
       er (float): Ground apparent relative permittivity.
+      t0 (float): Initial time value [s].
+      tf (float): Final time value [s].
+      dt (float): Time step [s].
       x0 (float): Initial x-axis value [m].
       xf (float): Final x-axis value [m].
       qx (float): Amount of values over the x-axis.
@@ -293,49 +1993,122 @@ def store_migration_file(folder, title, migrated_image, h_ant, er, x0, xf, qx, y
       qy (float): Amount of values over the y-axis.
       z0 (float): Initial z-axis value [m].
       zf (float): Final z-axis value [m].
-      qz (float): Amount of values over the z-axis.
+      mode (string): Migration mode ('2d' for two-pass 2D migrations or '3d' for full 3D migration).
+      factor (int): Decimation factor of the x- and y-axis of the coarse migration.
+      threshold (float): Fraction of the largest energy of the coarse migrated image above which its voxels are
+        refined.
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of threads used by the compiled kernels (all the available threads if not given).
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy) (h_ant for all
+        of them if not given).
+      height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
+    Returns:
+      migrated_image (float array): Migrated image amplitudes.
+      qz (int): Amount of values over the z-axis.
+      regions (list tuple slice): Slices over the x-, y- and z-axis of the regions migrated at full resolution.
     """
-    # Formats the output file name and creates the file
-    output_file_name = folder + '/' + title + '.h5'
-    output_file = h5py.File(output_file_name, 'w')
-    # Creates and populates attributes of the Micreated Image file
-    output_file.attrs['Title'] = title  # Title of the output file
-    output_file.attrs['Relative permittivity'] = er  # Relative permittivity used for migration
-    # Creates a group in the .h5 file to store the position of the measurement
-    pos_grp = output_file.create_group('/Position')
-    # Coordinates are stored in meters at the output file under the '/Position' group
-    pos_grp.attrs['x0'] = x0
-    pos_grp.attrs['y0'] = y0
-    pos_grp.attrs['z0'] = z0
-    pos_grp.attrs['xf'] = xf
-    pos_grp.attrs['yf'] = yf
-    pos_grp.attrs['zf'] = zf
-    pos_grp.attrs['qx'] = qx
-    pos_grp.attrs['qy'] = qy
-    pos_grp.attrs['qz'] = qz
-    # Height of the antena values are stored in data-set under '/Position' group
-    pos_grp.attrs['h_ant_mig'] = h_ant
-    # pos_grp.create_dataset('h', (qx, qy), dtype='f4', data=h_ant, compression="gzip")
-    # A group to store the migrated image '/MigratedImage'
-    mig_grp = output_file.create_group('/MigratedImage')
-    # Migrated image values are stored in data-set under the '/MigratedImage' group
-    mig_grp.create_dataset('Image', (qx, qy, qz), dtype='f4', data=migrated_image, compression="gzip")
-    # Output file is closed with all the information written in it
-    output_file.close()
+    if factor < 1:
+        raise Exception("The decimation factor of the multiresolution migration must be at least 1")
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    # The coarse grid keeps every factor-th trace of the C-Scan grid
+    x = np.linspace(x0, xf, qx)
+    y = np.linspace(y0, yf, qy)
+    x_coarse, y_coarse = x[::factor], y[::factor]
+    coarse_heights = None if heights is None else heights[::factor, ::factor]
+    coarse_c_scan = np.ascontiguousarray(np.asarray(c_scan_scalars)[::factor, ::factor, :])
+    if mode == "3d":
+        coarse_image = kirchhoff_migration_3d(coarse_c_scan, h_ant, er, t0, tf, dt, x_coarse[0], x_coarse[-1],
+                                              len(x_coarse), y_coarse[0], y_coarse[-1], len(y_coarse), z0, zf,
+                                              sampling, workers, max_angle=max_angle, max_distance=max_distance,
+                                              heights=coarse_heights, height_step=height_step, monitor=monitor)
+    else:
+        coarse_image = kirchhoff_migration_3d_batched(coarse_c_scan, h_ant, er, t0, tf, dt, x_coarse[0], x_coarse[-1],
+                                                      len(x_coarse), y_coarse[0], y_coarse[-1], len(y_coarse), z0, zf,
+                                                      sampling, workers, max_angle=max_angle,
+                                                      max_distance=max_distance, heights=coarse_heights,
+                                                      height_step=height_step, monitor=monitor)[0]
+    del coarse_c_scan
+    # High-energy voxels of the coarse image, grown by a coarse point and by factor depths so the regions cover the
+    # points between the coarse ones, are grouped in connected regions. The two-pass image is the product of two
+    # amplitudes, so it is already an energy, and the amplitudes of the full 3D image are squared
+    energy = coarse_image if mode == "2d" else np.square(coarse_image)
+    energetic = energy >= threshold * np.max(energy)
+    del energy
+    energetic = ndimage.binary_dilation(energetic, structure=np.ones((3, 3, 2 * factor + 1), dtype=bool))
+    qz = coarse_image.shape[2]
+    regions = []
+    for region in ndimage.find_objects(ndimage.label(energetic)[0]):
+        # Regions reaching the last coarse point also cover the points of the full grid after it
+        x_slice = slice(region[0].start * factor,
+                        qx if region[0].stop == len(x_coarse) else (region[0].stop - 1) * factor + 1)
+        y_slice = slice(region[1].start * factor,
+                        qy if region[1].stop == len(y_coarse) else (region[1].stop - 1) * factor + 1)
+        regions.append((x_slice, y_slice, region[2]))
+    # The coarse image is repeated from the nearest coarse point over the full grid and the regions are replaced by
+    # their full resolution migration
+    x_nearest = np.minimum(np.rint(np.arange(qx) / factor).astype(int), len(x_coarse) - 1)
+    y_nearest = np.minimum(np.rint(np.arange(qy) / factor).astype(int), len(y_coarse) - 1)
+    migrated_image = coarse_image[np.ix_(x_nearest, y_nearest)]
+    del coarse_image
+    voxels = sum((r[0].stop - r[0].start) * (r[1].stop - r[1].start) * (r[2].stop - r[2].start) for r in regions)
+    # The regions are reported as an event, and printed with the progress of a monitor printing to the console
+    monitor.emit('refinement', regions=len(regions), fraction=voxels / np.size(migrated_image))
+    if monitor.verbose:
+        print(f"Refining {len(regions)} regions at full resolution ({100 * voxels / np.size(migrated_image):.1f}% of "
+              f"the voxels)")
+    if mode == "3d":
+        d_c_scan, weight_table, position_table, trace_bins, x_weights, y_weights, x_aperture, y_aperture = \
+            prepare_migration_3d(c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                 max_angle=max_angle, max_distance=max_distance, heights=heights,
+                                 height_step=height_step, monitor=monitor)
+    else:
+        # A single full resolution plan is shared by all the regions
+        with monitor.stage('tables'):
+            plan = migration_plan(None, c_scan_scalars, h_ant, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                  max_angle, max_distance, heights, height_step)
+        with monitor.stage('half-derivative'):
+            d_c_scan = plan.filter(c_scan_scalars)
+        d_c_scan_y = np.swapaxes(d_c_scan, 0, 1)
+    with monitor.stage('summation'):
+        monitor.begin_work(len(regions), 'regions', voxels, get_num_threads())
+        for x_slice, y_slice, z_slice in regions:
+            x_indexes = np.arange(x_slice.start, x_slice.stop)
+            y_indexes = np.arange(y_slice.start, y_slice.stop)
+            if mode == "3d":
+                migrated_image[x_slice, y_slice, z_slice] = migrate_volume_3d(
+                    d_c_scan, weight_table, position_table, trace_bins, x_weights, y_weights, x_indexes, y_indexes,
+                    np.arange(z_slice.start, z_slice.stop), x_aperture, y_aperture, SAMPLING_MODES.index(sampling),
+                    COLUMN_CHUNK_SIZE)
+            else:
+                # Planes of fixed x crossing the region migrate along y over the region and vice versa
+                image_one = plan.migrate_lines('x', d_c_scan[x_slice], sampling, filtered=True, points=y_slice,
+                                               depths=z_slice, lines=x_indexes)
+                image_two = plan.migrate_lines('y', d_c_scan_y[y_slice], sampling, filtered=True, points=x_slice,
+                                               depths=z_slice, lines=y_indexes)
+                migrated_image[x_slice, y_slice, z_slice] = np.multiply(image_one, np.swapaxes(image_two, 0, 1))
+            monitor.advance()
+    if own_monitor:
+        monitor.finish()
+    return migrated_image, qz, regions
 
 
-def execute_migration(c_scan_file, title, er, pol, z0, zf, mode):
-    """Stored the result of the 3D migrated image
+def load_c_scan(c_scan_file, pol, dtype=np.float64):
+    """Reads the C-Scan of a merged file
     Args:
       c_scan_file (string): File with the C-Scan to be migrated.
-      title (string): Title for the migrated image file.
       pol (string): Polarization of antennas ('x' or 'y').
-      er (float): Ground apparent relative permittivity.
-      z0 (float): Initial z-axis value [m].
-      zf (float): Final z-axis value [m].
+      dtype (type): Type of the amplitudes of the C-Scan (np.float32 halves the memory used by the migration).
+    Returns:
+      tuple: Amplitudes of the C-Scan, mean height of the antennas, time axis (t0, tf, dt) and x- and y-axis
+        (x0, xf, qx, y0, yf, qy).
     """
-    # Reads the folder of the file, this folder will be used to store the migrated image
-    folder = os.path.dirname(c_scan_file)
     # Merged file is opened into data_frame variable
     data_frame = h5py.File(c_scan_file, 'r')
     # Time-domain lower and upper limits are retrieved
@@ -361,12 +2134,11 @@ def execute_migration(c_scan_file, title, er, pol, z0, zf, mode):
         h_attr_flag = True
     else:
         h_attr_flag = False
-    print(f"Antenna height: {ha} m")
     # Amount of steps over each axis is calculated. Operation rounds up the division result as needed
     qx = int(round((xf - x0) / dx + 1))
     qy = int(round((yf - y0) / dy + 1))
     # Initializes C-Scan matrix
-    c_scan_scalars = np.zeros([qx, qy, qt])
+    c_scan_scalars = np.zeros([qx, qy, qt], dtype=dtype)
     if pol.lower() == "x":
         if not h_attr_flag:
             ha = data_frame['Position/h x-pol']
@@ -391,13 +2163,499 @@ def execute_migration(c_scan_file, title, er, pol, z0, zf, mode):
             c_scan_scalars[count, :, :] = data_frame['A-Scan/Re{A-Scan y-pol}'][index_0:index_f][:]
     # Closes the .h5 file
     data_frame.close()
+    print(f"Antenna height: {ha} m")
+    return c_scan_scalars, ha, t0, tf, dt, x0, xf, qx, y0, yf, qy
+
+
+def load_frequency_c_scan(c_scan_file, pol, dtype=np.float64):
+    """Reads the C-Scan of S21 spectra of a merged frequency-domain file
+    Args:
+      c_scan_file (string): File with the C-Scan to be migrated.
+      pol (string): Polarization of antennas ('x' or 'y').
+      dtype (type): Type of the real and imaginary parts of the spectra (np.float32 halves the memory used by the
+        migration).
+    Returns:
+      tuple: Spectra of the C-Scan, mean height of the antennas, frequency axis (f, df) and x- and y-axis
+        (x0, xf, qx, y0, yf, qy).
+    """
+    # Merged file is opened into data_frame variable
+    data_frame = h5py.File(c_scan_file, 'r')
+    if 'Frequency' not in data_frame.keys():
+        data_frame.close()
+        raise Exception(f"{c_scan_file} is not a frequency-domain file")
+    # Frequency-domain lower and upper limits are retrieved
+    f0 = data_frame['Frequency'].attrs['f0']
+    ff = data_frame['Frequency'].attrs['ff']
+    df = data_frame['Frequency'].attrs['df']
+    qf = int(round(data_frame['Frequency'].attrs['q']))
+    # x- and y-axis lower limits, upper limits and step are retrieved
+    x0 = data_frame['Position'].attrs['x0']
+    dx = data_frame['Position'].attrs['dx']
+    xf = data_frame['Position'].attrs['xf']
+    y0 = data_frame['Position'].attrs['y0']
+    dy = data_frame['Position'].attrs['dy']
+    yf = data_frame['Position'].attrs['yf']
+    p = pol.lower()
+    # The antenna height from ground is the mean of the heights of the traces if it is not a single value
+    if 'h' in data_frame['Position'].attrs.keys():
+        ha = np.mean(data_frame['Position'].attrs['h'])
+    else:
+        ha = np.mean(data_frame[f'Position/h {p}-pol'])
+    # Amount of steps over each axis is calculated. Operation rounds up the division result as needed
+    qx = int(round((xf - x0) / dx + 1))
+    qy = int(round((yf - y0) / dy + 1))
+    # Initializes C-Scan matrix of complex spectra
+    spectra = np.zeros([qx, qy, qf], dtype=np.result_type(dtype, np.complex64))
+    for count in range(0, qx):
+        # Indexes used to retrieve individual planes of the C-Scan are calculated
+        index_0 = count * qy
+        index_f = (count + 1) * qy
+        # Real and imaginary parts of the spectra are retrieved from the merged file
+        spectra[count, :, :].real = data_frame[f'A-Scan/Re{{S21 {p}-pol}}'][index_0:index_f][:]
+        spectra[count, :, :].imag = data_frame[f'A-Scan/Im{{S21 {p}-pol}}'][index_0:index_f][:]
+    # Closes the .h5 file
+    data_frame.close()
+    f = np.linspace(f0, ff, qf)
+    print(f"Antenna height: {ha} m")
+    return spectra, ha, f, df, x0, xf, qx, y0, yf, qy
+
+
+def load_antenna_heights(c_scan_file, pol, qx, qy):
+    """Reads the height of the antennas of every trace of a merged file
+    Args:
+      c_scan_file (string): File with the C-Scan to be migrated.
+      pol (string): Polarization of antennas ('x' or 'y').
+      qx (int): Amount of values over the x-axis.
+      qy (int): Amount of values over the y-axis.
+    Returns:
+      heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy), or None if the
+        file only has a single height for all the traces.
+    """
+    data_frame = h5py.File(c_scan_file, 'r')
+    if 'h' in data_frame['Position'].attrs.keys():
+        heights = np.asarray(data_frame['Position'].attrs['h'], dtype=float)
+    elif pol.lower() == "x":
+        heights = np.asarray(data_frame['Position/h x-pol'][()], dtype=float)
+    else:
+        heights = np.asarray(data_frame['Position/h y-pol'][()], dtype=float)
+    data_frame.close()
+    if heights.size != qx * qy:
+        return None
+    # Heights are stored in the order of the A-Scans (the planes of fixed x one after the other)
+    return np.reshape(heights, (qx, qy))
+
+
+def antenna_heights(c_scan_file, pol, qx, qy, mode, height_step=None):
+    """Selects the antenna heights of the traces used by a migration
+    Args:
+      c_scan_file (string): File with the C-Scan to be migrated.
+      pol (string): Polarization of antennas ('x' or 'y').
+      qx (int): Amount of values over the x-axis.
+      qy (int): Amount of values over the y-axis.
+      mode (string): Migration mode. Only the Kirchhoff modes ('2d' and '3d') migrate every trace with its own height.
+      height_step (float): Height step between the bins the heights of the traces are grouped in [m].
+    Returns:
+      heights (float array): Height of the antennas from ground of every trace [m] with shape (qx, qy), or None if all
+        the traces are migrated with the mean height.
+    """
+    if height_step is None or mode not in ('2d', '3d'):
+        return None
+    heights = load_antenna_heights(c_scan_file, pol, qx, qy)
+    if heights is None:
+        print("The file has a single antenna height, all the traces are migrated with it")
+    else:
+        print(f"Antenna heights: {np.min(heights)} - {np.max(heights)} m, grouped in "
+              f"{len(height_bins(0, (qx, qy), heights, height_step)[0])} bins of {height_step} m")
+    return heights
+
+
+def execute_migration(c_scan_file, title, er, pol, z0, zf, mode, sampling='nearest', workers=None, tile_size=None,
+                      layers=None, max_angle=None, max_distance=None, engine='direct', max_frequency=None,
+                      precision='float64', height_step=None, multiresolution=None, energy_threshold=ENERGY_THRESHOLD,
+                      monitor=None, processes=False):
+    """Stored the result of the 3D migrated image
+    Args:
+      c_scan_file (string): File with the C-Scan to be migrated.
+      title (string): Title for the migrated image file.
+      pol (string): Polarization of antennas ('x' or 'y').
+      er (float): Ground apparent relative permittivity.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      mode (string): Migration mode ('2d' for two-pass 2D migrations, '3d' for full 3D migration, 'fk' for
+        frequency-wavenumber (Stolt) migration, 'ps' for phase-shift migration over a layered ground or 'fd' for
+        two-pass back-projections of the S21 spectra of a frequency-domain file). The 2d mode is migrated by the
+        compiled threads of kirchhoff_migration_3d_batched unless processes is given.
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of threads (2d, 3d and fk modes) or worker processes (tiled 2d mode and processes) (all the
+        available CPUs if not given).
+      tile_size (tuple int): Maximum amount of voxels over the x-, y- and z-axis of the blocks written to the migrated
+        image file by a tiled migration (the whole image is migrated in memory if not given). Not available in the
+        fk and ps modes.
+      layers (tuple): Permittivities and thicknesses [m] of the layers of the ground used by the ps mode (as given by
+        layer_parameter_estimation). A homogeneous ground with permittivity er is used if not given.
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given). Only used by the 2d, 3d and fd modes.
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+        Only used by the 2d, 3d and fd modes.
+      engine (string): Engine of the sum over the antennas of the 2d mode (one of ENGINES).
+      max_frequency (float): Highest frequency of the traces used by the fft engine [Hz] (all of them if not given).
+      precision (string): Precision of the C-Scan, tables and sums of the 2d, 3d and fd modes ('float64' or
+        'float32').
+      height_step (float): Height step between the bins the antenna heights of the traces are grouped in [m]. Each
+        trace is migrated with its own height if given, otherwise all of them are migrated with the mean height. Only
+        used by the 2d and 3d modes.
+      multiresolution (int): Decimation factor of the coarse migration of a coarse-to-fine migration, which only
+        migrates the high-energy regions of the coarse migration at full resolution (the whole image is migrated at
+        full resolution if not given). Only used by the 2d and 3d modes without tiles.
+      energy_threshold (float): Fraction of the largest energy of the coarse migration above which its voxels are
+        migrated at full resolution.
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
+      processes (bool): Whether the B-Scans of the 2d mode are migrated by worker processes sharing the C-Scan in
+        memory (kirchhoff_migration_3d_parallel). Only used by the 2d mode with the direct engine, without tiles or
+        multiresolution.
+    """
+    # Reads the folder of the file, this folder will be used to store the migrated image
+    folder = os.path.dirname(c_scan_file)
+    # Single precision is only used by the Kirchhoff modes
+    dtype = np.float32 if precision == 'float32' and mode in ('2d', '3d', 'fd') else np.float64
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    monitor.start(title, c_scan_file=c_scan_file, er=er, pol=pol, z0=z0, zf=zf, mode=mode, sampling=sampling,
+                  workers=workers, tile_size=tile_size, max_angle=max_angle, max_distance=max_distance, engine=engine,
+                  max_frequency=max_frequency, precision=precision, height_step=height_step,
+                  multiresolution=multiresolution, energy_threshold=energy_threshold, processes=processes)
+    # The fd mode migrates the spectra of a frequency-domain file without calculating its traces
+    if mode == "fd":
+        if tile_size is not None:
+            raise Exception("Tiled migration is not available for the fd mode")
+        with monitor.stage('load'):
+            spectra, ha, f, df, x0, xf, qx, y0, yf, qy = load_frequency_c_scan(c_scan_file, pol, dtype)
+        mi, qz = kirchhoff_migration_frequency(spectra, f, df, ha, er, x0, xf, qx, y0, yf, qy, z0, zf,
+                                               max_angle=max_angle, max_distance=max_distance, monitor=monitor)
+        del spectra
+        with monitor.stage('write'):
+            store_migration_file(folder, title, mi, ha, er, x0, xf, qx, y0, yf, qy, z0, zf, qz, max_angle,
+                                 max_distance)
+            output_file = h5py.File(folder + '/' + title + '.h5', 'a')
+            output_file.attrs['Domain'] = 'frequency'
+            output_file.close()
+        if own_monitor:
+            monitor.finish()
+        return
+    with monitor.stage('load'):
+        c_scan_scalars, ha, t0, tf, dt, x0, xf, qx, y0, yf, qy = load_c_scan(c_scan_file, pol, dtype)
+        heights = antenna_heights(c_scan_file, pol, qx, qy, mode, height_step)
+    regions = None
+    # Tiled migrations write the migrated image straight into the output file
+    if tile_size is not None:
+        if mode in ("fk", "ps"):
+            raise Exception(f"Tiled migration is not available for the {mode} mode")
+        kirchhoff_migration_tiled(c_scan_scalars, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                  folder + '/' + title + '.h5', title, tuple(tile_size), mode, sampling, workers,
+                                  max_angle=max_angle, max_distance=max_distance, heights=heights,
+                                  height_step=height_step, monitor=monitor)
+        if own_monitor:
+            monitor.finish()
+        return
     # Calls the migration function and stores the obtained migrated image
-    if mode == "2d":
-        mi, qz = kirchhoff_migration_3d_parallel(c_scan_scalars, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf)
+    if multiresolution is not None and mode in ("2d", "3d"):
+        mi, qz, regions = kirchhoff_migration_multiresolution(c_scan_scalars, ha, er, t0, tf, dt, x0, xf, qx, y0, yf,
+                                                              qy, z0, zf, mode, multiresolution, energy_threshold,
+                                                              sampling, workers, max_angle, max_distance, heights,
+                                                              height_step, monitor)
+    elif mode == "2d" and processes:
+        mi, qz = kirchhoff_migration_3d_parallel(c_scan_scalars, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                                 sampling, workers, max_angle=max_angle, max_distance=max_distance,
+                                                 heights=heights, height_step=height_step, monitor=monitor)
+    elif mode == "2d":
+        mi, qz = kirchhoff_migration_3d_batched(c_scan_scalars, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                                sampling, workers, max_angle=max_angle, max_distance=max_distance,
+                                                engine=engine, max_frequency=max_frequency, heights=heights,
+                                                height_step=height_step, monitor=monitor)
+    elif mode == "fk":
+        mi, qz = stolt_migration_3d(c_scan_scalars, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, workers=workers,
+                                    monitor=monitor)
+        max_angle = max_distance = None
+    elif mode == "ps":
+        if layers is None:
+            layers = ([er], [])
+        permittivities, thicknesses = layers
+        mi, qz = phase_shift_migration_3d(c_scan_scalars, ha, permittivities, thicknesses, t0, tf, dt, x0, xf, qx, y0,
+                                          yf, qy, z0, zf, monitor=monitor)
+        # The z-axis of the migrated image is sampled as in the first layer
+        er = permittivities[0]
+        max_angle = max_distance = None
     else:
-        mi, qz = kirchhoff_migration_3d_new_parallel(c_scan_scalars, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf)
+        mi, qz = kirchhoff_migration_3d_new_parallel(c_scan_scalars, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                                     sampling, workers, max_angle=max_angle, max_distance=max_distance,
+                                                     heights=heights, height_step=height_step, monitor=monitor)
     # Stores the obtained migrated image
-    store_migration_file(folder, title, mi, ha, er, x0, xf, qx, y0, yf, qy, z0, zf, qz)
+    with monitor.stage('write'):
+        store_migration_file(folder, title, mi, ha, er, x0, xf, qx, y0, yf, qy, z0, zf, qz, max_angle, max_distance,
+                             heights, height_step)
+        if mode == "ps":
+            # Layers of the ground used for the migration
+            output_file = h5py.File(folder + '/' + title + '.h5', 'a')
+            output_file.attrs['Layer permittivities'] = np.asarray(layers[0], dtype=float)
+            output_file.attrs['Layer thicknesses'] = np.asarray(layers[1], dtype=float)
+            output_file.close()
+        if regions is not None:
+            # Regions migrated at full resolution, as [x start, x end, y start, y end, z start, z end) indexes
+            output_file = h5py.File(folder + '/' + title + '.h5', 'a')
+            output_file.attrs['Multiresolution factor'] = multiresolution
+            output_file.attrs['Energy threshold'] = energy_threshold
+            bounds = [[index for s in region for index in (s.start, s.stop)] for region in regions]
+            output_file['MigratedImage'].create_dataset('Refined regions', data=np.reshape(bounds, (-1, 6)).astype(int))
+            output_file.close()
+    if own_monitor:
+        monitor.finish()
+
+
+def focusing_metrics(migrated_image):
+    """Calculates focusing metrics of a migrated image, used to compare migrations with different permittivities
+    Args:
+      migrated_image (float array): Migrated image amplitudes.
+    Returns:
+      entropy (float): Entropy of the normalized energy of the voxels (lower for a better focused image).
+      sharpness (float): Sum of the squared normalized energies of the voxels (higher for a better focused image).
+    """
+    energy = np.square(np.asarray(migrated_image, dtype=np.float64)).ravel()
+    total = np.sum(energy)
+    if total == 0:
+        return np.nan, np.nan
+    p = energy / total
+    p = p[p > 0]
+    entropy = -np.sum(p * np.log(p))
+    sharpness = np.sum(np.square(p))
+    return entropy, sharpness
+
+
+def execute_migration_sweep(c_scan_file, title, er_list, pol, z0, zf, mode, sampling='nearest', workers=None,
+                            max_angle=None, max_distance=None, engine='direct', max_frequency=None,
+                            precision='float64', height_step=None, monitor=None):
+    """Migrates a C-Scan for several permittivities. The C-Scan is read and filtered once for all of them and a migrated
+    image file is stored for each permittivity with its focusing metrics.
+    Args:
+      c_scan_file (string): File with the C-Scan to be migrated.
+      title (string): Title for the migrated image files (the permittivity is appended to it).
+      er_list (list float): Ground apparent relative permittivities.
+      pol (string): Polarization of antennas ('x' or 'y').
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      mode (string): Migration mode ('2d' for two-pass 2D migrations, '3d' for full 3D migration, 'fk' for
+        frequency-wavenumber (Stolt) migration or 'ps' for phase-shift migration over a homogeneous ground).
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of threads (all the available CPUs if not given).
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given). Only used by the 2d and 3d modes.
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+        Only used by the 2d and 3d modes.
+      engine (string): Engine of the sum over the antennas of the 2d mode (one of ENGINES).
+      max_frequency (float): Highest frequency of the traces used by the fft engine [Hz] (all of them if not given).
+      precision (string): Precision of the C-Scan, tables and sums of the 2d and 3d modes ('float64' or 'float32').
+      height_step (float): Height step between the bins the antenna heights of the traces are grouped in [m]. Each
+        trace is migrated with its own height if given, otherwise all of them are migrated with the mean height. Only
+        used by the 2d and 3d modes.
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
+    Returns:
+      list: Permittivity, entropy and sharpness of every migrated image.
+    """
+    # Reads the folder of the file, this folder will be used to store the migrated images
+    folder = os.path.dirname(c_scan_file)
+    # Single precision is only used by the Kirchhoff modes
+    dtype = np.float32 if precision == 'float32' and mode in ('2d', '3d') else np.float64
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    monitor.start(title, c_scan_file=c_scan_file, er_list=list(er_list), pol=pol, z0=z0, zf=zf, mode=mode,
+                  sampling=sampling, workers=workers, max_angle=max_angle, max_distance=max_distance, engine=engine,
+                  max_frequency=max_frequency, precision=precision, height_step=height_step)
+    with monitor.stage('load'):
+        c_scan_scalars, ha, t0, tf, dt, x0, xf, qx, y0, yf, qy = load_c_scan(c_scan_file, pol, dtype)
+        heights = antenna_heights(c_scan_file, pol, qx, qy, mode, height_step)
+    # The half-derivative filter does not depend on the permittivity, so it is applied once for the whole sweep
+    with monitor.stage('half-derivative'):
+        if mode == "2d":
+            d_c_scan = half_derivative_2d(c_scan_scalars, dt)
+        elif mode in ("fk", "ps"):
+            d_c_scan = c_scan_scalars
+            max_angle = max_distance = None
+        else:
+            d_c_scan = half_derivative_3d(c_scan_scalars, dt)
+    del c_scan_scalars
+    results = []
+    for er in er_list:
+        print(f"Migrating with e_r: {er}")
+        if mode == "2d":
+            mi, qz = kirchhoff_migration_3d_batched(d_c_scan, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                                    sampling, workers, filtered=True, max_angle=max_angle,
+                                                    max_distance=max_distance, engine=engine,
+                                                    max_frequency=max_frequency, heights=heights,
+                                                    height_step=height_step, monitor=monitor)
+        elif mode == "fk":
+            mi, qz = stolt_migration_3d(d_c_scan, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf, workers=workers,
+                                        monitor=monitor)
+        elif mode == "ps":
+            mi, qz = phase_shift_migration_3d(d_c_scan, ha, [er], [], t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                              monitor=monitor)
+        else:
+            mi, qz = kirchhoff_migration_3d_new_parallel(d_c_scan, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, z0, zf,
+                                                         sampling, workers, filtered=True, max_angle=max_angle,
+                                                         max_distance=max_distance, heights=heights,
+                                                         height_step=height_step, monitor=monitor)
+        entropy, sharpness = focusing_metrics(mi)
+        # Stores the obtained migrated image together with its focusing metrics
+        er_title = f"{title}_er_{er:g}"
+        with monitor.stage('write'):
+            store_migration_file(folder, er_title, mi, ha, er, x0, xf, qx, y0, yf, qy, z0, zf, qz, max_angle,
+                                 max_distance, heights, height_step)
+            output_file = h5py.File(folder + '/' + er_title + '.h5', 'a')
+            output_file['MigratedImage'].attrs['Entropy'] = entropy
+            output_file['MigratedImage'].attrs['Sharpness'] = sharpness
+            output_file.close()
+        results.append((er, entropy, sharpness))
+        del mi
+    # Summary of the sweep, the best focused image has the lowest entropy
+    print("e_r\tentropy\tsharpness")
+    for er, entropy, sharpness in results:
+        print(f"{er:g}\t{entropy:.6g}\t{sharpness:.6g}")
+    best = min(results, key=lambda result: result[1])
+    print(f"Best focused image (lowest entropy) e_r: {best[0]:g}")
+    if own_monitor:
+        monitor.finish()
+    return results
+
+
+def execute_migration_polarizations(c_scan_file, title, er, z0, zf, mode, fusion='sum', sampling='nearest',
+                                    workers=None, max_angle=None, max_distance=None, engine='direct',
+                                    max_frequency=None, precision='float64', height_step=None, monitor=None):
+    """Migrates both polarizations of a C-Scan in a single pass and stores their migrated images and the fused image in
+    one file. The fused image is stored as the migrated image of the file, and the image of each polarization under
+    'Image x-pol' and 'Image y-pol'. Both polarizations share the tables, so they are migrated with the mean height of
+    the antennas of both of them (or the mean of both heights of every trace).
+    Args:
+      c_scan_file (string): File with the C-Scan to be migrated.
+      title (string): Title for the migrated image file.
+      er (float): Ground apparent relative permittivity.
+      z0 (float): Initial z-axis value [m].
+      zf (float): Final z-axis value [m].
+      mode (string): Migration mode ('2d' for two-pass 2D migrations or '3d' for full 3D migration).
+      fusion (string): Method used to fuse the migrated images of both polarizations (one of FUSION_METHODS).
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of threads (all the available CPUs if not given).
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      engine (string): Engine of the sum over the antennas of the 2d mode (one of ENGINES).
+      max_frequency (float): Highest frequency of the traces used by the fft engine [Hz] (all of them if not given).
+      precision (string): Precision of the C-Scans, tables and sums ('float64' or 'float32').
+      height_step (float): Height step between the bins the antenna heights of the traces are grouped in [m]. Each
+        trace is migrated with its own height if given, otherwise all of them are migrated with the mean height.
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
+    """
+    if mode not in ('2d', '3d'):
+        raise Exception(f"Dual-polarization migration is not available for the {mode} mode")
+    # Reads the folder of the file, this folder will be used to store the migrated image
+    folder = os.path.dirname(c_scan_file)
+    dtype = np.float32 if precision == 'float32' else np.float64
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    monitor.start(title, c_scan_file=c_scan_file, er=er, pol='xy', z0=z0, zf=zf, mode=mode, fusion=fusion,
+                  sampling=sampling, workers=workers, max_angle=max_angle, max_distance=max_distance, engine=engine,
+                  max_frequency=max_frequency, precision=precision, height_step=height_step)
+    with monitor.stage('load'):
+        c_scan_x, ha_x, t0, tf, dt, x0, xf, qx, y0, yf, qy = load_c_scan(c_scan_file, 'x', dtype)
+        c_scan_y, ha_y = load_c_scan(c_scan_file, 'y', dtype)[:2]
+        ha = (ha_x + ha_y) / 2
+        heights = antenna_heights(c_scan_file, 'x', qx, qy, mode, height_step)
+        if heights is not None:
+            heights = (heights + antenna_heights(c_scan_file, 'y', qx, qy, mode, height_step)) / 2
+    migrated_images, qz = kirchhoff_migration_polarizations([c_scan_x, c_scan_y], ha, er, t0, tf, dt, x0, xf, qx, y0,
+                                                            yf, qy, z0, zf, mode, sampling, workers, max_angle,
+                                                            max_distance, engine, max_frequency, heights,
+                                                            height_step, monitor)
+    del c_scan_x, c_scan_y
+    mi = fuse_polarizations(migrated_images, fusion)
+    # Stores the fused image as the migrated image and the image of each polarization next to it
+    with monitor.stage('write'):
+        store_migration_file(folder, title, mi, ha, er, x0, xf, qx, y0, yf, qy, z0, zf, qz, max_angle, max_distance,
+                             heights, height_step)
+        output_file = h5py.File(folder + '/' + title + '.h5', 'a')
+        output_file.attrs['Polarization'] = 'xy'
+        output_file.attrs['Fusion'] = fusion
+        for pol, migrated_image in zip(('x', 'y'), migrated_images):
+            output_file['MigratedImage'].create_dataset(f"Image {pol}-pol", (qx, qy, qz), dtype='f4',
+                                                        data=migrated_image, compression="gzip")
+        output_file.close()
+    if own_monitor:
+        monitor.finish()
+
+
+def execute_migration_roi(c_scan_file, title, boxes, er, pol, mode, sampling='nearest', workers=None, max_angle=None,
+                          max_distance=None, precision='float64', height_step=None, monitor=None):
+    """Migrates regions of interest of a C-Scan. The C-Scan is read once and the migrated image of each region is stored
+    in its own file, cropped to the region.
+    Args:
+      c_scan_file (string): File with the C-Scan to be migrated.
+      title (string): Title for the migrated image files (the index of the region is appended to it).
+      boxes (list tuple float): Limits of each region of interest over the x-, y- and z-axis (x0, xf, y0, yf, z0, zf)
+        [m].
+      er (float): Ground apparent relative permittivity.
+      pol (string): Polarization of antennas ('x' or 'y').
+      mode (string): Migration mode ('2d' for two-pass 2D migrations or '3d' for full 3D migration).
+      sampling (string): Method used to sample the traces at the travel times (one of SAMPLING_MODES).
+      workers (int): Amount of worker processes (2d mode) or threads (3d mode) (all the available CPUs if not given).
+      max_angle (float): Maximum transmission angle in air of the traces summed for a point [deg] (no limit if not
+        given).
+      max_distance (float): Maximum lateral distance of the traces summed for a point [m] (no limit if not given).
+      precision (string): Precision of the C-Scan, tables and sums ('float64' or 'float32').
+      height_step (float): Height step between the bins the antenna heights of the traces are grouped in [m]. Each
+        trace is migrated with its own height if given, otherwise all of them are migrated with the mean height.
+      monitor (MigrationMonitor): Monitor of the progress and timing of the migration (a monitor printing to the
+        console is used if not given).
+    """
+    # Reads the folder of the file, this folder will be used to store the migrated images
+    folder = os.path.dirname(c_scan_file)
+    # Single precision is only used by the Kirchhoff modes
+    dtype = np.float32 if precision == 'float32' and mode in ('2d', '3d') else np.float64
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = MigrationMonitor()
+    monitor.start(title, c_scan_file=c_scan_file, boxes=[list(box) for box in boxes], er=er, pol=pol, mode=mode,
+                  sampling=sampling, workers=workers, max_angle=max_angle, max_distance=max_distance,
+                  precision=precision, height_step=height_step)
+    with monitor.stage('load'):
+        c_scan_scalars, ha, t0, tf, dt, x0, xf, qx, y0, yf, qy = load_c_scan(c_scan_file, pol, dtype)
+        heights = antenna_heights(c_scan_file, pol, qx, qy, mode, height_step)
+    # The half-derivative filter of the 3d mode is applied to the whole C-Scan, so it is applied once for all the
+    # regions. The 2d mode filters each B-Scan as it is migrated
+    filtered = mode != "2d"
+    if filtered:
+        with monitor.stage('half-derivative'):
+            c_scan_scalars = half_derivative_3d(c_scan_scalars, dt)
+    for n, box in enumerate(boxes):
+        print(f"Migrating region of interest {n}: x {box[0]} - {box[1]} m, y {box[2]} - {box[3]} m, "
+              f"z {box[4]} - {box[5]} m")
+        mi, (x, y, z) = kirchhoff_migration_roi(c_scan_scalars, ha, er, t0, tf, dt, x0, xf, qx, y0, yf, qy, box, mode,
+                                                sampling, workers, filtered, max_angle, max_distance, heights,
+                                                height_step, monitor)
+        # Heights of the traces inside the region, stored with the migrated image of the region
+        roi_heights = None
+        if heights is not None:
+            x_indexes = np.nonzero(np.isin(np.linspace(x0, xf, qx), x))[0]
+            y_indexes = np.nonzero(np.isin(np.linspace(y0, yf, qy), y))[0]
+            roi_heights = heights[np.ix_(x_indexes, y_indexes)]
+        # Stores the migrated image of the region with the limits of its grid
+        with monitor.stage('write'):
+            store_migration_file(folder, f"{title}_roi_{n}", mi, ha, er, x[0], x[-1], len(x), y[0], y[-1], len(y),
+                                 box[4], box[5], len(z), max_angle, max_distance, roi_heights, height_step)
+    if own_monitor:
+        monitor.finish()
 
 
 if __name__ == '__main__':
@@ -405,12 +2663,92 @@ if __name__ == '__main__':
     parser.add_argument('filepath', type=str, help='filepath of h5 file')
     parser.add_argument('output', type=str, help="title of migration")
     parser.add_argument('--er', default=2.58, type=float, help="relative permittivity of the ground")
-    parser.add_argument('--polarization', default='x', type=str, choices=['x', 'y'], help="polarization")
+    parser.add_argument('--er-list', default=None, type=float, nargs='+',
+                        help="migrate for several relative permittivities, reading and filtering the C-Scan once")
+    parser.add_argument('--polarization', default='x', type=str, choices=['x', 'y', 'xy'],
+                        help="polarization ('xy' migrates both of them in a single pass, 2d and 3d modes)")
+    parser.add_argument('--fusion', default='sum', type=str, choices=FUSION_METHODS,
+                        help="fusion of the migrated images of both polarizations (xy polarization)")
     parser.add_argument('--z_ini', default=0.00, type=float, help="start height")
     parser.add_argument('--z_end', default=0.60, type=float, help="end height")
-    parser.add_argument('--mode', default='2d', type=str, choices=['2d', '3d'], help="mode")
+    parser.add_argument('--mode', default='2d', type=str, choices=['2d', '3d', 'fk', 'ps', 'fd'],
+                        help="mode (fd migrates the S21 spectra of a frequency-domain file)")
+    parser.add_argument('--layer-er', default=None, type=float, nargs='+',
+                        help="relative permittivity of each layer of the ground, from top to bottom (ps mode)")
+    parser.add_argument('--layer-thickness', default=None, type=float, nargs='+',
+                        help="thickness of each layer of the ground except the last one (ps mode)")
+    parser.add_argument('--sampling', default='nearest', type=str, choices=SAMPLING_MODES,
+                        help="sampling of the traces at the travel times")
+    parser.add_argument('--engine', default='direct', type=str, choices=ENGINES,
+                        help="engine of the sum over the antennas (2d mode)")
+    parser.add_argument('--max-frequency', default=None, type=float,
+                        help="highest frequency of the traces used by the fft engine in Hz")
+    parser.add_argument('--precision', default='float64', type=str, choices=['float64', 'float32'],
+                        help="precision of the migration (2d and 3d modes), float32 halves the memory")
+    parser.add_argument('--workers', default=None, type=int,
+                        help="threads, or worker processes of the tiled and roi 2d mode and of --processes")
+    parser.add_argument('--processes', action='store_true',
+                        help="migrate the B-Scans of the 2d mode in worker processes sharing the C-Scan in memory "
+                             "instead of the compiled threads")
+    parser.add_argument('--aperture-angle', default=None, type=float,
+                        help="maximum transmission angle in air of the summed traces in degrees (2d and 3d modes)")
+    parser.add_argument('--aperture-distance', default=None, type=float,
+                        help="maximum lateral distance of the summed traces in meters (2d and 3d modes)")
+    parser.add_argument('--roi', default=None, type=float, nargs=6, action='append',
+                        metavar=('X0', 'XF', 'Y0', 'YF', 'Z0', 'ZF'),
+                        help="migrate only a region of interest, stored in its own file (can be repeated)")
+    parser.add_argument('--tile-size', default=None, type=int, nargs=3, metavar=('X', 'Y', 'Z'),
+                        help="migrate by blocks of voxels written to the output file (resumes interrupted migrations)")
+    parser.add_argument('--multiresolution', default=None, type=int, metavar='FACTOR',
+                        help="migrate a C-Scan decimated by this factor first and only the high-energy regions at full "
+                             "resolution (2d and 3d modes)")
+    parser.add_argument('--energy-threshold', default=ENERGY_THRESHOLD, type=float,
+                        help="fraction of the largest energy of the coarse migration refined by --multiresolution")
+    parser.add_argument('--log', default=None, type=str, metavar='FILE',
+                        help="append the progress and timing events of the migration to this JSON lines file")
+    parser.add_argument('--height-step', default=None, type=float, metavar='STEP',
+                        help="migrate every trace with its own antenna height, grouping the heights in bins of this "
+                             "step in m (2d and 3d modes, the mean height is used if not given)")
 
     args = parser.parse_args()
+    if args.er_list is not None and args.tile_size is not None:
+        parser.error("--er-list can not be combined with --tile-size")
+    if args.roi is not None and (args.er_list is not None or args.tile_size is not None or
+                                 args.mode not in ('2d', '3d')):
+        parser.error("--roi is only available in the 2d and 3d modes and can not be combined with --er-list or "
+                     "--tile-size")
+    if args.mode in ('fk', 'ps') and args.tile_size is not None:
+        parser.error(f"--tile-size is not available in the {args.mode} mode")
+    if args.mode in ('fk', 'ps') and (args.aperture_angle is not None or args.aperture_distance is not None):
+        parser.error(f"the aperture is not available in the {args.mode} mode")
+    if args.height_step is not None and (args.mode in ('fk', 'ps') or args.height_step <= 0):
+        parser.error("--height-step must be positive and is only available in the 2d and 3d modes")
+    if args.precision == 'float32' and args.mode in ('fk', 'ps'):
+        parser.error(f"--precision float32 is not available in the {args.mode} mode")
+    if args.engine == 'fft' and (args.mode != '2d' or args.tile_size is not None or args.roi is not None):
+        parser.error("the fft engine is only available in the 2d mode without --tile-size or --roi")
+    if args.polarization == 'xy' and (args.mode not in ('2d', '3d') or args.er_list is not None or
+                                      args.roi is not None or args.tile_size is not None):
+        parser.error("the xy polarization is only available in the 2d and 3d modes and can not be combined with "
+                     "--er-list, --roi or --tile-size")
+    if args.multiresolution is not None and (args.mode not in ('2d', '3d') or args.multiresolution < 1 or
+                                             args.engine == 'fft' or args.polarization == 'xy' or
+                                             args.er_list is not None or args.roi is not None or
+                                             args.tile_size is not None):
+        parser.error("--multiresolution must be at least 1, is only available in the 2d and 3d modes with the direct "
+                     "engine and can not be combined with the xy polarization, --er-list, --roi or --tile-size")
+    if args.mode == 'fd' and (args.er_list is not None or args.polarization == 'xy' or args.height_step is not None or
+                              args.multiresolution is not None or args.tile_size is not None):
+        parser.error("the fd mode can not be combined with --er-list, the xy polarization, --height-step, "
+                     "--multiresolution or --tile-size")
+    if args.processes and (args.mode != '2d' or args.engine == 'fft' or args.polarization == 'xy' or
+                           args.er_list is not None or args.roi is not None or args.tile_size is not None or
+                           args.multiresolution is not None):
+        parser.error("--processes is only available in the 2d mode with the direct engine and can not be combined "
+                     "with the xy polarization, --er-list, --roi, --tile-size or --multiresolution")
+    if (args.layer_er is None) != (args.layer_thickness is None) or \
+            (args.layer_er is not None and len(args.layer_thickness) < len(args.layer_er) - 1):
+        parser.error("--layer-er and --layer-thickness must give the thickness of every layer but the last one")
 
     file = args.filepath
     title = args.output
@@ -419,6 +2757,28 @@ if __name__ == '__main__':
     z_ini = args.z_ini
     z_end = args.z_end
     mode = args.mode
-    print(f"Starting migration e_r: {er}, pol: {pol}, z_ini: {z_ini}, z_end: {z_end}, mode: {mode}")
+    sampling = args.sampling
+    workers = args.workers
+    tile_size = args.tile_size
+    layers = None if args.layer_er is None else (args.layer_er, args.layer_thickness)
+    monitor = MigrationMonitor(log_file=args.log)
+    print(f"Starting migration e_r: {er if args.er_list is None else args.er_list}, pol: {pol}, z_ini: {z_ini}, "
+          f"z_end: {z_end}, mode: {mode}, sampling: {sampling}")
 
-    execute_migration(file, title, er, pol, z_ini, z_end, mode)
+    if pol == 'xy':
+        execute_migration_polarizations(file, title, er, z_ini, z_end, mode, args.fusion, sampling, workers,
+                                        args.aperture_angle, args.aperture_distance, args.engine, args.max_frequency,
+                                        args.precision, args.height_step, monitor)
+    elif args.roi is not None:
+        execute_migration_roi(file, title, args.roi, er, pol, mode, sampling, workers, args.aperture_angle,
+                              args.aperture_distance, args.precision, args.height_step, monitor)
+    elif args.er_list is not None:
+        execute_migration_sweep(file, title, args.er_list, pol, z_ini, z_end, mode, sampling, workers,
+                                args.aperture_angle, args.aperture_distance, args.engine, args.max_frequency,
+                                args.precision, args.height_step, monitor)
+    else:
+        execute_migration(file, title, er, pol, z_ini, z_end, mode, sampling, workers, tile_size, layers,
+                          args.aperture_angle, args.aperture_distance, args.engine, args.max_frequency,
+                          args.precision, args.height_step, args.multiresolution, args.energy_threshold, monitor,
+                          args.processes)
+    monitor.finish()
@@ -0,0 +1,163 @@
+import os
+import sys
+
+import h5py
+import numpy as np
+from scipy.integrate import trapezoid
+
+# The migration scripts import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parallel_kirchhoff_migration as pkm  # noqa: E402
+from migration_monitor import MigrationMonitor  # noqa: E402
+
+# Geometry of the synthetic C-Scans [m, s]
+H_ANT = 0.1
+ER = 4.0
+DT = 1e-10
+QT = 120
+T0, TF = 0, QT * DT
+Z0, ZF = 0, 0.06
+
+
+def synthetic_c_scan(qx, qy, seed=0):
+    """Random C-Scan with the time axis of the tests"""
+    return np.random.default_rng(seed).normal(size=(qx, qy, QT))
+
+
+def test_migration_plan_end_to_end():
+    qx, qy = 6, 5
+    x0, xf, y0, yf = 0, 0.2, 0, 0.16
+    c_scan = synthetic_c_scan(qx, qy)
+    plan = pkm.MigrationPlan(H_ANT, ER, T0, TF, DT, x0, xf, qx, y0, yf, qy, QT, Z0, ZF)
+    # Two-pass migration with the plan, B-Scan by B-Scan
+    image_one = np.stack([plan.migrate_line('x', c_scan[i, :, :]) for i in range(qx)])
+    image_two = np.stack([plan.migrate_line('y', c_scan[:, j, :]) for j in range(qy)], axis=1)
+    migrated_image = image_one * image_two
+    assert migrated_image.shape == (qx, qy, len(plan.z))
+    # Same B-Scans migrated without the plan
+    for i in range(qx):
+        b_scan = pkm.kirchhoff_migration_2d(c_scan[i, :, :], H_ANT, ER, T0, TF, DT, y0, yf, qy, Z0, ZF)
+        np.testing.assert_allclose(image_one[i], b_scan, rtol=1e-12, atol=0)
+    # The plan is reused by the compiled and the multi-process migrations
+    batched, qz = pkm.kirchhoff_migration_3d_batched(c_scan, H_ANT, ER, T0, TF, DT, x0, xf, qx, y0, yf, qy, Z0, ZF,
+                                                     plan=plan, monitor=MigrationMonitor(verbose=False))
+    parallel, _ = pkm.kirchhoff_migration_3d_parallel(c_scan, H_ANT, ER, T0, TF, DT, x0, xf, qx, y0, yf, qy, Z0, ZF,
+                                                      workers=2, plan=plan, monitor=MigrationMonitor(verbose=False))
+    assert qz == len(plan.z)
+    np.testing.assert_allclose(batched, migrated_image, rtol=1e-10, atol=0)
+    np.testing.assert_allclose(parallel, migrated_image, rtol=1e-12, atol=0)
+
+
+def test_incremental_migration_matches_batched():
+    qx, qy = 7, 6
+    x0, xf, y0, yf = 0, 0.24, 0, 0.2
+    c_scan = synthetic_c_scan(qx, qy, seed=1)
+    plan = pkm.MigrationPlan(H_ANT, ER, T0, TF, DT, x0, xf, qx, y0, yf, qy, QT, Z0, ZF)
+    batched, _ = pkm.kirchhoff_migration_3d_batched(c_scan, H_ANT, ER, T0, TF, DT, x0, xf, qx, y0, yf, qy, Z0, ZF,
+                                                    plan=plan, monitor=MigrationMonitor(verbose=False))
+    order = np.random.default_rng(2).permutation(max(qx, qy))
+    for line_axis, n_lines in (('x', qx), ('y', qy)):
+        migration = pkm.IncrementalMigration(plan, line_axis=line_axis)
+        for index in order[order < n_lines]:
+            b_scan = c_scan[index, :, :] if line_axis == 'x' else c_scan[:, index, :]
+            changed = migration.add_line(index, b_scan)
+            # Only the points within the aperture of the new line change
+            assert changed.start <= index < changed.stop
+        assert migration.complete()
+        np.testing.assert_allclose(migration.image(), batched, rtol=1e-10, atol=1e-12 * np.abs(batched).max())
+
+
+def test_multiresolution_refines_the_whole_grid():
+    # The last coarse point of both axes (x=18, y=15) is before the end of the grid
+    qx, qy, factor = 21, 17, 3
+    x0, xf, y0, yf = 0, 0.4, 0, 0.32
+    c_scan = synthetic_c_scan(qx, qy, seed=3)
+    full_image = pkm.kirchhoff_migration_3d(c_scan, H_ANT, ER, T0, TF, DT, x0, xf, qx, y0, yf, qy, Z0, ZF,
+                                            monitor=MigrationMonitor(verbose=False))
+    # With no energy threshold every voxel is refined
+    migrated_image, qz, regions = pkm.kirchhoff_migration_multiresolution(
+        c_scan, H_ANT, ER, T0, TF, DT, x0, xf, qx, y0, yf, qy, Z0, ZF, mode='3d', factor=factor, threshold=0,
+        monitor=MigrationMonitor(verbose=False))
+    assert regions == [(slice(0, qx), slice(0, qy), slice(0, qz))]
+    np.testing.assert_array_equal(migrated_image, full_image)
+
+
+def test_multiresolution_reports_the_regions_to_the_monitor(capsys):
+    qx, qy = 9, 7
+    c_scan = synthetic_c_scan(qx, qy, seed=4)
+    events = []
+    monitor = MigrationMonitor(callbacks=[events.append], verbose=False)
+    _, _, regions = pkm.kirchhoff_migration_multiresolution(c_scan, H_ANT, ER, T0, TF, DT, 0, 0.16, qx, 0, 0.12, qy,
+                                                            Z0, ZF, factor=2, monitor=monitor)
+    refinements = [event for event in events if event['event'] == 'refinement']
+    assert len(refinements) == 1 and refinements[0]['regions'] == len(regions)
+    assert 0 < refinements[0]['fraction'] <= 1
+    # A monitor that does not print to the console keeps the migration silent
+    assert capsys.readouterr().out == ''
+
+
+def test_shared_tile_keeps_the_plan_precision():
+    qx, qy = 6, 5
+    x0, xf, y0, yf = 0, 0.2, 0, 0.16
+    c_scan = synthetic_c_scan(qx, qy, seed=5).astype(np.float32)
+    plan = pkm.MigrationPlan(H_ANT, ER, T0, TF, DT, x0, xf, qx, y0, yf, qy, QT, Z0, ZF, dtype=np.float32)
+    shm, c_scan_shared = pkm.create_shared_array(c_scan.shape, plan.dtype)
+    try:
+        c_scan_shared[:] = c_scan
+        # The worker state is attached in this process
+        pkm.init_shared_migration_worker({'c_scan': (shm.name, c_scan.shape, plan.dtype)}, plan, 'nearest', False)
+        x_slice, y_slice, z_slice = slice(1, 4), slice(2, 5), slice(0, len(plan.z))
+        _, tile, _ = pkm.migrate_shared_tile(((0, 0, 0), x_slice, y_slice, z_slice))
+    finally:
+        pkm._worker_state.clear()
+        shm.close()
+        shm.unlink()
+    assert tile.dtype == np.float32
+    migrated_image, _ = pkm.kirchhoff_migration_3d_batched(c_scan, H_ANT, ER, T0, TF, DT, x0, xf, qx, y0, yf, qy, Z0,
+                                                           ZF, plan=plan, monitor=MigrationMonitor(verbose=False))
+    np.testing.assert_allclose(tile, migrated_image[x_slice, y_slice, z_slice], rtol=1e-4,
+                               atol=1e-6 * np.abs(migrated_image).max())
+
+
+def test_trapezoid_weights_match_scipy():
+    x = np.cumsum(np.random.default_rng(6).uniform(0.01, 0.05, size=9))
+    samples = synthetic_c_scan(9, 4, seed=6)
+    np.testing.assert_allclose(pkm.trapezoid_weights(x) @ samples.reshape(9, -1),
+                               trapezoid(samples, x, axis=0).reshape(-1), rtol=1e-12)
+    assert not np.any(pkm.trapezoid_weights(x[:1]))
+
+
+def test_migration_2d_without_np_trapz(monkeypatch):
+    # np.trapz was removed in NumPy 2.0
+    monkeypatch.delattr(np, 'trapz', raising=False)
+    qx, qy = 6, 5
+    c_scan = synthetic_c_scan(qx, qy, seed=7)
+    plan = pkm.MigrationPlan(H_ANT, ER, T0, TF, DT, 0, 0.2, qx, 0, 0.16, qy, QT, Z0, ZF)
+    b_scan = pkm.kirchhoff_migration_2d(c_scan[2], H_ANT, ER, T0, TF, DT, 0, 0.16, qy, Z0, ZF)
+    # The compiled kernel integrates with trapezoid_weights
+    np.testing.assert_allclose(b_scan, plan.migrate_lines('x', c_scan[2:3])[0], rtol=1e-10)
+
+
+def test_cli_2d_drivers_agree(tmp_path):
+    qx, qy = 5, 4
+    x0, xf, y0, yf = 0, 0.16, 0, 0.12
+    c_scan = synthetic_c_scan(qx, qy, seed=5)
+    heights = H_ANT + np.random.default_rng(6).uniform(-0.01, 0.01, size=qx * qy)
+    # Merged file with one height per A-Scan, stored plane of fixed x after plane of fixed x
+    c_scan_file = str(tmp_path / 'c_scan.h5')
+    with h5py.File(c_scan_file, 'w') as data_frame:
+        data_frame.create_group('Time').attrs.update({'t0': T0, 'tf': TF, 'dt': DT, 'q': QT})
+        data_frame.create_group('Position').attrs.update({'x0': x0, 'dx': (xf - x0) / (qx - 1), 'xf': xf, 'y0': y0,
+                                                           'dy': (yf - y0) / (qy - 1), 'yf': yf, 'h': heights})
+        data_frame.create_dataset('A-Scan/Re{A-Scan x-pol}', data=np.reshape(c_scan, (qx * qy, QT)))
+    # The CLI migrates the 2d mode with the compiled threads unless --processes is given
+    images = []
+    for title, processes, workers in (('threads', False, None), ('processes', True, 2)):
+        pkm.execute_migration(c_scan_file, title, ER, 'x', Z0, ZF, '2d', workers=workers, height_step=0.005,
+                              monitor=MigrationMonitor(verbose=False), processes=processes)
+        with h5py.File(str(tmp_path / (title + '.h5')), 'r') as output_file:
+            images.append(output_file['MigratedImage/Image'][()])
+    assert np.any(images[0] != 0)
+    # Images are stored in single precision
+    np.testing.assert_allclose(images[1], images[0], rtol=1e-5, atol=0)